@@ -7,6 +7,7 @@ For more information on this file, see
 https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 """
 
+import atexit
 import os
 
 from django.core.asgi import get_asgi_application
@@ -14,3 +15,10 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
 
 application = get_asgi_application()
+
+# Imported once Django is set up by get_asgi_application().
+from core.metrics import mark_process_dead  # noqa: E402
+from recipe.async_views import route_async_reads  # noqa: E402
+
+application = route_async_reads(application)
+atexit.register(mark_process_dead)
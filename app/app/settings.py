@@ -44,6 +44,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'core',
     'rest_framework',
     'drf_spectacular',
@@ -54,11 +55,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its total covers the other middleware too.
+    'core.metrics.RequestMetricsMiddleware',
+    'core.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.db.routers.PrimaryPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -89,15 +94,78 @@ WSGI_APPLICATION = 'app.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        # Django's PostgreSQL backend plus health checks and a pool limit.
+        'ENGINE': 'core.db.backends.postgresql',
         'NAME': os.environ.get('DB_NAME', 'recipe_db'),
         'USER': os.environ.get('DB_USER', 'postgres'),
         'PASSWORD': os.environ.get('DB_PASSWORD', 'postgres'),
         'HOST': os.environ.get('DB_HOST', 'localhost'),
         'PORT': os.environ.get('DB_PORT', '5432'),
+        # Reuse connections across requests, checking them before reuse.
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        # Open connections per process (one per thread using the DB) and
+        # how long a thread waits for one.
+        'POOL_SIZE': int(os.environ.get('DB_POOL_SIZE', 8)),
+        'POOL_TIMEOUT': 10,
+        'OPTIONS': {
+            'connect_timeout': 5,
+            # Notice a dead server (e.g. after a failover) within ~1 minute.
+            'keepalives': 1,
+            'keepalives_idle': 30,
+            'keepalives_interval': 10,
+            'keepalives_count': 3,
+        },
+    }
+}
+
+# Read replicas, e.g. DB_REPLICA_HOSTS=replica-a,replica-b. Without any,
+# "replica1" points at the primary's server but is not used for reads;
+# tests give it a database of its own to check the routing.
+REPLICA_HOSTS = [host for host in os.environ.get('DB_REPLICA_HOSTS', '').split(',') if host]
+for number, host in enumerate(REPLICA_HOSTS or [DATABASES['default']['HOST']], 1):
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'TEST': {'NAME': f'test_recipe_db_replica{number}'},
+    }
+DATABASE_REPLICAS = [f'replica{number}' for number in range(1, len(REPLICA_HOSTS) + 1)]
+DATABASE_ROUTERS = ['core.db.routers.ReplicaRouter']
+# How long a user reads from the primary after a write.
+DATABASE_REPLICA_PIN_SECONDS = int(os.environ.get('DB_REPLICA_PIN_SECONDS', 10))
+
+
+# Cache
+# Local memory by default; point CACHE_BACKEND/CACHE_LOCATION at a shared
+# cache (e.g. memcached) in production so all workers see the same data.
+# Cached recipe lists, tokens, login limits and replica pins depend on
+# that: `manage.py check --deploy` reports a process-local backend as an
+# error (core.checks).
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
     }
 }
 
+RECIPE_CACHE_ALIAS = 'default'
+RECIPE_CACHE_TIMEOUT = int(os.environ.get('RECIPE_CACHE_TIMEOUT', 300))
+
+# Resolved auth tokens: shared cache TTL and per-process LRU size.
+TOKEN_CACHE_ALIAS = 'default'
+TOKEN_CACHE_TIMEOUT = int(os.environ.get('TOKEN_CACHE_TIMEOUT', 300))
+TOKEN_CACHE_LOCAL_SIZE = 1024
+
+# Threads (and so DB connections) per process behind the async endpoints.
+ASYNC_DB_THREADS = int(os.environ.get('ASYNC_DB_THREADS', 8))
+
+# Password attempts per (attempts, window seconds), checked before hashing.
+LOGIN_RATE_LIMITS = {'ip': (20, 60), 'email': (5, 300)}
+LOGIN_RATE_LIMIT_STORE = 'core.ratelimit.CacheRateStore'
+LOGIN_RATE_LIMIT_CACHE_ALIAS = 'default'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -140,6 +208,21 @@ MEDIA_URL = '/static/media/'
 MEDIA_ROOT ='/vol/web/media'
 STATIC_ROOT ='/vol/web/static'
 
+# Store recipe images under their SHA-256 so identical uploads share a file.
+RECIPE_IMAGE_CONTENT_ADDRESSED = bool(
+    int(os.environ.get('RECIPE_IMAGE_CONTENT_ADDRESSED', 1)))
+
+# Resumable uploads: the largest image accepted and the largest chunk
+# per PATCH, which bounds how long one request holds a worker.
+RECIPE_IMAGE_UPLOAD_MAX_BYTES = 20 * 1024 * 1024
+RECIPE_IMAGE_UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+# On-demand resized images: allowed widths and the size cap of the LRU
+# disk cache kept under MEDIA_ROOT/cache/resized.
+RECIPE_IMAGE_RESIZE_WIDTHS = (64, 128, 256, 320, 480, 640, 960, 1280)
+RECIPE_IMAGE_CACHE_MAX_BYTES = int(
+    os.environ.get('RECIPE_IMAGE_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -150,12 +233,31 @@ AUTH_USER_MODEL = 'core.User'
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'core.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ],
+    # Reverse proxies in front of the app. Client IPs (e.g. for the login
+    # rate limits) are taken from X-Forwarded-For only this many hops
+    # deep; with 0 the header is ignored and REMOTE_ADDR is used.
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', 0)),
 }
 
+# Bearer token required by the /metrics endpoint, which is refused
+# (403) while it is unset.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Request profiles (see core.profiling) are written here, e.g.
+# /vol/web/profiles; empty (the default) disables profiling. Staff trigger
+# it with a token from `manage.py profile_token --email`, valid for
+# PROFILE_TOKEN_MAX_AGE seconds, or sample a share of requests. Only the
+# newest PROFILE_MAX_COUNT profiles are kept.
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '')
+PROFILE_MAX_COUNT = int(os.environ.get('PROFILE_MAX_COUNT', 100))
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', 0.005))
+PROFILE_TOKEN_MAX_AGE = int(os.environ.get('PROFILE_TOKEN_MAX_AGE', 3600))
+
 SPECTACULAR_SETTINGS =  {
     'TITLE': 'Recipe API',
     'DESCRIPTION': 'API for managing recipes',
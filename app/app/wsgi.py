@@ -14,3 +14,12 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
 
 application = get_wsgi_application()
+
+try:
+    import uwsgi
+except ImportError:
+    # Not running under uwsgi.
+    pass
+else:
+    from core.metrics import mark_process_dead
+    uwsgi.atexit = mark_process_dead
@@ -0,0 +1,157 @@
+"""Token authentication that skips the database for known tokens.
+
+Resolved tokens are kept in the shared cache for ``TOKEN_CACHE_TIMEOUT``
+seconds and, in front of it, in a small per-process LRU. Every token also
+has a version in the shared cache, replaced whenever the token must stop
+working. Cached entries are only trusted while their version is current,
+so a revocation takes effect at once in every process. Any change to a
+user other than ``last_login`` revokes their tokens (see core.signals).
+
+Entries hold only ``USER_FIELDS`` of the user, never the password hash,
+and each request gets a user and token rebuilt from them. The user's
+other fields are deferred: they load from the database when read.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication
+
+TOKEN_KEY = 'auth:token:{digest}'
+VERSION_KEY = 'auth:token-version:{digest}'
+# What authentication and permission checks read from ``request.user``.
+USER_FIELDS = ['id', 'is_active', 'is_staff', 'is_superuser']
+
+
+def get_cache():
+    return caches[getattr(settings, 'TOKEN_CACHE_ALIAS', 'default')]
+
+
+def _timeout():
+    return getattr(settings, 'TOKEN_CACHE_TIMEOUT', 300)
+
+
+def _digest(key):
+    # Token keys are credentials: keep them out of cache keys.
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _fresh_version():
+    # Never reuses a version, even after the backend evicts the key.
+    return time.time_ns()
+
+
+def _entry(user, token, version):
+    fields = {name: getattr(user, name) for name in USER_FIELDS}
+    return fields, token.created, version
+
+
+def _from_db(model, fields):
+    # from_db() takes the values in field order; the rest are deferred.
+    names = [field.attname for field in model._meta.concrete_fields
+             if field.attname in fields]
+    return model.from_db(None, names, [fields[name] for name in names])
+
+
+def _rebuild(token_model, key, entry):
+    # New instances per request: requests may mutate the user they are
+    # handed (e.g. ManageUserView), and the entry must not change.
+    fields, created = entry[:2]
+    user = _from_db(get_user_model(), fields)
+    token = _from_db(token_model,
+                     {'key': key, 'user_id': user.pk, 'created': created})
+    token.user = user
+    return user, token
+
+
+class LocalTokenCache:
+    """Thread-safe LRU of ``digest -> (fields, created, version, expires)``."""
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, digest):
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is None:
+                return None
+            if entry[3] < time.monotonic():
+                del self.entries[digest]
+                return None
+            self.entries.move_to_end(digest)
+            return entry
+
+    def set(self, digest, fields, created, version):
+        with self.lock:
+            self.entries[digest] = (fields, created, version,
+                                    time.monotonic() + _timeout())
+            self.entries.move_to_end(digest)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def discard(self, digest):
+        with self.lock:
+            self.entries.pop(digest, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+local_tokens = LocalTokenCache(
+    getattr(settings, 'TOKEN_CACHE_LOCAL_SIZE', 1024))
+
+
+def invalidate_tokens(keys):
+    """Make the given token keys stop authenticating from cache at once."""
+    cache = get_cache()
+    digests = [_digest(key) for key in keys]
+    cache.set_many(
+        {VERSION_KEY.format(digest=d): _fresh_version() for d in digests},
+        timeout=None)
+    cache.delete_many([TOKEN_KEY.format(digest=d) for d in digests])
+    for digest in digests:
+        local_tokens.discard(digest)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """``TokenAuthentication`` with a per-process LRU and a shared cache.
+
+    A token found in either cache is authenticated without a database
+    query; only a miss falls back to the ``Token`` + ``User`` lookup.
+    """
+
+    def authenticate_credentials(self, key):
+        cache = get_cache()
+        digest = _digest(key)
+        token_key = TOKEN_KEY.format(digest=digest)
+        version_key = VERSION_KEY.format(digest=digest)
+
+        entry = local_tokens.get(digest)
+        if entry is not None and cache.get(version_key) == entry[2]:
+            return _rebuild(self.get_model(), key, entry)
+
+        values = cache.get_many([token_key, version_key])
+        version = values.get(version_key)
+        entry = values.get(token_key)
+        if entry is not None and entry[2] == version:
+            local_tokens.set(digest, *entry)
+            return _rebuild(self.get_model(), key, entry)
+
+        if version is None:
+            cache.add(version_key, _fresh_version(), timeout=None)
+            version = cache.get(version_key)
+        # The version was read before the query: if the token is revoked
+        # meanwhile, the entry stored below is already stale and ignored.
+        user, token = super().authenticate_credentials(key)
+        entry = _entry(user, token, version)
+        cache.set(token_key, entry, _timeout())
+        local_tokens.set(digest, *entry)
+        return user, token
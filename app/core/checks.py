@@ -0,0 +1,48 @@
+"""System checks for settings that break once there are several workers.
+
+uwsgi and uvicorn run two or more worker processes. Cached state that
+must be consistent across requests only works if every worker sees it,
+so the caches holding it must be shared, e.g. memcached. A process-local
+backend is fine for a single process such as runserver or the tests, so
+this is a deployment check: ``manage.py check --deploy`` (run by
+scripts/run.sh before the server starts) reports it as an error.
+"""
+
+from django.conf import settings
+from django.core.checks import Error, register
+
+PROCESS_LOCAL_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+# (setting naming a cache alias, what breaks if the cache is not shared)
+SHARED_CACHES = [
+    ('RECIPE_CACHE_ALIAS',
+     'cached recipe lists would stay stale on other workers, which would '
+     'also answer 304 for data changed elsewhere'),
+    ('TOKEN_CACHE_ALIAS',
+     'revoked tokens would keep authenticating on other workers'),
+    ('LOGIN_RATE_LIMIT_CACHE_ALIAS',
+     'every worker would allow the full login rate'),
+    ('DATABASE_REPLICA_PIN_CACHE',
+     'users could read stale replica data right after a write handled by '
+     'another worker'),
+]
+
+
+@register(deploy=True)
+def check_shared_caches(app_configs, **kwargs):
+    """Report caches holding shared state that each worker keeps to itself."""
+    errors = []
+    for setting, consequence in SHARED_CACHES:
+        alias = getattr(settings, setting, 'default')
+        backend = settings.CACHES[alias]['BACKEND']
+        if backend in PROCESS_LOCAL_CACHES:
+            errors.append(Error(
+                f'CACHES[{alias!r}] ({setting}) uses {backend}, which every '
+                f'worker process keeps to itself: {consequence}.',
+                hint='Point CACHE_BACKEND and CACHE_LOCATION at memcached.',
+                id='core.E001',
+            ))
+    return errors
@@ -0,0 +1,2 @@
+"""PostgreSQL backend with connection health checks and a per-process pool
+limit."""
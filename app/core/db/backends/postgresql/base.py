@@ -0,0 +1,182 @@
+"""PostgreSQL backend with persistent-connection health checks and pool limits.
+
+Use ``'ENGINE': 'core.db.backends.postgresql'`` together with
+``CONN_MAX_AGE`` so connections outlive a request. On top of Django's
+backend this adds, per database alias:
+
+- ``CONN_HEALTH_CHECKS``: the first use of a reused connection in a
+  request runs ``SELECT 1``; a connection broken, e.g. by a failover, is
+  discarded and replaced instead of failing the request.
+- ``POOL_SIZE`` / ``POOL_TIMEOUT``: at most ``POOL_SIZE`` connections are
+  open per process (each thread holds its own); a thread waits up to
+  ``POOL_TIMEOUT`` seconds for a slot. A thread that exits without
+  closing its connection (runserver and other thread-per-request
+  servers) has it closed and its slot returned as the thread ends.
+- Connect time, pool wait and reuse counters, see ``pool_stats()``.
+"""
+
+import threading
+import time
+import weakref
+
+from django.db.backends.postgresql import base
+from django.db.utils import OperationalError
+from django.utils.asyncio import async_unsafe
+
+_pools = {}
+_pools_lock = threading.Lock()
+# One object per thread and alias, freed when the thread exits.
+_thread_guards = threading.local()
+
+
+class Pool:
+    """Per-process connection slots and metrics for one database alias."""
+
+    def __init__(self, size):
+        self.slots = threading.BoundedSemaphore(size) if size else None
+        self.lock = threading.Lock()
+        self.stats = {
+            'size': size or 0,
+            'open': 0,
+            'connects': 0,
+            'connect_seconds': 0.0,
+            'waits': 0,
+            'wait_seconds': 0.0,
+            'timeouts': 0,
+            'health_checks': 0,
+            'discarded': 0,
+        }
+
+    def add(self, **amounts):
+        with self.lock:
+            for name, amount in amounts.items():
+                self.stats[name] += amount
+
+
+class _ThreadGuard:
+    """Stored in a thread's locals: freed by refcount when the thread exits.
+    """
+
+
+def _close_on_thread_exit(pool, slot, connection):
+    try:
+        connection.close()
+    except base.Database.Error:
+        pass
+    pool.add(open=-1)
+    if slot is not None:
+        slot.release()
+
+
+def get_pool(alias, size):
+    with _pools_lock:
+        if alias not in _pools:
+            _pools[alias] = Pool(size)
+        return _pools[alias]
+
+
+def pool_stats():
+    """Return ``{alias: counters}`` for this process."""
+    with _pools_lock:
+        pools = dict(_pools)
+    result = {}
+    for alias, pool in pools.items():
+        with pool.lock:
+            result[alias] = dict(pool.stats)
+    return result
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    health_check_done = True
+    # The semaphore this wrapper took a slot from, if any.
+    slot = None
+    # Closes the connection if the owning thread exits with it open.
+    on_thread_exit = None
+
+    @property
+    def pool(self):
+        return get_pool(self.alias, self.settings_dict.get('POOL_SIZE'))
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool.slots is not None and self.slot is None:
+            started = time.monotonic()
+            acquired = pool.slots.acquire(blocking=False)
+            if not acquired:
+                acquired = pool.slots.acquire(
+                    timeout=self.settings_dict.get('POOL_TIMEOUT', 10))
+            waited = time.monotonic() - started
+            if not acquired:
+                pool.add(timeouts=1, wait_seconds=waited)
+                raise OperationalError(
+                    f'No free connection slot for {self.alias!r} after '
+                    f'{waited:.1f}s '
+                    f'(POOL_SIZE={pool.stats["size"]})'
+                )
+            pool.add(waits=1, wait_seconds=waited)
+            self.slot = pool.slots
+
+        started = time.monotonic()
+        try:
+            connection = super().get_new_connection(conn_params)
+        except Exception:
+            self._release_slot()
+            raise
+        pool.add(connects=1, open=1,
+                 connect_seconds=time.monotonic() - started)
+        # The wrapper sits in reference cycles and would only be freed by
+        # the cyclic GC; the guard is freed as soon as the thread exits.
+        guard = _ThreadGuard()
+        setattr(_thread_guards, self.alias, guard)
+        self.on_thread_exit = weakref.finalize(
+            guard, _close_on_thread_exit, pool, self.slot, connection)
+        return connection
+
+    def _release_slot(self):
+        if self.slot is not None:
+            slot, self.slot = self.slot, None
+            slot.release()
+
+    def _close(self):
+        had_connection = self.connection is not None
+        if self.on_thread_exit is not None:
+            self.on_thread_exit.detach()
+            self.on_thread_exit = None
+        try:
+            super()._close()
+        finally:
+            if had_connection:
+                self.pool.add(open=-1)
+            self._release_slot()
+
+    @async_unsafe
+    def connect(self):
+        # A fresh connection needs no check, and connect() itself calls
+        # ensure_connection() before autocommit is set up.
+        self.health_check_done = True
+        super().connect()
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        # Called at the start and end of every request: check the
+        # connection again before it is next used.
+        self.health_check_done = False
+
+    @async_unsafe
+    def ensure_connection(self):
+        if (
+            self.connection is not None
+            and not self.health_check_done
+            and not self.in_atomic_block
+            and self.settings_dict.get('CONN_HEALTH_CHECKS')
+        ):
+            self.health_check_done = True
+            self.pool.add(health_checks=1)
+            if not self.is_usable():
+                self.pool.add(discarded=1)
+                try:
+                    self.close()
+                except base.Database.Error:
+                    # The server is gone; close() has already dropped it.
+                    pass
+        super().ensure_connection()
@@ -0,0 +1,106 @@
+"""Send safe-method reads to replicas, keeping recent writers on the primary.
+
+Views opt in with ``ReplicaReadMixin``: once a GET/HEAD request is
+authenticated (always on the primary, so a brand new token works at
+once), its queries go to one of ``DATABASE_REPLICAS``. Writes always go to
+``default``. ``PrimaryPinMiddleware`` pins a user to the primary for
+``DATABASE_REPLICA_PIN_SECONDS`` after any successful write, so they read
+their own writes while the replicas catch up. ``recipe.cache.bump_version``
+pins as well, which covers writes made outside a request. Pins live in
+``DATABASE_REPLICA_PIN_CACHE``, which every worker must share.
+"""
+
+import random
+
+from asgiref.local import Local
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.permissions import SAFE_METHODS
+
+PIN_KEY = 'db:pin:user:{user_id}'
+
+_state = Local()
+
+
+def get_cache():
+    return caches[getattr(settings, 'DATABASE_REPLICA_PIN_CACHE', 'default')]
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def pin_to_primary(user_id):
+    """Serve the user's reads from the primary for the pin window."""
+    timeout = getattr(settings, 'DATABASE_REPLICA_PIN_SECONDS', 10)
+    get_cache().set(PIN_KEY.format(user_id=user_id), True, timeout=timeout)
+
+
+def is_pinned(user_id):
+    return bool(get_cache().get(PIN_KEY.format(user_id=user_id)))
+
+
+def route_reads(alias):
+    """Send this thread's reads to ``alias`` (``None``: the primary).
+
+    Returns the previous alias so it can be restored.
+    """
+    previous = getattr(_state, 'alias', None)
+    _state.alias = alias
+    return previous
+
+
+class ReplicaRouter:
+    """Database router for ``DATABASE_ROUTERS``."""
+
+    def db_for_read(self, model, **hints):
+        return getattr(_state, 'alias', None)
+
+    def db_for_write(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in replicas():
+            # Saving something that was read from a replica.
+            return 'default'
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary.
+        databases = {'default', *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaReadMixin:
+    """Serve a view's safe-method requests from a replica."""
+
+    def use_replica(self, request):
+        return request.method in SAFE_METHODS
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if (replicas() and self.use_replica(request)
+                and not is_pinned(request.user.pk)):
+            self._previous_alias = route_reads(random.choice(replicas()))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if hasattr(self, '_previous_alias'):
+            route_reads(self._previous_alias)
+            del self._previous_alias
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class PrimaryPinMiddleware:
+    """Pin users to the primary after a successful write request."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            # DRF sets ``request.user`` to the token's user as well.
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                pin_to_primary(user.pk)
+        return response
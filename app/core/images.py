@@ -0,0 +1,229 @@
+"""Rendition processing for recipe images."""
+
+import fcntl
+import hashlib
+import io
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, features
+
+RENDITIONS_DIR = 'uploads/recipe/renditions/'
+
+
+# Bytes in the resize cache, kept up to date by renders and evictions.
+RESIZE_BYTES_KEY = 'images:resize:bytes'
+# An eviction pass trims the cache to this share of its cap, so the next
+# pass is not due after a single render.
+RESIZE_LOW_WATER = 0.9
+
+RESIZE_STATS_KEYS = {
+    'hits': 'images:resize:hits',
+    'renders': 'images:resize:renders',
+    'evictions': 'images:resize:evictions',
+}
+
+
+class UnreadableImage(ValueError):
+    """The source image is missing or cannot be decoded."""
+
+
+def rendition_formats():
+    """Return the (name, Pillow format, extension) renditions to produce."""
+    formats = [('jpeg', 'JPEG', 'jpg')]
+    if features.check('webp'):
+        formats.append(('webp', 'WEBP', 'webp'))
+    return formats
+
+
+def rendition_widths():
+    return getattr(settings, 'RECIPE_IMAGE_WIDTHS', (320, 640, 1280))
+
+
+def render_renditions(recipe):
+    """Write resized, metadata-free renditions of a recipe's image.
+
+    The EXIF orientation is applied to the pixels and the EXIF block is
+    not carried over. Returns ``{format: {width: storage name}}``; widths
+    larger than the original are skipped.
+    """
+    with recipe.image.open('rb') as source:
+        image = Image.open(source)
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGB')
+
+    stem = os.path.splitext(os.path.basename(recipe.image.name))[0]
+    renditions = {}
+    try:
+        for name, pil_format, ext in rendition_formats():
+            renditions[name] = {}
+            for width in rendition_widths():
+                if width > image.width and renditions[name]:
+                    continue
+                resized = image.copy()
+                height = width * image.height // image.width or 1
+                resized.thumbnail((width, height))
+                buffer = io.BytesIO()
+                resized.save(buffer, format=pil_format, quality=82,
+                             optimize=True)
+                path = default_storage.save(
+                    f'{RENDITIONS_DIR}{stem}-{width}.{ext}',
+                    ContentFile(buffer.getvalue()),
+                )
+                renditions[name][str(width)] = path
+    except BaseException:
+        delete_renditions(renditions)
+        raise
+    return renditions
+
+
+def delete_renditions(renditions):
+    """Delete the files of a ``{format: {width: name}}`` map."""
+    for widths in renditions.values():
+        for name in widths.values():
+            default_storage.delete(name)
+
+
+def resize_widths():
+    return getattr(settings, 'RECIPE_IMAGE_RESIZE_WIDTHS',
+                   (64, 128, 256, 320, 480, 640, 960, 1280))
+
+
+def resize_cache_dir():
+    return os.path.join(settings.MEDIA_ROOT, 'cache', 'resized')
+
+
+def _count(stat, amount=1):
+    key = RESIZE_STATS_KEYS[stat]
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key, amount)
+
+
+def resize_stats():
+    """Return the shared hit/render/eviction counters of the resize cache."""
+    values = cache.get_many(RESIZE_STATS_KEYS.values())
+    return {stat: values.get(key, 0)
+            for stat, key in RESIZE_STATS_KEYS.items()}
+
+
+def open_resized_image(image, width, fmt):
+    """Return ``image`` resized to ``width`` in ``fmt`` as an open file.
+
+    Variants live in a size-capped directory under MEDIA_ROOT. A hit
+    bumps the file's mtime, which is what eviction orders by (LRU). A
+    miss renders under an exclusive per-variant file lock, so concurrent
+    requests for the same variant, in any worker process, render once.
+    The file is opened before it can be evicted, so it stays readable.
+    Raises ``UnreadableImage`` if the source cannot be decoded.
+    """
+    formats = {name: (pil, ext) for name, pil, ext in rendition_formats()}
+    pil_format, ext = formats[fmt]
+    key = hashlib.sha256(f'{image.name}:{width}:{fmt}'.encode()).hexdigest()
+    directory = os.path.join(resize_cache_dir(), key[:2])
+    path = os.path.join(directory, f'{key}.{ext}')
+
+    fp = _open_touched(path)
+    if fp is not None:
+        _count('hits')
+        return fp
+
+    os.makedirs(directory, exist_ok=True)
+    # Lock files are left in place: unlinking one while another worker
+    # waits on it would let a third worker lock a fresh file and render.
+    with open(f'{path}.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            fp = _open_touched(path)
+            if fp is not None:
+                _count('hits')
+                return fp
+            try:
+                with image.open('rb') as source:
+                    rendered = ImageOps.exif_transpose(Image.open(source))
+                    rendered = rendered.convert('RGB')
+            except (OSError, SyntaxError, ValueError,
+                    Image.DecompressionBombError) as exc:
+                raise UnreadableImage(f'{image.name}: {exc}') from exc
+            height = width * rendered.height // rendered.width or 1
+            rendered.thumbnail((width, height))
+            with tempfile.NamedTemporaryFile(dir=directory,
+                                             delete=False) as tmp:
+                rendered.save(tmp, format=pil_format, quality=82,
+                              optimize=True)
+            os.replace(tmp.name, path)
+            fp = open(path, 'rb')
+            _count('renders')
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    if _grow_cache(os.fstat(fp.fileno()).st_size) > resize_cache_limit():
+        evict_resized(keep=path,
+                      target=int(resize_cache_limit() * RESIZE_LOW_WATER))
+    return fp
+
+
+def _open_touched(path):
+    try:
+        fp = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    os.utime(fp.fileno())
+    return fp
+
+
+def resize_cache_limit():
+    return getattr(settings, 'RECIPE_IMAGE_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+
+
+def _grow_cache(size):
+    """Add ``size`` to the cache's byte count and return the new total."""
+    try:
+        return cache.incr(RESIZE_BYTES_KEY, size)
+    except ValueError:
+        # Unknown, e.g. after a cache restart: have the next pass recount.
+        return float('inf')
+
+
+def evict_resized(keep=None, target=None):
+    """Delete least recently used variants until the cache fits its cap.
+
+    Walks the whole cache directory, so it only runs when the byte count
+    says the cap is exceeded; it then resets the count to what is on disk.
+    Trims to ``target`` bytes if given, else to the cap.
+    """
+    limit = resize_cache_limit() if target is None else target
+    entries, total = [], 0
+    for root, _, files in os.walk(resize_cache_dir()):
+        for name in files:
+            if name.endswith('.lock'):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+    evicted = 0
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        if path == keep:
+            continue
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            continue
+        total -= size
+        evicted += 1
+    cache.set(RESIZE_BYTES_KEY, total, timeout=None)
+    if evicted:
+        _count('evictions', evicted)
+    return evicted
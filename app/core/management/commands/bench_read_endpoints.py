@@ -0,0 +1,109 @@
+"""Django command to compare the sync and async recipe read endpoints."""
+
+import statistics
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+from core.models import User
+
+ENDPOINTS = {
+    'sync': ['/api/recipe/recipe-list/', '/api/recipe/tags/',
+             '/api/recipe/ingredients/'],
+    'async': ['/api/async/recipe/recipes/', '/api/async/recipe/tags/',
+              '/api/async/recipe/ingredients/'],
+}
+
+
+def percentile(timings, pct):
+    ordered = sorted(timings)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class Command(BaseCommand):
+    """Load a running uwsgi (sync) and ASGI (async) server side by side.
+
+    Start the servers first, e.g.::
+
+        uwsgi --http :8001 --module app.wsgi:application --workers=2
+        uvicorn app.asgi:application --port 8002 --workers 2
+    """
+
+    help = ('Benchmark throughput and latency of the sync vs async read '
+            'endpoints.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sync-url', default='http://127.0.0.1:8001')
+        parser.add_argument('--async-url', default='http://127.0.0.1:8002')
+        parser.add_argument('--email', required=True,
+                            help='User to authenticate as.')
+        parser.add_argument('--concurrency', default='1,8,32,64',
+                            help='Comma-separated numbers of concurrent '
+                            'clients.')
+        parser.add_argument('--requests', type=int, default=500,
+                            help='Requests per concurrency level and server.')
+        parser.add_argument('--uncached', action='store_true',
+                            help='Add a unique query param to every request '
+                            'so responses come from Postgres, not the '
+                            'response cache.')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        try:
+            user = User.objects.get(email=options['email'])
+        except User.DoesNotExist:
+            raise CommandError(f'No user with email {options["email"]}')
+        token, _ = Token.objects.get_or_create(user=user)
+        self.headers = {'Authorization': f'Token {token.key}'}
+        self.uncached = options['uncached']
+
+        targets = {'sync': options['sync_url'], 'async': options['async_url']}
+        for concurrency in map(int, options['concurrency'].split(',')):
+            for name, base_url in targets.items():
+                urls = [base_url + path for path in ENDPOINTS[name]]
+                self._run(name, urls, concurrency, options['requests'])
+
+    def _fetch(self, url):
+        request = urllib.request.Request(url, headers=self.headers)
+        start = time.perf_counter()
+        with urllib.request.urlopen(request, timeout=60) as response:
+            response.read()
+        return (time.perf_counter() - start) * 1000
+
+    def _run(self, name, urls, concurrency, total):
+        counter = iter(range(total))
+        lock = threading.Lock()
+        timings, errors = [], []
+
+        def client():
+            while True:
+                with lock:
+                    number = next(counter, None)
+                if number is None:
+                    return
+                url = urls[number % len(urls)]
+                if self.uncached:
+                    url += f'?bench={time.time_ns()}'
+                try:
+                    timings.append(self._fetch(url))
+                except OSError as exc:
+                    errors.append(exc)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for _ in range(concurrency):
+                pool.submit(client)
+        elapsed = time.perf_counter() - started
+        if not timings:
+            raise CommandError(f'{name}: every request failed ({errors[0]})')
+        self.stdout.write(
+            f'{name:<5} concurrency={concurrency:<4} '
+            f'req/s={len(timings) / elapsed:<8.1f} '
+            f'p50={statistics.median(timings):.1f}ms '
+            f'p99={percentile(timings, 99):.1f}ms '
+            f'errors={len(errors)}'
+        )
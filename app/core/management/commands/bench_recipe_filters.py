@@ -0,0 +1,78 @@
+"""Django command to benchmark recipe ingredient/tag filtering."""
+
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from core.models import Recipe, User
+
+
+class Command(BaseCommand):
+    """Compare the legacy M2M join filter with the any/all filters."""
+
+    help = 'Benchmark recipe ingredient/tag filtering strategies.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--email', help='User whose recipes are queried '
+                            '(defaults to the user with the most recipes).')
+        parser.add_argument('--relation', choices=['ingredients', 'tags'],
+                            default='ingredients')
+        parser.add_argument('--ids', help='Comma-separated ids to filter on '
+                            '(defaults to the user\'s most used ones).')
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        user = self._get_user(options['email'])
+        relation = options['relation']
+        ids = self._get_ids(user, relation, options['ids'])
+        recipes = Recipe.objects.filter(user=user)
+        lookup = f'{relation}__in'
+
+        strategies = [
+            ('join (legacy)', lambda: recipes.filter(**{lookup: ids})),
+            ('join + distinct',
+             lambda: recipes.filter(**{lookup: ids}).distinct()),
+            ('overlap (any)',
+             lambda: recipes.with_related_ids(relation, ids, 'any')),
+            ('contains (all)',
+             lambda: recipes.with_related_ids(relation, ids, 'all')),
+        ]
+        self.stdout.write(f'user={user.email} {relation}={ids} '
+                          f'repeat={options["repeat"]}')
+        for name, build in strategies:
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                rows = list(build().values_list('id', flat=True))
+                timings.append((time.perf_counter() - start) * 1000)
+            self.stdout.write(
+                f'{name:<16} rows={len(rows):<7} unique={len(set(rows)):<7} '
+                f'median={statistics.median(timings):.2f}ms '
+                f'max={max(timings):.2f}ms'
+            )
+
+    def _get_user(self, email):
+        if email:
+            try:
+                return User.objects.get(email=email)
+            except User.DoesNotExist:
+                raise CommandError(f'No user with email {email}')
+        user = User.objects.annotate(n=Count('recipe')).order_by('-n').first()
+        if user is None:
+            raise CommandError('No users to benchmark against')
+        return user
+
+    def _get_ids(self, user, relation, ids):
+        if ids:
+            return [int(pk) for pk in ids.split(',')]
+        field = Recipe._meta.get_field(relation)
+        target = field.m2m_reverse_name()
+        return list(
+            field.remote_field.through.objects
+            .filter(recipe__user=user)
+            .values(target).annotate(n=Count('id')).order_by('-n')
+            .values_list(target, flat=True)[:3]
+        )
@@ -0,0 +1,170 @@
+"""Django command to remove recipe media files nothing refers to."""
+
+import os
+import shutil
+import stat
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.models import ImageBlob, ImageUpload
+from core.storage import is_content_addressed
+
+MEDIA_DIR = 'uploads'
+# Every name in MEDIA_DIR the database refers to, ordered like walk() yields
+# files: by path components, which is the string order once '/' sorts first.
+REFERENCED_SQL = """
+    SELECT name FROM (
+        SELECT image AS name FROM core_recipe
+        WHERE image IS NOT NULL AND image <> ''
+        UNION ALL
+        SELECT width.value FROM core_recipe,
+            jsonb_each(image_renditions) AS fmt,
+            jsonb_each_text(fmt.value) AS width
+        WHERE image_renditions <> '{}'
+        UNION ALL
+        SELECT name FROM core_imageblob WHERE ref_count > 0
+        UNION ALL
+        SELECT 'uploads/partial/' || id::text FROM core_imageupload
+    ) refs
+    ORDER BY replace(name, '/', chr(1)) COLLATE "C"
+"""
+
+
+def sort_key(name):
+    return name.replace('/', '\x01')
+
+
+def walk(root, relative=''):
+    """Yield ``(name, os.stat_result)`` for files under ``root``.
+
+    Files come in sort_key() order; only one directory listing is held
+    in memory at a time.
+    """
+    try:
+        with os.scandir(os.path.join(root, relative)) as entries:
+            names = sorted(entry.name for entry in entries)
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = f'{relative}/{name}' if relative else name
+        try:
+            info = os.stat(os.path.join(root, path), follow_symlinks=False)
+        except FileNotFoundError:
+            continue
+        if stat.S_ISDIR(info.st_mode):
+            yield from walk(root, path)
+        elif stat.S_ISREG(info.st_mode):
+            yield path, info
+
+
+def referenced_names(batch_size):
+    """Stream referenced names in sort_key() order.
+
+    A server-side cursor keeps memory flat however many rows there are.
+    """
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(REFERENCED_SQL)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            for (name,) in rows:
+                yield name
+
+
+def orphans(root, batch_size):
+    """Merge the file walk with the referenced names, yielding the rest."""
+    references = referenced_names(batch_size)
+    reference = next(references, None)
+    for name, info in walk(os.path.join(root, MEDIA_DIR)):
+        name = f'{MEDIA_DIR}/{name}'
+        key = sort_key(name)
+        while reference is not None and sort_key(reference) < key:
+            reference = next(references, None)
+        if reference != name:
+            yield name, info
+
+
+class Command(BaseCommand):
+    """Delete or quarantine unreferenced files under MEDIA_ROOT/uploads."""
+
+    help = 'Remove recipe media files that no database row refers to.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=24,
+                            help='Keep files younger than this, as they may '
+                            'belong to a request still in flight.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report what would be removed.')
+        parser.add_argument('--quarantine', metavar='DIR',
+                            help='Move orphans to DIR instead of deleting '
+                            'them.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        dry_run = options['dry_run']
+        quarantine = options['quarantine']
+        media_root = os.path.abspath(settings.MEDIA_ROOT)
+        if quarantine and os.path.commonpath(
+                [media_root, os.path.abspath(quarantine)]) == media_root:
+            raise CommandError(
+                'The quarantine directory must be outside MEDIA_ROOT.')
+        grace = timedelta(hours=options['grace_hours'])
+        cutoff = time.time() - grace.total_seconds()
+
+        # Abandoned resumable uploads stop protecting their partial files.
+        stale = ImageUpload.objects.filter(
+            updated_at__lt=timezone.now() - grace)
+        if dry_run:
+            expired = stale.count()
+        else:
+            expired, _ = stale.delete()
+
+        scanned = removed = reclaimed = 0
+        for name, info in orphans(settings.MEDIA_ROOT, options['batch_size']):
+            scanned += 1
+            if info.st_mtime > cutoff:
+                continue
+            if not dry_run and not self._remove(name, quarantine):
+                continue
+            removed += 1
+            reclaimed += info.st_size
+            if options['verbosity'] > 1:
+                action = 'would remove' if dry_run else 'removed'
+                self.stdout.write(f'{action} {name}')
+
+        verb = 'Would reclaim' if dry_run else 'Reclaimed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {reclaimed} bytes from {removed} of {scanned} '
+            f'unreferenced files '
+            f'({expired} expired uploads).'
+        ))
+
+    def _remove(self, name, quarantine):
+        path = os.path.join(settings.MEDIA_ROOT, name)
+        with transaction.atomic():
+            if is_content_addressed(name):
+                # Recheck under the row lock ContentAddressedStorage.save()
+                # takes, in case an identical upload just reused the file.
+                blob = (ImageBlob.objects.select_for_update()
+                        .filter(name=name).first())
+                if blob is not None:
+                    if blob.ref_count > 0:
+                        return False
+                    blob.delete()
+            try:
+                if quarantine:
+                    target = os.path.join(quarantine, name)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    shutil.move(path, target)
+                else:
+                    os.unlink(path)
+            except FileNotFoundError:
+                return False
+        return True
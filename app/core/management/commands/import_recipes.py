@@ -0,0 +1,218 @@
+"""Django command to bulk import recipes with PostgreSQL COPY."""
+
+import csv
+import io
+import itertools
+import json
+import os
+import sys
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from core.models import (Ingredient, Recipe, RecipeImport, Tag, User,
+                         normalize_name)
+from recipe.cache import bump_version
+
+RECIPE_COLUMNS = ['id', 'user_id', 'title', 'description', 'time_minutes',
+                  'price', 'link', 'image', 'image_status', 'image_renditions',
+                  'tag_ids', 'tag_names', 'ingredient_ids', 'ingredient_names']
+RELATIONS = [
+    # (input field, model, recipe ids array, recipe names array)
+    ('tag_names', Tag, 'tag_ids', 'tag_names'),
+    ('ingredient_names', Ingredient, 'ingredient_ids', 'ingredient_names'),
+]
+
+
+def pg_array(values):
+    """Format values as a PostgreSQL array literal."""
+    items = (
+        '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+        for value in values
+    )
+    return '{' + ','.join(items) + '}'
+
+
+def read_ndjson(stream):
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_csv(stream):
+    # Matches the export format: list columns are joined with '|'.
+    for row in csv.DictReader(stream):
+        for field, *_ in RELATIONS:
+            names = (row.get(field) or '').split('|')
+            row[field] = [name for name in names if name]
+        yield row
+
+
+READERS = {'ndjson': read_ndjson, 'csv': read_csv}
+
+
+class Command(BaseCommand):
+    """Stream NDJSON/CSV recipes into core_recipe and its through tables."""
+
+    help = 'Import recipes for a user from an NDJSON or CSV file using COPY.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Input file, or '-' for stdin.")
+        parser.add_argument('--email', required=True,
+                            help='Owner of the recipes.')
+        parser.add_argument('--format', choices=sorted(READERS),
+                            help='Input format (default: from the file '
+                                 'extension).')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--source', help='Name used to track progress for '
+                            'resuming (default: the input path).')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        try:
+            self.user = User.objects.get(email=options['email'])
+        except User.DoesNotExist:
+            raise CommandError(f'No user with email {options["email"]}')
+
+        path = options['path']
+        fmt = options['format'] or os.path.splitext(path)[1].lstrip('.')
+        if fmt not in READERS:
+            raise CommandError('Cannot tell the input format, pass --format.')
+        source = options['source'] or os.path.abspath(path)
+        progress, _ = RecipeImport.objects.get_or_create(user=self.user,
+                                                         source=source)
+        if progress.committed_records:
+            self.stdout.write(
+                f'Resuming after record {progress.committed_records}')
+
+        self.names = {}
+        for _, model, *_ in RELATIONS:
+            names = model.objects.filter(user=self.user)
+            self.names[model] = {
+                name.lower(): (pk, name)
+                for pk, name in names.values_list('id', 'name')
+            }
+
+        if path == '-':
+            stream = sys.stdin
+        else:
+            stream = open(path, newline='', encoding='utf-8')
+        started = time.perf_counter()
+        imported = 0
+        try:
+            records = READERS[fmt](stream)
+            records = itertools.islice(records, progress.committed_records,
+                                       None)
+            position = progress.committed_records
+            while True:
+                chunk = list(itertools.islice(records, options['chunk_size']))
+                if not chunk:
+                    break
+                chunk_started = time.perf_counter()
+                with transaction.atomic():
+                    self._copy_chunk(chunk, position)
+                    position += len(chunk)
+                    RecipeImport.objects.filter(pk=progress.pk).update(
+                        committed_records=position)
+                imported += len(chunk)
+                rate = len(chunk) / (time.perf_counter() - chunk_started)
+                self.stdout.write(
+                    f'{position} records committed ({rate:.0f} rows/sec)')
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        if imported:
+            bump_version(self.user.pk)
+        elapsed = time.perf_counter() - started
+        rate = imported / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} recipes in {elapsed:.1f}s '
+            f'({rate:.0f} rows/sec)'
+        ))
+
+    def _add_missing_names(self, chunk):
+        """Create, in one batch per model, the names this chunk introduces."""
+        for field, model, *_ in RELATIONS:
+            known = self.names[model]
+            names = {normalize_name(name) for record in chunk
+                     for name in record.get(field) or []}
+            missing = {name for name in names
+                       if name and name.lower() not in known}
+            if missing:
+                ids, _ = model.objects.get_or_create_many(self.user, missing)
+                stored = dict(model.objects.filter(pk__in=ids.values())
+                              .values_list('id', 'name'))
+                for name, pk in ids.items():
+                    known[name.lower()] = (pk, stored[pk])
+
+    def _resolve(self, model, names):
+        """Return sorted (id, name) pairs for names from the in-memory map."""
+        known = self.names[model]
+        names = filter(None, map(normalize_name, names))
+        return sorted({known[name.lower()] for name in names})
+
+    def _copy_chunk(self, chunk, position):
+        self._add_missing_names(chunk)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence('core_recipe', 'id')) "
+                'FROM generate_series(1, %s)', [len(chunk)])
+            ids = [row[0] for row in cursor.fetchall()]
+
+            recipes = io.StringIO()
+            recipe_writer = csv.writer(recipes, quoting=csv.QUOTE_ALL)
+            links = {model: io.StringIO() for _, model, *_ in RELATIONS}
+            link_writers = {model: csv.writer(buffer)
+                            for model, buffer in links.items()}
+
+            numbered = enumerate(zip(ids, chunk), position + 1)
+            for number, (recipe_id, record) in numbered:
+                row = self._recipe_row(number, record)
+                row.update(id=recipe_id, user_id=self.user.pk, image='',
+                           image_status='none', image_renditions='{}')
+                for field, model, ids_field, names_field in RELATIONS:
+                    related = self._resolve(model, record.get(field) or [])
+                    row[ids_field] = pg_array(pk for pk, _ in related)
+                    row[names_field] = pg_array(name for _, name in related)
+                    for pk, _ in related:
+                        link_writers[model].writerow([recipe_id, pk])
+                recipe_writer.writerow(
+                    [row[column] for column in RECIPE_COLUMNS])
+
+            recipes.seek(0)
+            cursor.copy_expert(
+                f'COPY core_recipe ({", ".join(RECIPE_COLUMNS)}) FROM STDIN '
+                'WITH (FORMAT csv, FORCE_NULL (image))', recipes)
+            relations = (('tags', Tag), ('ingredients', Ingredient))
+            for relation, model in relations:
+                field = Recipe._meta.get_field(relation)
+                links[model].seek(0)
+                cursor.copy_expert(
+                    f'COPY {field.m2m_db_table()} '
+                    f'({field.m2m_column_name()}, {field.m2m_reverse_name()}) '
+                    'FROM STDIN WITH (FORMAT csv)', links[model])
+
+    def _recipe_row(self, number, record):
+        """Validate one input record and return its scalar columns."""
+        title = (record.get('title') or '').strip()
+        if not title:
+            raise CommandError(f'Record {number}: title is required')
+        try:
+            time_minutes = int(record.get('time_minutes'))
+            price = Decimal(str(record.get('price')))
+            price = price.quantize(Decimal('0.01'))
+        except (TypeError, ValueError, InvalidOperation):
+            raise CommandError(
+                f'Record {number}: invalid time_minutes or price')
+        if abs(price) >= 1000:
+            raise CommandError(f'Record {number}: price must be below 1000')
+        return {
+            'title': title[:255],
+            'description': record.get('description') or '',
+            'time_minutes': time_minutes,
+            'price': price,
+            'link': (record.get('link') or '')[:255],
+        }
@@ -0,0 +1,368 @@
+"""Django command to replay a realistic request mix against a server."""
+
+import io
+import json
+import random
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from core.management.commands.bench_read_endpoints import percentile
+from core.models import Ingredient, Recipe, Tag, User
+from recipe.cache import bump_version
+
+DEFAULT_MIX = 'list=35,filter=15,detail=25,create=8,update=10,upload=2,login=5'
+EMAIL = 'loadtest{number}@example.com'
+RECIPES_PER_USER = 20
+
+
+def parse_mix(value):
+    """Parse ``name=weight,...`` into ``{name: weight}``."""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in OPERATIONS or not weight.isdigit():
+            raise CommandError(f'Invalid mix entry {part!r}; operations: '
+                               f'{", ".join(OPERATIONS)}')
+        mix[name] = int(weight)
+    return mix
+
+
+def summarize(timings, statuses, elapsed):
+    """Return throughput and latency percentiles for one endpoint."""
+    return {
+        'requests': len(timings),
+        'errors': sum(count for code, count in statuses.items()
+                      if code >= 400 or code == 0),
+        'statuses': {str(code): count
+                     for code, count in sorted(statuses.items())},
+        'req_per_s': round(len(timings) / elapsed, 2),
+        'mean_ms': round(statistics.fmean(timings), 2),
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p95_ms': round(percentile(timings, 95), 2),
+        'p99_ms': round(percentile(timings, 99), 2),
+    }
+
+
+class Client:
+    """One simulated user: a token and the recipes it knows about."""
+
+    def __init__(self, base_url, email, password, token, recipe_ids, tag_ids,
+                 ingredient_ids):
+        self.base_url = base_url
+        self.email = email
+        self.password = password
+        self.token = token
+        self.recipe_ids = recipe_ids
+        self.tag_ids = tag_ids
+        self.ingredient_ids = ingredient_ids
+
+    def request(self, method, path, data=None, json_body=None, files=None):
+        """Send a request and return ``(status, parsed JSON or None)``."""
+        headers = {'Authorization': f'Token {self.token}'}
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif files is not None:
+            boundary = uuid.uuid4().hex
+            body = encode_multipart(boundary, files)
+            headers['Content-Type'] = (
+                f'multipart/form-data; boundary={boundary}')
+        elif data is not None:
+            body = urllib.parse.urlencode(data).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        request = urllib.request.Request(self.base_url + path, data=body,
+                                         headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                content = response.read()
+                status = response.status
+        except urllib.error.HTTPError as exc:
+            exc.read()
+            return exc.code, None
+        if not content:
+            return status, None
+        return status, json.loads(content)
+
+
+def encode_multipart(boundary, files):
+    """Encode ``{field: (filename, content_type, bytes)}`` as multipart."""
+    parts = []
+    for field, (filename, content_type, content) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; '
+            f'filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'.encode()
+            + content + b'\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts)
+
+
+def _sample_png():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), (200, 120, 40)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+SAMPLE_PNG = _sample_png()
+
+
+def op_login(client, rng):
+    status, body = client.request('POST', '/api/user/token/', data={
+        'email': client.email,
+        'password': client.password,
+    })
+    if status == 200:
+        client.token = body['token']
+    return status
+
+
+def op_list(client, rng):
+    return client.request('GET', '/api/recipe/recipes/')[0]
+
+
+def op_filter(client, rng):
+    sample = rng.sample(client.tag_ids, min(2, len(client.tag_ids)))
+    tags = ','.join(str(tag) for tag in sample)
+    return client.request('GET', f'/api/recipe/recipe-list/?tags={tags}')[0]
+
+
+def op_detail(client, rng):
+    recipe_id = rng.choice(client.recipe_ids)
+    return client.request('GET', f'/api/recipe/recipes/{recipe_id}/')[0]
+
+
+def op_create(client, rng):
+    status, body = client.request('POST', '/api/recipe/recipes/', json_body={
+        'title': f'Load test {rng.randrange(10 ** 6)}',
+        'time_minutes': rng.randint(5, 120),
+        'price': f'{rng.uniform(1, 50):.2f}',
+        'tags': rng.sample(client.tag_ids, min(2, len(client.tag_ids))),
+        'ingredients': rng.sample(client.ingredient_ids,
+                                  min(3, len(client.ingredient_ids))),
+    })
+    if status == 201:
+        client.recipe_ids.append(body['id'])
+    return status
+
+
+def op_update(client, rng):
+    recipe_id = rng.choice(client.recipe_ids)
+    return client.request('PATCH', f'/api/recipe/recipes/{recipe_id}/',
+                          json_body={'time_minutes': rng.randint(5, 120)})[0]
+
+
+def op_upload(client, rng):
+    recipe_id = rng.choice(client.recipe_ids)
+    return client.request(
+        'POST', f'/api/recipe/recipes/{recipe_id}/upload-image/',
+        files={'image': ('load.png', 'image/png', SAMPLE_PNG)})[0]
+
+
+OPERATIONS = {
+    'login': op_login,
+    'list': op_list,
+    'filter': op_filter,
+    'detail': op_detail,
+    'create': op_create,
+    'update': op_update,
+    'upload': op_upload,
+}
+
+
+class Command(BaseCommand):
+    """Replay a weighted mix of API calls against a running server.
+
+    Start a server first, e.g. ``uwsgi --http :8001 --module
+    app.wsgi:application --workers=2``, then compare two runs with
+    ``--output`` and ``--baseline``. Load test users are created on first
+    use. Token logins count against LOGIN_RATE_LIMITS, so expect 429s if
+    the login share is high.
+    """
+
+    help = 'Load test the recipe API and report p50/p95/p99 per endpoint.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8001')
+        parser.add_argument('--users', type=int, default=10,
+                            help='Number of simulated users.')
+        parser.add_argument('--password', default='loadtest-pass123')
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--requests', type=int, default=2000,
+                            help='Total number of requests.')
+        parser.add_argument('--mix', type=parse_mix,
+                            default=parse_mix(DEFAULT_MIX),
+                            help='Weighted operations '
+                            f'(default: {DEFAULT_MIX}).')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed for the request sequence.')
+        parser.add_argument('--output',
+                            help='Write the results as JSON to this file.')
+        parser.add_argument('--baseline',
+                            help='JSON results of an earlier run to compare '
+                            'with.')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        base_url = options['url'].rstrip('/')
+        clients = [
+            self._client(base_url, number, options['password'])
+            for number in range(options['users'])
+        ]
+        mix = options['mix']
+        rng = random.Random(options['seed'])
+        # Decide the whole sequence up front so runs with one seed match.
+        plan = [
+            (rng.choice(clients),
+             rng.choices(list(mix), weights=list(mix.values()))[0],
+             rng.randrange(2 ** 32))
+            for _ in range(options['requests'])
+        ]
+        results = self._run(plan, options['concurrency'])
+        results['config'] = {
+            key: options[key]
+            for key in ('url', 'users', 'concurrency', 'requests', 'seed')
+        }
+        results['config']['mix'] = mix
+        self._report(results)
+
+        if options['baseline']:
+            with open(options['baseline']) as fp:
+                self._compare(json.load(fp), results)
+        if options['output']:
+            with open(options['output'], 'w') as fp:
+                json.dump(results, fp, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+    def _client(self, base_url, number, password):
+        email = EMAIL.format(number=number)
+        user = User.objects.filter(email=email).first()
+        if user is None:
+            user = User.objects.create_user(email=email, password=password,
+                                            name=f'Load test {number}')
+        tag_ids = [
+            Tag.objects.get_or_create(user=user, name=name)[0].id
+            for name in ('Dinner', 'Vegan', 'Quick', 'Dessert')
+        ]
+        ingredient_ids = [
+            Ingredient.objects.get_or_create(user=user, name=name)[0].id
+            for name in ('Salt', 'Flour', 'Eggs', 'Butter', 'Sugar')
+        ]
+        recipe_ids = list(Recipe.objects.filter(user=user)
+                          .values_list('id', flat=True)[:500])
+        if not recipe_ids:
+            recipes = Recipe.objects.bulk_create(
+                Recipe(user=user, title=f'Load test recipe {i}',
+                       time_minutes=10 + i, price=Decimal('4.50'))
+                for i in range(RECIPES_PER_USER)
+            )
+            Recipe.tags.through.objects.bulk_create(
+                Recipe.tags.through(recipe_id=recipe.id,
+                                    tag_id=tag_ids[i % len(tag_ids)])
+                for i, recipe in enumerate(recipes)
+            )
+            recipe_ids = [recipe.id for recipe in recipes]
+            # bulk_create skips the signals that fill the tag arrays the
+            # filter operation matches on and invalidate cached lists.
+            Recipe.objects.filter(pk__in=recipe_ids).sync_related_arrays()
+            bump_version(user.pk)
+        token, _ = Token.objects.get_or_create(user=user)
+        return Client(base_url, email, password, token.key, recipe_ids,
+                      tag_ids, ingredient_ids)
+
+    def _run(self, plan, concurrency):
+        lock = threading.Lock()
+        steps = iter(plan)
+        timings, statuses = {}, {}
+
+        def worker():
+            while True:
+                with lock:
+                    step = next(steps, None)
+                if step is None:
+                    return
+                client, operation, seed = step
+                started = time.perf_counter()
+                try:
+                    status = OPERATIONS[operation](client, random.Random(seed))
+                except OSError:
+                    status = 0
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    timings.setdefault(operation, []).append(elapsed)
+                    counts = statuses.setdefault(operation, {})
+                    counts[status] = counts.get(status, 0) + 1
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for _ in range(concurrency):
+                pool.submit(worker)
+        elapsed = time.perf_counter() - started
+        if not timings:
+            raise CommandError('No requests were made')
+
+        every = [timing for values in timings.values() for timing in values]
+        every_status = {}
+        for counts in statuses.values():
+            for code, count in counts.items():
+                every_status[code] = every_status.get(code, 0) + count
+        return {
+            'elapsed_s': round(elapsed, 3),
+            'total': summarize(every, every_status, elapsed),
+            'endpoints': {
+                operation: summarize(timings[operation], statuses[operation],
+                                     elapsed)
+                for operation in sorted(timings)
+            },
+        }
+
+    def _report(self, results):
+        self.stdout.write(
+            f'{"endpoint":<8} {"requests":>8} {"errors":>6} {"req/s":>8} '
+            f'{"p50":>8} {"p95":>8} {"p99":>8}'
+        )
+        for name, row in _rows(results):
+            self.stdout.write(
+                f'{name:<8} {row["requests"]:>8} {row["errors"]:>6} '
+                f'{row["req_per_s"]:>8.1f} {row["p50_ms"]:>6.1f}ms '
+                f'{row["p95_ms"]:>6.1f}ms {row["p99_ms"]:>6.1f}ms'
+            )
+
+    def _compare(self, baseline, results):
+        self.stdout.write(
+            'Change against baseline (negative latency is faster):')
+        for name, row in _rows(results):
+            if name == 'total':
+                before = baseline['total']
+            else:
+                before = baseline['endpoints'].get(name)
+            if before is None:
+                continue
+            changes = ' '.join(
+                f'{key[:-3]}={_percent(before[key], row[key])}'
+                for key in ('p50_ms', 'p95_ms', 'p99_ms')
+            )
+            throughput = _percent(before['req_per_s'], row['req_per_s'])
+            self.stdout.write(f'{name:<8} req/s={throughput} {changes}')
+
+
+def _rows(results):
+    return list(results['endpoints'].items()) + [('total', results['total'])]
+
+
+def _percent(before, after):
+    if not before:
+        return 'n/a'
+    return f'{(after - before) / before * 100:+.1f}%'
@@ -0,0 +1,100 @@
+"""Django command to render recipe image renditions off-request."""
+
+import time
+import traceback
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core.images import delete_renditions, render_renditions
+from core.models import Recipe
+
+
+class Command(BaseCommand):
+    """Process recipes whose image_status is pending.
+
+    A row is claimed by setting it to processing under SELECT ... FOR
+    UPDATE SKIP LOCKED, so several workers can run side by side, and is
+    rendered with no transaction or lock held. The renditions are kept
+    only if the image was not replaced meanwhile.
+    """
+
+    help = 'Render resized renditions for newly uploaded recipe images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Exit when no pending images are left.')
+        parser.add_argument('--poll-interval', type=float, default=2.0)
+        parser.add_argument('--claim-timeout', type=float, default=600.0,
+                            help='Seconds after which an image still '
+                                 'processing is retried, its worker '
+                                 'presumed dead.')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        processed = 0
+        while True:
+            if self.process_next(options['claim_timeout']):
+                processed += 1
+                continue
+            if options['once']:
+                break
+            time.sleep(options['poll_interval'])
+        self.stdout.write(self.style.SUCCESS(f'{processed} images processed'))
+
+    def claim_next(self, claim_timeout):
+        """Mark the next pending image processing and return its recipe."""
+        now = timezone.now()
+        stale = now - timedelta(seconds=claim_timeout)
+        with transaction.atomic():
+            recipe = (
+                Recipe.objects.select_for_update(skip_locked=True)
+                .filter(Q(image_status='pending')
+                        | Q(image_status='processing',
+                            image_claimed_at__lt=stale))
+                .order_by('id').only('id', 'user_id', 'image').first()
+            )
+            if recipe is not None:
+                recipe.image_status = 'processing'
+                recipe.image_claimed_at = now
+                recipe.save(update_fields=['image_status', 'image_claimed_at'])
+        return recipe
+
+    def process_next(self, claim_timeout):
+        """Process one pending image; return False when none is waiting."""
+        recipe = self.claim_next(claim_timeout)
+        if recipe is None:
+            return False
+        try:
+            renditions = render_renditions(recipe)
+            image_status = 'ready'
+        except Exception:
+            # Anything, e.g. Image.DecompressionBombError: a row left
+            # pending would be claimed first again and crash every worker.
+            self.stderr.write(
+                f'Recipe {recipe.id} failed:\n{traceback.format_exc()}')
+            renditions = {}
+            image_status = 'failed'
+
+        with transaction.atomic():
+            current = (
+                Recipe.objects.select_for_update()
+                .filter(pk=recipe.pk, image=recipe.image.name,
+                        image_status='processing',
+                        image_claimed_at=recipe.image_claimed_at)
+                .only('id', 'user_id').first()
+            )
+            if current is None:
+                # Replaced or deleted while rendering: a new upload is
+                # pending again and gets its own renditions.
+                transaction.on_commit(lambda: delete_renditions(renditions))
+                return True
+            current.image_renditions = renditions
+            current.image_status = image_status
+            current.image_claimed_at = None
+            current.save(update_fields=['image_status', 'image_renditions',
+                                        'image_claimed_at'])
+        return True
@@ -0,0 +1,38 @@
+"""Django command to print a token that turns on request profiling."""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import User
+from core.profiling import make_token
+
+
+class Command(BaseCommand):
+    """Print a signed token for the ``X-Profile`` header.
+
+    Send it as ``X-Profile: <token>`` on requests authenticated as the
+    staff user it was made for; the response's ``X-Profile-Id`` names the
+    files written under PROFILE_DIR.
+    """
+
+    help = ('Print a token that profiles the requests of a staff user '
+            'carrying it.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--email', required=True,
+                            help='Staff user whose requests the token '
+                            'profiles.')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        try:
+            user = User.objects.get(email=options['email'], is_staff=True)
+        except User.DoesNotExist:
+            raise CommandError(f'No staff user with email {options["email"]}')
+        if not settings.PROFILE_DIR:
+            raise CommandError('Profiling is off: set PROFILE_DIR first.')
+
+        self.stdout.write(make_token(user))
+        self.stderr.write(
+            f'Valid for {settings.PROFILE_TOKEN_MAX_AGE} seconds; '
+            f'profiles are written to {settings.PROFILE_DIR}.')
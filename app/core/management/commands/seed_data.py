@@ -0,0 +1,359 @@
+"""Django command to generate a large synthetic dataset with COPY."""
+
+import csv
+import io
+import itertools
+import multiprocessing
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image
+
+from core.management.commands.import_recipes import RECIPE_COLUMNS
+from core.models import ImageBlob, Ingredient, Recipe, Tag, User
+from core.storage import is_content_addressed
+
+USER_COLUMNS = ['id', 'password', 'is_superuser', 'email', 'name',
+                'is_active', 'is_staff', 'username', 'date_joined',
+                'first_name', 'last_name']
+
+TAG_WORDS = [
+    'Dinner', 'Lunch', 'Breakfast', 'Brunch', 'Dessert', 'Snack', 'Vegan',
+    'Vegetarian', 'Gluten free', 'Quick', 'Easy', 'Healthy', 'Comfort food',
+    'Italian', 'Mexican', 'Indian', 'Chinese', 'Japanese', 'Thai', 'French',
+    'Spicy', 'Summer', 'Winter', 'Holiday', 'Party', 'Kids', 'Baking',
+    'Grill', 'Slow cooker', 'One pot', 'Meal prep', 'Low carb',
+    'High protein',
+]
+INGREDIENT_WORDS = [
+    'Salt', 'Pepper', 'Olive oil', 'Butter', 'Garlic', 'Onion', 'Flour',
+    'Sugar', 'Eggs', 'Milk', 'Cream', 'Cheese', 'Tomato', 'Basil', 'Parsley',
+    'Lemon', 'Lime', 'Chicken', 'Beef', 'Pork', 'Salmon', 'Shrimp', 'Rice',
+    'Pasta', 'Potato', 'Carrot', 'Celery', 'Spinach', 'Mushroom',
+    'Bell pepper', 'Chili', 'Ginger', 'Soy sauce', 'Honey', 'Vinegar',
+    'Yogurt', 'Beans', 'Lentils', 'Chickpeas', 'Coconut milk', 'Cumin',
+    'Paprika', 'Oregano', 'Thyme', 'Cinnamon', 'Vanilla', 'Chocolate',
+    'Almonds', 'Walnuts', 'Oats',
+]
+ADJECTIVES = ['Classic', 'Easy', 'Spicy', 'Creamy', 'Crispy', 'Roasted',
+              'Grilled', 'Smoky', 'Zesty', 'Hearty', 'Light', 'Sweet', 'Tangy',
+              'Rustic']
+DISHES = ['Soup', 'Salad', 'Stew', 'Curry', 'Pasta', 'Tacos', 'Risotto', 'Pie',
+          'Stir fry', 'Bowl', 'Casserole', 'Sandwich', 'Cake', 'Bread',
+          'Pancakes']
+# Tags per recipe, 0 to 5, and how often each count occurs.
+TAG_FANOUT_WEIGHTS = [10, 25, 30, 20, 10, 5]
+
+
+def skewed_counts(rng, total, buckets, skew):
+    """Split ``total`` over ``buckets`` with Pareto(``skew``) weights.
+
+    Lower ``skew`` means a heavier tail: a few buckets get most items.
+    """
+    weights = [rng.paretovariate(skew) for _ in range(buckets)]
+    scale = total / sum(weights)
+    counts = [int(weight * scale) for weight in weights]
+    for index in rng.sample(range(buckets), total - sum(counts)):
+        counts[index] += 1
+    return counts
+
+
+def vocabulary(words, size):
+    """Return ``size`` distinct names, numbering repeats of ``words``."""
+    names = []
+    for index in range(size):
+        repeat, position = divmod(index, len(words))
+        names.append(f'{words[position]} {repeat + 1}' if repeat
+                     else words[position])
+    return names
+
+
+def pick(rng, items, cum_weights, count):
+    """Pick ``count`` distinct items, favouring the heavily weighted ones."""
+    count = min(count, len(items))
+    picked = set()
+    while len(picked) < count:
+        picked.update(rng.choices(range(len(items)), cum_weights=cum_weights,
+                                  k=count - len(picked)))
+    return sorted(items[index] for index in picked)
+
+
+def zipf_cum_weights(size):
+    return list(itertools.accumulate(
+        1 / rank for rank in range(1, size + 1)))
+
+
+def _copy(cursor, table, columns, rows, options='FORMAT csv'):
+    buffer = io.StringIO()
+    csv.writer(buffer, quoting=csv.QUOTE_ALL).writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert(
+        f'COPY {table} ({", ".join(columns)}) FROM STDIN WITH ({options})',
+        buffer)
+
+
+def _next_ids(cursor, model, count):
+    cursor.execute(
+        'SELECT nextval(pg_get_serial_sequence(%s, %s)) '
+        'FROM generate_series(1, %s)', [model._meta.db_table, 'id', count])
+    return [row[0] for row in cursor.fetchall()]
+
+
+class Loader:
+    """Load batches of users with their tags, ingredients and recipes.
+
+    Holds only plain data so it can be sent to worker processes.
+    """
+
+    def __init__(self, options, password, placeholder):
+        self.prefix = options['email_prefix']
+        self.images = options['images']
+        self.chunk_size = options['chunk_size']
+        self.password = password
+        self.placeholder = placeholder
+
+    def email(self, number):
+        return f'{self.prefix}{number}@example.com'
+
+    def load_batch(self, seed, users):
+        """Load ``[(number, recipes, tags, ingredients)]`` users.
+
+        Returns the number of recipes loaded.
+        """
+        rng = random.Random(seed)
+        now = timezone.now().isoformat()
+        with transaction.atomic(), connection.cursor() as cursor:
+            user_ids = _next_ids(cursor, User, len(users))
+            _copy(cursor, User._meta.db_table, USER_COLUMNS, (
+                [user_id, self.password, False, self.email(number),
+                 f'Seed user {number}', True, False, f'{self.prefix}{number}',
+                 now, 'Seed', str(number)]
+                for user_id, (number, *_) in zip(user_ids, users)
+            ))
+
+            names = {}
+            vocabularies = ((Tag, TAG_WORDS, 2),
+                            (Ingredient, INGREDIENT_WORDS, 3))
+            for model, words, size_index in vocabularies:
+                total = sum(user[size_index] for user in users)
+                ids = iter(_next_ids(cursor, model, total))
+                rows = []
+                for user_id, user in zip(user_ids, users):
+                    vocab = [(next(ids), name)
+                             for name in vocabulary(words, user[size_index])]
+                    # Shuffle so the most used names differ between users.
+                    rng.shuffle(vocab)
+                    names[model, user_id] = (vocab,
+                                             zipf_cum_weights(len(vocab)))
+                    rows.extend([pk, name, user_id] for pk, name in vocab)
+                _copy(cursor, model._meta.db_table,
+                      ['id', 'name', 'user_id'], rows)
+
+        recipes = ((user_id, names[Tag, user_id], names[Ingredient, user_id])
+                   for user_id, user in zip(user_ids, users)
+                   for _ in range(user[1]))
+        loaded = 0
+        while True:
+            chunk = list(itertools.islice(recipes, self.chunk_size))
+            if not chunk:
+                return loaded
+            with transaction.atomic():
+                self._copy_recipes(rng, chunk)
+            loaded += len(chunk)
+
+    def _copy_recipes(self, rng, chunk):
+        with connection.cursor() as cursor:
+            ids = _next_ids(cursor, Recipe, len(chunk))
+            rows, tag_links, ingredient_links = [], [], []
+            with_image = 0
+            for recipe_id, (user_id, tags, ingredients) in zip(ids, chunk):
+                tag_pairs = pick(rng, *tags,
+                                 rng.choices(range(6), TAG_FANOUT_WEIGHTS)[0])
+                ingredient_pairs = pick(rng, *ingredients,
+                                        max(1, round(rng.gauss(7, 2.5))))
+                tag_links.extend([recipe_id, pk] for pk, _ in tag_pairs)
+                ingredient_links.extend(
+                    [recipe_id, pk] for pk, _ in ingredient_pairs)
+                dish = f'{rng.choice(ADJECTIVES)} {rng.choice(DISHES)}'
+                has_image = (self.placeholder is not None
+                             and rng.random() < self.images)
+                with_image += has_image
+                tag_names = [name for _, name in tag_pairs]
+                ingredient_names = [name for _, name in ingredient_pairs]
+                row = {
+                    'id': recipe_id,
+                    'user_id': user_id,
+                    'title': f'{dish} with {ingredient_names[0].lower()}',
+                    'description': f'{dish} made with '
+                                   f'{", ".join(ingredient_names).lower()}.',
+                    # Cooking times cluster around half an hour.
+                    'time_minutes': max(
+                        1, round(rng.lognormvariate(3.4, 0.6))),
+                    'price': '%.2f' % min(999.99,
+                                          rng.lognormvariate(2.2, 0.7)),
+                    'link': (f'https://example.com/recipes/{recipe_id}'
+                             if rng.random() < 0.3 else ''),
+                    'image': self.placeholder if has_image else '',
+                    'image_status': 'ready' if has_image else 'none',
+                    'image_renditions': '{}',
+                    # Generated names need no escaping, unlike pg_array()
+                    # input.
+                    'tag_ids': '{%s}' % ','.join(
+                        str(pk) for pk, _ in tag_pairs),
+                    'tag_names': ('{"%s"}' % '","'.join(tag_names)
+                                  if tag_names else '{}'),
+                    'ingredient_ids': '{%s}' % ','.join(
+                        str(pk) for pk, _ in ingredient_pairs),
+                    'ingredient_names': '{"%s"}' % '","'.join(
+                        ingredient_names),
+                }
+                rows.append([row[column] for column in RECIPE_COLUMNS])
+
+            _copy(cursor, Recipe._meta.db_table, RECIPE_COLUMNS, rows,
+                  options='FORMAT csv, FORCE_NULL (image)')
+            links_by_relation = (('tags', tag_links),
+                                 ('ingredients', ingredient_links))
+            for relation, links in links_by_relation:
+                field = Recipe._meta.get_field(relation)
+                _copy(cursor, field.m2m_db_table(),
+                      [field.m2m_column_name(), field.m2m_reverse_name()],
+                      links)
+        if with_image and is_content_addressed(self.placeholder):
+            # Every recipe holds a reference to the shared blob.
+            ImageBlob.objects.filter(name=self.placeholder).update(
+                ref_count=F('ref_count') + with_image)
+
+
+def _load_in_worker(loader, seed, users):
+    return loader.load_batch(seed, users)
+
+
+class Command(BaseCommand):
+    """Generate users, tags, ingredients and recipes for benchmarking.
+
+    Everything derives from ``--seed``, so a run can be reproduced on
+    another database. Users are loaded in batches, each batch and its
+    recipes committed in ``--chunk-size`` COPY chunks, so memory stays flat
+    however large the dataset. Most of the time goes to the foreign key
+    checks at commit and the search vector trigger, so ``--jobs`` loads
+    batches in parallel processes.
+    """
+
+    help = 'Generate a seeded synthetic dataset using PostgreSQL COPY.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=100000,
+                            help='Total number of recipes.')
+        parser.add_argument('--tags', type=int, default=20,
+                            help='Average number of tags per user.')
+        parser.add_argument('--ingredients', type=int, default=60,
+                            help='Average number of ingredients per user.')
+        parser.add_argument('--skew', type=float, default=1.5,
+                            help='Pareto shape of the per-user sizes; lower '
+                            'is more skewed.')
+        parser.add_argument('--images', type=float, default=0.0,
+                            help='Fraction of recipes given a placeholder '
+                            'image.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--email-prefix', default='seed',
+                            help='Users are <prefix><n>@example.com.')
+        parser.add_argument('--password', default='seed-pass123')
+        parser.add_argument('--user-batch', type=int, default=1000,
+                            help='Users created per batch.')
+        parser.add_argument('--chunk-size', type=int, default=20000,
+                            help='Recipes per COPY chunk and transaction.')
+        parser.add_argument('--jobs', type=int, default=1,
+                            help='Worker processes loading batches in '
+                            'parallel.')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        if options['users'] < 1 or options['recipes'] < 0:
+            raise CommandError(
+                '--users must be positive and --recipes not negative.')
+        if options['skew'] <= 0:
+            raise CommandError('--skew must be positive.')
+        placeholder = self._placeholder() if options['images'] else None
+        loader = Loader(options, make_password(options['password']),
+                        placeholder)
+        if User.objects.filter(email=loader.email(0)).exists():
+            raise CommandError(
+                f'{loader.email(0)} exists; pass another --email-prefix.')
+
+        rng = random.Random(options['seed'])
+        users = options['users']
+        recipe_counts = skewed_counts(rng, options['recipes'], users,
+                                      options['skew'])
+        # Vocabulary sizes are skewed too, but never below 3 names.
+        tag_counts, ingredient_counts = (
+            [max(3, min(10 * mean, round(mean * weight)))
+             for weight in self._weights(rng, users, options['skew'])]
+            for mean in (options['tags'], options['ingredients'])
+        )
+        batch_size = options['user_batch']
+        batches = [
+            (f'{options["seed"]}:{first}',
+             [(number, recipe_counts[number], tag_counts[number],
+               ingredient_counts[number])
+              for number in range(first, min(first + batch_size, users))])
+            for first in range(0, users, batch_size)
+        ]
+
+        started = time.perf_counter()
+        loaded = 0
+        results = self._run(loader, batches, options['jobs'])
+        for done, count in enumerate(results, 1):
+            loaded += count
+            self.stdout.write(
+                f'{done}/{len(batches)} user batches, {loaded} recipes '
+                f'({loaded / (time.perf_counter() - started):.0f} recipes/sec)'
+            )
+
+        if placeholder and is_content_addressed(placeholder):
+            # Saving the placeholder counted a reference no recipe holds.
+            ImageBlob.objects.filter(name=placeholder).update(
+                ref_count=F('ref_count') - 1)
+        with connection.cursor() as cursor:
+            for model in (User, Tag, Ingredient, Recipe):
+                cursor.execute(f'ANALYZE {model._meta.db_table}')
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {users} users and {loaded} recipes in {elapsed:.1f}s'
+        ))
+
+    def _run(self, loader, batches, jobs):
+        """Yield the recipe count of each loaded batch."""
+        if jobs <= 1:
+            for seed, users in batches:
+                yield loader.load_batch(seed, users)
+            return
+        # Forked workers must not share the parent's connection.
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(jobs, mp_context=context) as pool:
+            futures = [pool.submit(_load_in_worker, loader, seed, users)
+                       for seed, users in batches]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def _weights(self, rng, size, skew):
+        # Pareto weights normalized to a mean of 1.
+        weights = [rng.paretovariate(skew) for _ in range(size)]
+        mean = sum(weights) / size
+        return [weight / mean for weight in weights]
+
+    def _placeholder(self):
+        buffer = io.BytesIO()
+        image = Image.new('RGB', (640, 480), (220, 200, 170))
+        image.save(buffer, format='JPEG')
+        storage = Recipe._meta.get_field('image').storage
+        return storage.save('uploads/recipe/seed-placeholder.jpg',
+                            ContentFile(buffer.getvalue()))
@@ -0,0 +1,61 @@
+"""Django command to backfill or verify Recipe's tag/ingredient arrays."""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.models import RELATED_ARRAYS, Recipe
+from recipe.cache import bump_version
+
+
+class Command(BaseCommand):
+    """Rebuild the denormalized arrays from the through tables in batches."""
+
+    help = ('Backfill (default) or verify the denormalized tag/ingredient '
+            'arrays.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--verify', action='store_true',
+                            help='Only report recipes whose arrays are stale.')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        fields = [name for pair in RELATED_ARRAYS.values() for name in pair]
+        batch_size = options['batch_size']
+        last_id = 0
+        processed = mismatched = 0
+
+        while True:
+            batch = list(
+                Recipe.objects.filter(pk__gt=last_id).order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1]
+            recipes = Recipe.objects.filter(pk__in=batch)
+            if options['verify']:
+                rows = recipes.with_computed_arrays().values('pk', *fields, *[
+                    f'computed_{name}' for name in fields
+                ])
+                for row in rows:
+                    if any(row[name] != row[f'computed_{name}']
+                           for name in fields):
+                        mismatched += 1
+                        self.stdout.write(f'Recipe {row["pk"]} is out of sync')
+            else:
+                with transaction.atomic():
+                    recipes.sync_related_arrays()
+                # Cached lists and ETags of these users still show the old
+                # arrays.
+                user_ids = recipes.values_list('user_id', flat=True)
+                for user_id in user_ids.distinct():
+                    bump_version(user_id)
+            processed += len(batch)
+            self.stdout.write(
+                f'{processed} recipes processed (last id {last_id})')
+
+        if options['verify'] and mismatched:
+            raise CommandError(
+                f'{mismatched} of {processed} recipes out of sync')
+        self.stdout.write(self.style.SUCCESS(f'{processed} recipes in sync'))
@@ -0,0 +1,230 @@
+"""Per-request timings as Server-Timing headers and Prometheus histograms.
+
+``RequestMetricsMiddleware`` measures, for every request, the database
+queries (through ``connection.execute_wrapper``), serializer, render and
+total time. They are returned in a ``Server-Timing`` header and observed
+into per-view histograms, labelled by URL pattern, served by
+``metrics_view``.
+
+Under uwsgi or several uvicorn workers, set ``PROMETHEUS_MULTIPROC_DIR``
+to an empty directory before the server starts (scripts/run.sh clears
+it): every worker then writes its samples to files there and
+``metrics_view`` sums them all. Workers call ``mark_process_dead()`` on
+exit, see app/wsgi.py and app/asgi.py, so recycled workers drop out of
+the live gauges.
+
+Counts kept in a shared store rather than per process, such as the
+attempts ``core.ratelimit`` rejected, are read from it at scrape time
+by a collector.
+
+``metrics_view`` answers 403 unless ``METRICS_TOKEN`` is set and sent
+as a bearer token.
+"""
+
+import os
+import time
+from contextlib import ExitStack, contextmanager
+
+from asgiref.local import Local
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Gauge, Histogram,
+                               generate_latest, multiprocess)
+from prometheus_client.core import CounterMetricFamily
+
+from core.db.backends.postgresql.base import pool_stats
+from core.ratelimit import rejected_counts
+
+PHASES = ('db', 'serialize', 'render', 'total')
+
+REQUEST_SECONDS = Histogram(
+    'http_request_phase_seconds',
+    'Time spent per request, by route and phase.',
+    ['route', 'phase'],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10),
+)
+REQUEST_QUERIES = Histogram(
+    'http_request_db_queries', 'Database queries per request, by route.',
+    ['route'], buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 250),
+)
+DB_POOL = Gauge(
+    'db_pool', 'Connection pool counters of core.db.backends.postgresql.',
+    ['alias', 'stat'], multiprocess_mode='livesum',
+)
+# Pool counters are refreshed at most this often per process.
+POOL_REFRESH_SECONDS = 5
+
+_local = Local()
+_pool_refreshed = 0
+
+
+class RequestTimings:
+    """Durations collected while one request is handled."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.serializing = False
+        self.render_started = None
+
+    def __call__(self, execute, sql, params, many, context):
+        # Installed with connection.execute_wrapper().
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds['db'] += time.perf_counter() - started
+            self.queries += 1
+
+    def server_timing(self):
+        return ', '.join(
+            f'{phase};dur={self.seconds[phase] * 1000:.1f}'
+            + (f';desc="{self.queries} queries"' if phase == 'db' else '')
+            for phase in PHASES
+        )
+
+
+def current_timings():
+    return getattr(_local, 'timings', None)
+
+
+@contextmanager
+def track_request():
+    """Collect timings for the request handled inside the block."""
+    timings = RequestTimings()
+    previous = current_timings()
+    _local.timings = timings
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timings))
+            yield timings
+    finally:
+        _local.timings = previous
+
+
+def record(request, response, timings):
+    """Add the Server-Timing header and observe the request's histograms."""
+    timings.seconds['total'] = time.perf_counter() - timings.started
+    response['Server-Timing'] = timings.server_timing()
+    # The URL pattern identifies the view; some URL names are reused.
+    match = getattr(request, 'resolver_match', None)
+    route = match.route if match else 'unmatched'
+    for phase, seconds in timings.seconds.items():
+        REQUEST_SECONDS.labels(route, phase).observe(seconds)
+    REQUEST_QUERIES.labels(route).observe(timings.queries)
+    _refresh_pool_stats()
+
+
+def _refresh_pool_stats():
+    global _pool_refreshed
+    now = time.monotonic()
+    if now - _pool_refreshed < POOL_REFRESH_SECONDS:
+        return
+    _pool_refreshed = now
+    for alias, stats in pool_stats().items():
+        for stat, value in stats.items():
+            DB_POOL.labels(alias, stat).set(value)
+
+
+class RequestMetricsMiddleware:
+    """Time each request and report it in ``Server-Timing`` and histograms."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with track_request() as timings:
+            response = self.get_response(request)
+        record(request, response, timings)
+        return response
+
+    def process_template_response(self, request, response):
+        # Runs right before DRF responses are rendered.
+        timings = current_timings()
+        if timings is not None:
+            timings.render_started = time.perf_counter()
+            response.add_post_render_callback(self._rendered)
+        return response
+
+    def _rendered(self, response):
+        timings = current_timings()
+        if timings is not None and timings.render_started is not None:
+            timings.seconds['render'] += (time.perf_counter()
+                                          - timings.render_started)
+
+
+class TimedSerializerMixin:
+    """Count a serializer's ``to_representation()`` as serializer time.
+
+    Nested and per-item calls of list serializers are summed once; queries
+    they trigger are included, and also counted as database time.
+    """
+
+    def to_representation(self, instance):
+        timings = current_timings()
+        if timings is None or timings.serializing:
+            return super().to_representation(instance)
+        timings.serializing = True
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            timings.serializing = False
+            timings.seconds['serialize'] += time.perf_counter() - started
+
+
+class LoginRateLimitCollector:
+    """Report the attempts the login rate limit rejected, from its store.
+
+    The store is shared by all workers, so its counts are already totals
+    and are read at scrape time, not written to per-process files.
+    """
+
+    def _family(self):
+        return CounterMetricFamily(
+            'login_rate_limit_rejected',
+            'Password attempts rejected before hashing, by scope.',
+            labels=['scope'],
+        )
+
+    def describe(self):
+        # Lets the registry check names without reading the store.
+        yield self._family()
+
+    def collect(self):
+        family = self._family()
+        for scope, count in rejected_counts().items():
+            family.add_metric([scope], count)
+        yield family
+
+
+LOGIN_RATE_LIMIT = LoginRateLimitCollector()
+REGISTRY.register(LOGIN_RATE_LIMIT)
+
+
+def mark_process_dead():
+    """Drop this worker's live gauge samples from PROMETHEUS_MULTIPROC_DIR."""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def metrics_view(request):
+    """Serve the metrics in the Prometheus text format."""
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if not token or not constant_time_compare(authorization,
+                                              f'Bearer {token}'):
+        return HttpResponseForbidden()
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(LOGIN_RATE_LIMIT)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry),
+                        content_type=CONTENT_TYPE_LATEST)
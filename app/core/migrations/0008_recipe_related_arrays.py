@@ -0,0 +1,65 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:51
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+# Fill the new arrays from the through tables, ordered by id like
+# RecipeQuerySet.sync_related_arrays(), so existing recipes keep their
+# tags and ingredients.
+BACKFILL = """
+UPDATE core_recipe recipe SET
+    tag_ids = ARRAY(
+        SELECT tag.id FROM core_recipe_tags link JOIN core_tag tag ON tag.id = link.tag_id
+        WHERE link.recipe_id = recipe.id ORDER BY tag.id),
+    tag_names = ARRAY(
+        SELECT tag.name FROM core_recipe_tags link JOIN core_tag tag ON tag.id = link.tag_id
+        WHERE link.recipe_id = recipe.id ORDER BY tag.id),
+    ingredient_ids = ARRAY(
+        SELECT item.id FROM core_recipe_ingredients link
+        JOIN core_ingredient item ON item.id = link.ingredient_id
+        WHERE link.recipe_id = recipe.id ORDER BY item.id),
+    ingredient_names = ARRAY(
+        SELECT item.name FROM core_recipe_ingredients link
+        JOIN core_ingredient item ON item.id = link.ingredient_id
+        WHERE link.recipe_id = recipe.id ORDER BY item.id);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredient_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), default=list, editable=False, size=None),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredient_names',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=255), default=list, editable=False, size=None),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='tag_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), default=list, editable=False, size=None),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='tag_names',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=255), default=list, editable=False, size=None),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['tag_ids'], name='recipe_tag_ids_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['ingredient_ids'], name='recipe_ingredient_ids_idx'),
+        ),
+        migrations.RunSQL(BACKFILL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,58 @@
+from django.db import migrations
+
+
+# Merge case-insensitive duplicates into the lowest id, re-pointing recipe
+# links and rebuilding the affected recipes' arrays, then enforce
+# uniqueness on (user, lower(name)).
+MERGE_AND_INDEX = """
+CREATE TEMP TABLE {table}_dups ON COMMIT DROP AS
+    SELECT id, keeper FROM (
+        SELECT id, min(id) OVER (PARTITION BY user_id, lower(name)) AS keeper
+        FROM {table}
+    ) ranked WHERE id <> keeper;
+
+INSERT INTO {through} (recipe_id, {column})
+    SELECT link.recipe_id, dups.keeper
+    FROM {through} link JOIN {table}_dups dups ON dups.id = link.{column}
+    ON CONFLICT DO NOTHING;
+
+DELETE FROM {through} link USING {table}_dups dups WHERE link.{column} = dups.id;
+
+UPDATE core_recipe recipe SET
+    {ids_field} = ARRAY(
+        SELECT item.id FROM {through} link JOIN {table} item ON item.id = link.{column}
+        WHERE link.recipe_id = recipe.id ORDER BY item.id),
+    {names_field} = ARRAY(
+        SELECT item.name FROM {through} link JOIN {table} item ON item.id = link.{column}
+        WHERE link.recipe_id = recipe.id ORDER BY item.id)
+    WHERE recipe.{ids_field} && ARRAY(SELECT id FROM {table}_dups);
+
+DELETE FROM {table} item USING {table}_dups dups WHERE item.id = dups.id;
+
+-- Flush the deferred FK checks queued by the deletes before indexing.
+SET CONSTRAINTS ALL IMMEDIATE;
+
+CREATE UNIQUE INDEX {table}_user_lower_name_uniq ON {table} (user_id, lower(name));
+"""
+
+DROP_INDEX = 'DROP INDEX IF EXISTS {table}_user_lower_name_uniq;'
+
+RELATIONS = [
+    {'table': 'core_tag', 'through': 'core_recipe_tags', 'column': 'tag_id',
+     'ids_field': 'tag_ids', 'names_field': 'tag_names'},
+    {'table': 'core_ingredient', 'through': 'core_recipe_ingredients',
+     'column': 'ingredient_id', 'ids_field': 'ingredient_ids',
+     'names_field': 'ingredient_names'},
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_recipe_related_arrays'),
+    ]
+
+    operations = [
+        migrations.RunSQL(MERGE_AND_INDEX.format(**relation), DROP_INDEX.format(**relation))
+        for relation in RELATIONS
+    ]
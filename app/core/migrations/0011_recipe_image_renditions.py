@@ -0,0 +1,32 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_recipeimport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_renditions',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_status',
+            field=models.CharField(choices=[('none', 'No image'), ('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='none', max_length=10),
+        ),
+        migrations.RunSQL(
+            "UPDATE core_recipe SET image_status = 'pending' "
+            "WHERE image IS NOT NULL AND image <> ''",
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(('image_status', 'pending')), fields=['id'], name='recipe_image_pending_idx'),
+        ),
+    ]
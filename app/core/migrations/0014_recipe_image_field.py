@@ -0,0 +1,20 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:02
+
+import core.models
+import core.storage
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_imageupload'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=core.storage.RecipeImageField(null=True, storage=core.storage.recipe_image_storage, upload_to=core.models.recipe_image_file_path),
+        ),
+    ]
@@ -1,10 +1,17 @@
 ""
-from django.db import models
+from django.db import connections, models, router
+from django.db.models.functions import Cast
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import (SearchQuery,
+                                            SearchRank,
+                                            SearchVectorField)
 from django.contrib.auth.models import (AbstractBaseUser, 
                                         BaseUserManager, 
                                         PermissionsMixin)
 from django.conf import settings
 from django.utils import timezone
+from core.storage import RecipeImageField, recipe_image_storage
 from rest_framework import status
 from rest_framework.response import Response
  
@@ -62,6 +69,134 @@ class User(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = 'email'
 
 
+SEARCH_CONFIG = 'english'
+
+# M2M relation -> denormalized (ids, names) array fields on Recipe.
+RELATED_ARRAYS = {
+    'tags': ('tag_ids', 'tag_names'),
+    'ingredients': ('ingredient_ids', 'ingredient_names'),
+}
+ARRAY_FIELDS = [field for fields in RELATED_ARRAYS.values()
+                for field in fields]
+
+
+class RecipeQuerySet(models.QuerySet):
+    """QuerySet for recipes."""
+
+    def _related_arrays(self, relations):
+        """Return ARRAY(SELECT ...) expressions rebuilding the arrays."""
+        arrays = {}
+        for relation in relations:
+            related = self.model._meta.get_field(relation).related_model
+            linked = (related.objects.filter(recipe=models.OuterRef('pk'))
+                      .order_by('id'))
+            columns = zip(RELATED_ARRAYS[relation], ('id', 'name'))
+            for array_field, column in columns:
+                arrays[array_field] = models.Func(
+                    models.Subquery(linked.values(column)),
+                    function='ARRAY',
+                    output_field=self.model._meta.get_field(array_field),
+                )
+        return arrays
+
+    def with_computed_arrays(self, relations=tuple(RELATED_ARRAYS)):
+        """Annotate ``computed_<field>`` from the through tables."""
+        return self.annotate(**{
+            f'computed_{name}': expression
+            for name, expression in self._related_arrays(relations).items()
+        })
+
+    def sync_related_arrays(self, relations=tuple(RELATED_ARRAYS)):
+        """Rebuild the denormalized tag/ingredient arrays in one UPDATE."""
+        return self.update(**self._related_arrays(relations))
+
+    def with_related_ids(self, relation, ids, match='any'):
+        """Filter to recipes linked to any or all of ``ids``.
+
+        Uses array containment (``@>`` for all, ``&&`` for any) on the
+        GIN-indexed id arrays, so no through table is joined and each
+        recipe appears once.
+        """
+        ids = sorted(set(ids))
+        if not ids:
+            return self.none()
+        ids_field = RELATED_ARRAYS[relation][0]
+        lookup = 'contains' if match == 'all' else 'overlap'
+        return self.filter(**{f'{ids_field}__{lookup}': ids})
+
+    def search(self, text):
+        """Filter on title/description and annotate a relevance rank.
+
+        Matches go through the GIN index on ``search_vector``. The rank
+        is cast to double precision so it round-trips exactly through
+        pagination cursors.
+        """
+        query = SearchQuery(text, config=SEARCH_CONFIG,
+                            search_type='websearch')
+        return self.filter(search_vector=query).annotate(
+            rank=Cast(
+                SearchRank(models.F('search_vector'), query),
+                models.FloatField(),
+            ),
+        )
+
+
+def normalize_name(name):
+    """Collapse whitespace in a tag/ingredient name."""
+    return ' '.join(name.split())
+
+
+class NamedQuerySet(models.QuerySet):
+    """QuerySet for per-user named objects (tags and ingredients).
+
+    Names are unique per user ignoring case, enforced by a
+    ``(user_id, lower(name))`` unique index (migration 0009).
+    """
+
+    def get_or_create_many(self, user, names):
+        """Resolve ``names`` to ids, inserting the missing ones.
+
+        Returns ``({normalized name: id}, created_names)``. Names are
+        matched with PostgreSQL's ``lower()``, like the unique index, as
+        Python's ``str.lower()`` disagrees with it on some characters.
+        Existing rows are read in one query and missing ones added with a
+        single batched ``INSERT ... ON CONFLICT DO NOTHING``; rows a
+        concurrent request inserted first are picked up by a final read.
+        """
+        wanted = list(dict.fromkeys(filter(None, map(normalize_name, names))))
+        db = router.db_for_write(self.model)
+
+        def lookup(keys):
+            with connections[db].cursor() as cursor:
+                cursor.execute(
+                    'SELECT wanted.name, named.id '
+                    'FROM unnest(%s::text[]) AS wanted(name) '
+                    f'JOIN {self.model._meta.db_table} named '
+                    'ON named.user_id = %s '
+                    'AND lower(named.name) = lower(wanted.name)',
+                    [keys, user.pk],
+                )
+                return dict(cursor.fetchall())
+
+        ids = lookup(wanted)
+        missing = [name for name in wanted if name not in ids]
+        created = []
+        if missing:
+            self.using(db).bulk_create(
+                [self.model(user=user, name=name) for name in missing],
+                ignore_conflicts=True,
+            )
+            new_ids = lookup(missing)
+            ids.update(new_ids)
+            # Spellings differing only in case share the row of the first.
+            seen = set()
+            for name in missing:
+                if new_ids[name] not in seen:
+                    seen.add(new_ids[name])
+                    created.append(name)
+        return ids, created
+
+
 class Recipe(models.Model):
     """Recipe object."""
     user = models.ForeignKey(
@@ -75,8 +210,67 @@ class Recipe(models.Model):
     time_minutes = models.IntegerField()
     price = models.DecimalField(max_digits=5, decimal_places=2)
     link = models.CharField(max_length=255, blank=True) 
-    image = models.ImageField(null=True,upload_to=recipe_image_file_path)
+    image = RecipeImageField(null=True, upload_to=recipe_image_file_path,
+                             storage=recipe_image_storage)
+    # Renditions are rendered off-request by `manage.py process_images`.
+    image_status = models.CharField(
+        max_length=10,
+        choices=[
+            ('none', 'No image'),
+            ('pending', 'Pending'),
+            ('processing', 'Processing'),
+            ('ready', 'Ready'),
+            ('failed', 'Failed'),
+        ],
+        default='none',
+    )
+    image_renditions = models.JSONField(default=dict, blank=True)
+    # When a worker set 'processing'; a claim older than its timeout is
+    # taken to be from a worker that died and is retried.
+    image_claimed_at = models.DateTimeField(null=True, blank=True)
     # attachments = models.FileField(upload_to=recipe_image_file_path)
+    # Maintained by a database trigger, see migration 0007.
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Denormalized copies of the M2M relations, ordered by id and kept in
+    # sync by core.signals. See RecipeQuerySet.sync_related_arrays().
+    tag_ids = ArrayField(models.BigIntegerField(), default=list,
+                         editable=False)
+    tag_names = ArrayField(models.CharField(max_length=255), default=list,
+                           editable=False)
+    ingredient_ids = ArrayField(models.BigIntegerField(), default=list,
+                                editable=False)
+    ingredient_names = ArrayField(models.CharField(max_length=255),
+                                  default=list, editable=False)
+
+    objects = RecipeQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'],
+                     name='recipe_search_vector_idx'),
+            GinIndex(fields=['tag_ids'], name='recipe_tag_ids_idx'),
+            GinIndex(fields=['ingredient_ids'],
+                     name='recipe_ingredient_ids_idx'),
+            models.Index(fields=['id'], name='recipe_image_pending_idx',
+                         condition=models.Q(
+                             image_status__in=['pending', 'processing'])),
+        ]
+
+    def save(self, *args, **kwargs):
+        """Save the recipe, leaving the denormalized arrays alone.
+
+        The arrays are written by ``sync_related_arrays()`` only, so an
+        instance loaded before a concurrent tag/ingredient change cannot
+        put its stale copies back.
+        """
+        if (not self._state.adding and kwargs.get('update_fields') is None
+                and not kwargs.get('force_insert')):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in ARRAY_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
     def create(self, serializer):
         """Create a new recipe."""
         serializer.save(user=self.request.user)
@@ -94,6 +288,8 @@ class Tag(models.Model):
         on_delete=models.CASCADE
     )
 
+    objects = NamedQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
@@ -104,6 +300,72 @@ class Ingredient(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE
     )
+
+    objects = NamedQuerySet.as_manager()
     
     def __str__(self):
         return self.name
+
+
+class RecipeImport(models.Model):
+    """Progress of a ``manage.py import_recipes`` run.
+
+    Updated in the same transaction as each imported chunk, so a rerun
+    resumes exactly after the last committed record.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    source = models.CharField(max_length=255)
+    committed_records = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'source'],
+                                    name='recipe_import_user_source_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.source} ({self.committed_records})'
+
+
+class ImageUpload(models.Model):
+    """A resumable, chunked recipe image upload in progress.
+
+    Chunks are appended to ``partial_name`` in MEDIA_ROOT until ``offset``
+    reaches ``size``; finalizing attaches the file to the recipe.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE
+    )
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def partial_name(self):
+        return f'uploads/partial/{self.id}'
+
+    def __str__(self):
+        return f'{self.filename} ({self.offset}/{self.size})'
+
+
+class ImageBlob(models.Model):
+    """A content-addressed image file and the number of its references.
+
+    Maintained by ``core.storage.ContentAddressedStorage``.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.name} ({self.ref_count})'
@@ -0,0 +1,175 @@
+"""Profile single requests on demand, in production.
+
+A request is profiled when it carries a token from ``manage.py
+profile_token`` in the ``X-Profile`` header, or when it is picked at
+``PROFILE_SAMPLE_RATE``. It then runs under cProfile while a thread
+samples its stack every ``PROFILE_SAMPLE_INTERVAL`` seconds. Both are
+written to ``PROFILE_DIR/<view>/<time>-<request id>``:
+
+- ``.pstats``: load with ``pstats.Stats`` or snakeviz.
+- ``.collapsed``: folded stacks for flamegraph.pl or speedscope.
+
+A token is signed for one staff user: a profile is only kept if the
+request authenticated as that user, so a leaked token is useless on its
+own. Only the newest ``PROFILE_MAX_COUNT`` profiles are kept.
+
+The response names the files in ``X-Profile-Id``. Requests that are not
+profiled only pay for a header lookup; without ``PROFILE_DIR`` the
+middleware is not loaded at all.
+"""
+
+import cProfile
+import glob
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+
+SALT = 'core.profiling'
+
+
+def make_token(user):
+    """Return a token that profiles ``user``'s requests until it expires."""
+    return signing.TimestampSigner(salt=SALT).sign(str(user.pk))
+
+
+def token_user_id(token):
+    """Return the pk, as a string, of a valid token's user, else None."""
+    try:
+        value = signing.TimestampSigner(salt=SALT).unsign(
+            token, max_age=getattr(settings, 'PROFILE_TOKEN_MAX_AGE', 3600))
+    except signing.BadSignature:
+        return None
+    return value
+
+
+def should_profile(request):
+    """Return ``(profile?, pk of the user a token requires or None)``."""
+    if not getattr(settings, 'PROFILE_DIR', None):
+        return False, None
+    token = request.META.get('HTTP_X_PROFILE')
+    if token:
+        user_id = token_user_id(token)
+        return user_id is not None, user_id
+    rate = getattr(settings, 'PROFILE_SAMPLE_RATE', 0)
+    return bool(rate) and random.random() < rate, None
+
+
+def _allowed(request, user_id):
+    # DRF sets the user it authenticated on the Django request as well.
+    user = getattr(request, 'user', None)
+    return (user is not None and user.is_authenticated and user.is_staff
+            and str(user.pk) == user_id)
+
+
+def prune(directory, keep):
+    """Delete all but the newest ``keep`` profiles under ``directory``."""
+    profiles = []
+    pattern = os.path.join(glob.escape(directory), '*', '*.pstats')
+    for path in glob.glob(pattern):
+        try:
+            profiles.append((os.stat(path).st_mtime, path[:-len('.pstats')]))
+        except FileNotFoundError:
+            continue
+    profiles.sort()
+    for _, stem in profiles[:max(len(profiles) - keep, 0)]:
+        for ext in ('.pstats', '.collapsed'):
+            try:
+                os.unlink(stem + ext)
+            except FileNotFoundError:
+                pass
+
+
+class StackSampler(threading.Thread):
+    """Count the stacks of one thread below ``base`` at a fixed interval."""
+
+    def __init__(self, thread_id, base, interval):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.base = base
+        self.interval = interval
+        self.stacks = Counter()
+        self.finished = threading.Event()
+
+    def run(self):
+        while not self.finished.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None and frame is not self.base:
+                code = frame.f_code
+                path = _short_path(code.co_filename)
+                names.append(
+                    f'{code.co_name} ({path}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def stop(self):
+        self.finished.set()
+        self.join()
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n'
+                       for stack, count in self.stacks.most_common())
+
+
+def _short_path(path):
+    for prefix in sorted(sys.path, key=len, reverse=True):
+        if prefix and path.startswith(prefix + os.sep):
+            return path[len(prefix) + 1:]
+    return path
+
+
+def profile(request, handler):
+    """Return ``handler()``, profiled if ``request`` asks for it."""
+    wanted, user_id = should_profile(request)
+    if not wanted:
+        return handler()
+
+    request_id = re.sub(r'[^\w-]', '',
+                        request.META.get('HTTP_X_REQUEST_ID', ''))[:64]
+    request_id = request_id or uuid.uuid4().hex
+    sampler = StackSampler(threading.get_ident(), sys._getframe(),
+                           getattr(settings, 'PROFILE_SAMPLE_INTERVAL', 0.005))
+    profiler = cProfile.Profile()
+    sampler.start()
+    profiler.enable()
+    try:
+        response = handler()
+    finally:
+        profiler.disable()
+        sampler.stop()
+    if user_id is not None and not _allowed(request, user_id):
+        return response
+
+    match = getattr(request, 'resolver_match', None)
+    view = re.sub(r'[^\w.-]', '.', match.view_name) if match else 'unmatched'
+    name = f'{view}/{time.strftime("%Y%m%dT%H%M%S")}-{request_id}'
+    path = os.path.join(settings.PROFILE_DIR, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    profiler.dump_stats(f'{path}.pstats')
+    with open(f'{path}.collapsed', 'w') as fp:
+        fp.write(sampler.collapsed())
+    prune(settings.PROFILE_DIR, getattr(settings, 'PROFILE_MAX_COUNT', 100))
+    response['X-Profile-Id'] = name
+    return response
+
+
+class ProfilingMiddleware:
+    """Profile requests that carry a valid token or are sampled."""
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILE_DIR', None):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return profile(request, lambda: self.get_response(request))
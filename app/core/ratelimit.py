@@ -0,0 +1,96 @@
+"""Sliding-window rate limiting for password checks.
+
+Every login or token request runs a full PBKDF2 hash, so attempts are
+counted per client IP and per email *before* ``authenticate()`` is called,
+and rejected with 429 once either goes over its limit. Limits are
+``LOGIN_RATE_LIMITS = {scope: (attempts, window seconds)}``; the counters
+live in ``LOGIN_RATE_LIMIT_STORE``, shared by all workers. Client IPs
+honour ``REST_FRAMEWORK['NUM_PROXIES']``, so a spoofed X-Forwarded-For
+does not pick a fresh counter.
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import BaseThrottle
+
+DEFAULT_LIMITS = {'ip': (20, 60), 'email': (5, 300)}
+REJECTED_KEY = 'ratelimit:login:rejected:{scope}'
+
+
+class CacheRateStore:
+    """Sliding window counters kept in a Django cache backend.
+
+    Each window is approximated from two fixed buckets: the current one
+    and the previous one weighted by how much of it still overlaps.
+    """
+
+    def __init__(self, alias=None):
+        self.alias = alias or getattr(
+            settings, 'LOGIN_RATE_LIMIT_CACHE_ALIAS', 'default')
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def incr(self, key, timeout=None):
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            self.cache.add(key, 0, timeout=timeout)
+            return self.cache.incr(key)
+
+    def hit(self, key, window):
+        """Count one attempt.
+
+        Returns ``(attempts in window, seconds until retry)``.
+        """
+        now = time.time()
+        bucket, offset = divmod(now, window)
+        current = self.incr(f'{key}:{int(bucket)}', timeout=window * 2)
+        previous = self.cache.get(f'{key}:{int(bucket) - 1}', 0)
+        return previous * (1 - offset / window) + current, window - offset
+
+    def get_many(self, keys):
+        return self.cache.get_many(keys)
+
+
+def get_store():
+    path = getattr(settings, 'LOGIN_RATE_LIMIT_STORE',
+                   'core.ratelimit.CacheRateStore')
+    return import_string(path)()
+
+
+def _limits():
+    return getattr(settings, 'LOGIN_RATE_LIMITS', DEFAULT_LIMITS)
+
+
+def check_login_rate(request, email):
+    """Count a password attempt and raise ``Throttled`` when over a limit."""
+    store = get_store()
+    idents = {'ip': None, 'email': None}
+    if request is not None:
+        idents['ip'] = BaseThrottle().get_ident(request)
+    if email:
+        idents['email'] = hashlib.sha256(
+            email.strip().lower().encode()).hexdigest()
+    for scope, (limit, window) in _limits().items():
+        ident = idents.get(scope)
+        if ident is None:
+            continue
+        attempts, retry_after = store.hit(
+            f'ratelimit:login:{scope}:{ident}', window)
+        if attempts > limit:
+            store.incr(REJECTED_KEY.format(scope=scope))
+            raise Throttled(wait=retry_after)
+
+
+def rejected_counts():
+    """Return how many attempts each scope rejected, i.e. hashes saved."""
+    keys = {scope: REJECTED_KEY.format(scope=scope) for scope in _limits()}
+    values = get_store().get_many(keys.values())
+    return {scope: values.get(key, 0) for scope, key in keys.items()}
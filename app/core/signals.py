@@ -0,0 +1,145 @@
+"""Signal handlers keeping denormalized data, image refs and caches in sync."""
+
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from core.authentication import invalidate_tokens
+from core.images import delete_renditions
+from core.models import RELATED_ARRAYS, Ingredient, Recipe, Tag, User
+from core.storage import release_image
+
+RELATIONS = {
+    Recipe.tags.through: 'tags',
+    Recipe.ingredients.through: 'ingredients',
+    Tag: 'tags',
+    Ingredient: 'ingredients',
+}
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def sync_arrays_on_m2m_change(sender, instance, action, reverse, pk_set,
+                              **kwargs):
+    """Rebuild the arrays of every recipe whose links changed."""
+    relation = RELATIONS[sender]
+    if action == 'pre_clear' and reverse:
+        # The affected recipes are gone from the through table by post_clear.
+        instance._cleared_recipe_ids = list(
+            instance.recipe_set.values_list('pk', flat=True)
+        )
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        recipe_ids = [instance.pk]
+    elif action == 'post_clear':
+        recipe_ids = instance.__dict__.pop('_cleared_recipe_ids', [])
+    else:
+        recipe_ids = pk_set
+    if not recipe_ids:
+        return
+
+    Recipe.objects.filter(pk__in=recipe_ids).sync_related_arrays([relation])
+    if not reverse:
+        instance.refresh_from_db(fields=RELATED_ARRAYS[relation])
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def sync_arrays_on_rename(sender, instance, created, **kwargs):
+    """Propagate a tag/ingredient name change to its recipes."""
+    if created:
+        return
+    relation = RELATIONS[sender]
+    recipes = Recipe.objects.filter(**{relation: instance})
+    recipes.sync_related_arrays([relation])
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def remember_recipes_on_delete(sender, instance, **kwargs):
+    """Record linked recipes before the cascade removes the links."""
+    instance._linked_recipe_ids = list(
+        instance.recipe_set.values_list('pk', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def sync_arrays_on_delete(sender, instance, **kwargs):
+    """Drop a deleted tag/ingredient from its recipes' arrays."""
+    recipe_ids = instance.__dict__.pop('_linked_recipe_ids', [])
+    if recipe_ids:
+        Recipe.objects.filter(pk__in=recipe_ids).sync_related_arrays(
+            [RELATIONS[sender]]
+        )
+
+
+@receiver(post_delete, sender=Recipe)
+def release_image_on_delete(sender, instance, **kwargs):
+    """Release a deleted recipe's reference to its shared image file."""
+    release_image(instance.image.name)
+    renditions = instance.image_renditions
+    transaction.on_commit(lambda: delete_renditions(renditions))
+
+
+@receiver(pre_save, sender=Recipe)
+def remember_replaced_image(sender, instance, update_fields, using, **kwargs):
+    """Note the image a save storing a new file is about to replace."""
+    stored = (instance.__dict__.get('_image_stored')
+              or not instance.image._committed)
+    if (instance._state.adding or not stored
+            or (update_fields is not None and 'image' not in update_fields)):
+        return
+    old = (Recipe.objects.using(using).filter(pk=instance.pk)
+           .values('image', 'image_renditions').first())
+    if old is not None:
+        instance._replaced_image = old
+
+
+@receiver(post_save, sender=Recipe)
+def release_replaced_image(sender, instance, **kwargs):
+    """Release the image and renditions a newly stored image replaced.
+
+    Storing the new file took a reference even when the bytes are the
+    same, so the old one is always released.
+    """
+    instance.__dict__.pop('_image_stored', None)
+    old = instance.__dict__.pop('_replaced_image', None)
+    if old is None:
+        return
+    release_image(old['image'])
+    kept = {name for widths in instance.image_renditions.values()
+            for name in widths.values()}
+    stale = {fmt: {width: name for width, name in widths.items()
+                   if name not in kept}
+             for fmt, widths in old['image_renditions'].items()}
+    transaction.on_commit(lambda: delete_renditions(stale))
+
+
+@receiver(post_delete, sender=Token)
+def revoke_deleted_token(sender, instance, **kwargs):
+    """Stop a deleted token (also when its user is deleted) authenticating."""
+    # The key is the primary key, which delete() clears on the instance.
+    keys = [instance.key]
+    transaction.on_commit(lambda: invalidate_tokens(keys))
+
+
+@receiver(post_save, sender=User)
+def revoke_tokens_on_user_change(sender, instance, created, update_fields,
+                                 **kwargs):
+    """Drop cached tokens when a user changes: the entries hold its flags.
+
+    Logins only update ``last_login`` and keep the tokens.
+    """
+    if created or (update_fields is not None
+                   and set(update_fields) <= {'last_login'}):
+        return
+    keys = list(Token.objects.filter(user_id=instance.pk)
+                .values_list('key', flat=True))
+    if keys:
+        transaction.on_commit(lambda: invalidate_tokens(keys))
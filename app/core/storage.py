@@ -0,0 +1,136 @@
+"""Content-addressed storage for recipe images.
+
+Uploads are hashed while they are spooled to disk and stored as
+``uploads/recipe/sha256/ab/cd/<digest>.<ext>``. Identical uploads share
+one file. An ``ImageBlob`` row counts the references to each file:
+``save()`` adds one and ``delete()`` releases one, removing the file when
+the last reference goes. ``RecipeImageField`` has the save of a recipe
+that stores a new image release the one it replaces. The name changes
+whenever the bytes change, so these files can be cached forever.
+"""
+
+import hashlib
+import os
+import tempfile
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import connections, router, transaction
+from django.db.models import F, ImageField
+from django.db.models.fields.files import ImageFieldFile
+
+CONTENT_ADDRESSED_DIR = 'uploads/recipe/sha256/'
+
+
+def is_content_addressed(name):
+    """Return whether a stored file name is immutable."""
+    return bool(name) and name.startswith(CONTENT_ADDRESSED_DIR)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Store files under their SHA-256 digest with reference counting."""
+
+    def _blob_model(self):
+        # Imported lazily: core.models refers to this module.
+        return apps.get_model('core', 'ImageBlob')
+
+    def _spool(self, content):
+        """Write ``content`` to a temporary file, hashing it on the way."""
+        directory = self.path(CONTENT_ADDRESSED_DIR)
+        os.makedirs(directory, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        with tempfile.NamedTemporaryFile(dir=directory, delete=False) as tmp:
+            for chunk in content.chunks():
+                digest.update(chunk)
+                tmp.write(chunk)
+                size += len(chunk)
+        return digest.hexdigest(), tmp.name, size
+
+    def save(self, name, content, max_length=None):
+        ext = os.path.splitext(name)[1].lower()
+        digest, tmp_path, size = self._spool(content)
+        name = (f'{CONTENT_ADDRESSED_DIR}{digest[:2]}/{digest[2:4]}/'
+                f'{digest}{ext}')
+        ImageBlob = self._blob_model()
+        using = router.db_for_write(ImageBlob)
+        try:
+            with transaction.atomic(using=using):
+                # The upsert locks the row, which orders this against a
+                # delete() releasing the last reference to the same file,
+                # and it cannot miss a row that delete() removes meanwhile.
+                with connections[using].cursor() as cursor:
+                    table = ImageBlob._meta.db_table
+                    cursor.execute(
+                        f'INSERT INTO {table} '
+                        '(name, size, ref_count, created_at) '
+                        'VALUES (%s, %s, 1, now()) '
+                        'ON CONFLICT (name) DO UPDATE '
+                        f'SET ref_count = {table}.ref_count + 1',
+                        [name, size],
+                    )
+                path = self.path(name)
+                if os.path.exists(path):
+                    os.unlink(tmp_path)
+                else:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        return name
+
+    def delete(self, name):
+        if not is_content_addressed(name):
+            return super().delete(name)
+        ImageBlob = self._blob_model()
+        with transaction.atomic():
+            blob = (ImageBlob.objects.select_for_update()
+                    .filter(name=name).first())
+            if blob is not None and blob.ref_count > 1:
+                ImageBlob.objects.filter(pk=blob.pk).update(
+                    ref_count=F('ref_count') - 1)
+                return
+            if blob is not None:
+                blob.delete()
+            super().delete(name)
+
+
+content_addressed_storage = ContentAddressedStorage()
+
+
+def release_image(name):
+    """Drop a recipe's reference to a content-addressed image on commit.
+
+    Files stored under uuid4 names are left alone, as they always were.
+    """
+    if is_content_addressed(name):
+        transaction.on_commit(lambda: content_addressed_storage.delete(name))
+
+
+class RecipeImageFieldFile(ImageFieldFile):
+
+    def save(self, name, content, save=True):
+        # The storage takes a reference to the new file; the model save
+        # that persists it releases the old one (core.signals).
+        self.instance._image_stored = True
+        super().save(name, content, save)
+
+
+class RecipeImageField(ImageField):
+    """An ``ImageField`` telling signals when a save stores a new file."""
+    attr_class = RecipeImageFieldFile
+
+
+def recipe_image_storage():
+    """Return the storage for recipe images.
+
+    ``RECIPE_IMAGE_CONTENT_ADDRESSED`` switches between content-addressed
+    storage and the default storage with uuid4 names.
+    """
+    if getattr(settings, 'RECIPE_IMAGE_CONTENT_ADDRESSED', False):
+        return content_addressed_storage
+    return default_storage
@@ -0,0 +1,363 @@
+"""Tests for the data management commands."""
+
+import json
+import os
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models import Count
+from django.test import LiveServerTestCase, TestCase
+from django.utils import timezone
+from PIL import Image
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+
+from core.models import ImageBlob, ImageUpload, Ingredient, Recipe, User
+from core.tests.utils import TempMediaRootMixin
+from recipe.tests.test_recipe_api import create_recipe, create_user, detail_url
+
+EXPORT_URL = reverse('recipe:recipe-export')
+
+
+class ImportRecipesCommandTests(TestCase):
+    """Test the COPY-based import_recipes command."""
+
+    def setUp(self):
+        self.user = create_user(email='export@example.com',
+                                password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_import_round_trip(self):
+        """Test an export can be re-imported with COPY and resumed."""
+        for i in range(3):
+            create_recipe(user=self.user, title=f'Soup {i}',
+                          description='A "hearty" one')
+        export = b''.join(self.client.get(EXPORT_URL).streaming_content)
+        target = create_user(email='import@example.com',
+                             password='testpass123')
+        Ingredient.objects.create(user=target, name='salt')
+
+        with tempfile.NamedTemporaryFile(suffix='.ndjson') as source:
+            source.write(export)
+            source.flush()
+            out = StringIO()
+            call_command('import_recipes', source.name,
+                         '--email', target.email, '--chunk-size', '2',
+                         stdout=out)
+            self.assertIn('Imported 3 recipes', out.getvalue())
+            call_command('import_recipes', source.name,
+                         '--email', target.email, stdout=out)
+            self.assertIn('Imported 0 recipes', out.getvalue())
+
+        recipes = Recipe.objects.filter(user=target).order_by('id')
+        self.assertEqual([r.title for r in recipes],
+                         ['Soup 0', 'Soup 1', 'Soup 2'])
+        self.assertEqual(recipes[0].description, 'A "hearty" one')
+        self.assertEqual(recipes[0].ingredient_names, ['salt'])
+        tags = recipes[0].tags.values_list('name', flat=True)
+        self.assertEqual(list(tags), ['Dinner'])
+        self.assertEqual(recipes[0].image.name, None)
+        self.assertEqual(recipes.search('soup').count(), 3)
+        call_command('sync_recipe_arrays', '--verify', stdout=StringIO())
+
+
+class SyncRecipeArraysCommandTests(TestCase):
+    """Test the sync_recipe_arrays command."""
+
+    def setUp(self):
+        self.user = create_user(email='arrays@example.com',
+                                password='testpass123')
+
+    def test_sync_recipe_arrays_command(self):
+        """Test the command reports and repairs stale arrays."""
+        recipe = create_recipe(user=self.user)
+        Recipe.objects.filter(pk=recipe.pk).update(tag_ids=[], tag_names=[])
+
+        with self.assertRaises(CommandError):
+            call_command('sync_recipe_arrays', '--verify', stdout=StringIO())
+        call_command('sync_recipe_arrays', '--batch-size', '1',
+                     stdout=StringIO())
+        call_command('sync_recipe_arrays', '--verify', stdout=StringIO())
+
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.tag_names, ['Dinner'])
+
+    def test_sync_invalidates_cached_responses(self):
+        """Test clients holding an ETag see the repaired arrays."""
+        recipe = create_recipe(user=self.user)
+        Recipe.objects.filter(pk=recipe.pk).update(tag_ids=[], tag_names=[])
+        client = APIClient()
+        client.force_authenticate(self.user)
+        res = client.get(detail_url(recipe.id))
+
+        call_command('sync_recipe_arrays', stdout=StringIO())
+
+        res = client.get(detail_url(recipe.id), HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['tags']), 1)
+
+
+class ProcessImagesCommandTests(TempMediaRootMixin, TestCase):
+    """Test the process_images worker command."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user(email='worker@example.com',
+                                password='testpass123')
+
+    def _recipe(self, image, renditions=None):
+        recipe = create_recipe(user=self.user)
+        Recipe.objects.filter(pk=recipe.pk).update(
+            image=image, image_status='pending',
+            image_renditions=renditions or {})
+        return recipe
+
+    def _file(self, name):
+        path = os.path.join(self.media.name, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x')
+        return name
+
+    def test_failure_does_not_block_queue(self):
+        """Test any rendering error marks the row failed and moves on."""
+        bomb = self._recipe('uploads/recipe/bomb.png')
+        fine = self._recipe('uploads/recipe/fine.png')
+        err = StringIO()
+
+        bombed = [Image.DecompressionBombError('too many pixels'), {}]
+        with patch('core.management.commands.process_images.render_renditions',
+                   side_effect=bombed):
+            call_command('process_images', '--once', stdout=StringIO(),
+                         stderr=err)
+
+        self.assertIn('DecompressionBombError', err.getvalue())
+        statuses = dict(Recipe.objects.values_list('id', 'image_status'))
+        self.assertEqual(statuses, {bomb.id: 'failed', fine.id: 'ready'})
+
+    def test_image_replaced_while_rendering(self):
+        """Test renditions of an image replaced meanwhile are dropped."""
+        recipe = self._recipe('uploads/recipe/old.jpg')
+        stale = self._file('uploads/recipe/renditions/old-320.jpg')
+        fresh = self._file('uploads/recipe/renditions/new-320.jpg')
+
+        def render(claimed):
+            if claimed.image.name == 'uploads/recipe/new.jpg':
+                return {'jpeg': {'320': fresh}}
+            # No lock is held while rendering, so an upload goes through.
+            claimed.refresh_from_db(fields=['image_status'])
+            self.assertEqual(claimed.image_status, 'processing')
+            Recipe.objects.filter(pk=claimed.pk).update(
+                image='uploads/recipe/new.jpg', image_status='pending')
+            return {'jpeg': {'320': stale}}
+
+        with patch('core.management.commands.process_images.render_renditions',
+                   side_effect=render):
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('process_images', '--once', stdout=StringIO())
+
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_status, 'ready')
+        self.assertEqual(recipe.image_renditions, {'jpeg': {'320': fresh}})
+        self.assertFalse(default_storage.exists(stale))
+
+    def test_stale_claim_retried(self):
+        """Test an image left processing by a dead worker is retried."""
+        dead = self._recipe('uploads/recipe/dead.jpg')
+        busy = self._recipe('uploads/recipe/busy.jpg')
+        Recipe.objects.filter(pk=dead.pk).update(
+            image_status='processing',
+            image_claimed_at=timezone.now() - timedelta(minutes=11))
+        Recipe.objects.filter(pk=busy.pk).update(
+            image_status='processing', image_claimed_at=timezone.now())
+
+        with patch('core.management.commands.process_images.render_renditions',
+                   return_value={}):
+            call_command('process_images', '--once', stdout=StringIO())
+
+        statuses = dict(Recipe.objects.values_list('id', 'image_status'))
+        self.assertEqual(statuses, {dead.id: 'ready', busy.id: 'processing'})
+
+    def test_replaced_image_renditions_deleted(self):
+        """Test renditions go with the image they were rendered from."""
+        old = self._file('uploads/recipe/renditions/old-320.jpg')
+        recipe = self._recipe('uploads/recipe/old.jpg', {'jpeg': {'320': old}})
+        recipe.refresh_from_db()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.image_renditions = {}
+            recipe.image.save('new.jpg', ContentFile(b'new'))
+        self.assertFalse(default_storage.exists(old))
+
+        kept = self._file('uploads/recipe/renditions/new-320.jpg')
+        Recipe.objects.filter(pk=recipe.pk).update(
+            image_renditions={'jpeg': {'320': kept}})
+        recipe.refresh_from_db()
+        recipe.title = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.save()
+        self.assertTrue(default_storage.exists(kept))
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+        self.assertFalse(default_storage.exists(kept))
+
+
+class MediaGarbageCollectorTests(TempMediaRootMixin, TestCase):
+    """Test the gc_media command."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user(email='gc@example.com', password='testpass123')
+        recipe = create_recipe(user=self.user)
+        recipe.image = self._file('uploads/recipe/kept.jpg')
+        rendition = self._file('uploads/recipe/renditions/kept-320.jpg')
+        recipe.image_renditions = {'jpeg': {'320': rendition}}
+        recipe.save()
+        self.orphan = self._file('uploads/recipe/old.jpg', size=100)
+        self.quarantined = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.quarantined.cleanup()
+
+    def _file(self, name, size=10, age_hours=48):
+        path = os.path.join(self.media.name, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        aged = time.time() - age_hours * 3600
+        os.utime(path, (aged, aged))
+        return name
+
+    def _exists(self, name):
+        return os.path.exists(os.path.join(self.media.name, name))
+
+    def test_removes_old_unreferenced_files(self):
+        """Test only unreferenced files past the grace period are removed."""
+        fresh = self._file('uploads/recipe/fresh.jpg', age_hours=1)
+        out = StringIO()
+
+        call_command('gc_media', '--dry-run', stdout=out)
+        self.assertIn('Would reclaim 100 bytes from 1 of 2', out.getvalue())
+        self.assertTrue(self._exists(self.orphan))
+
+        out = StringIO()
+        call_command('gc_media', stdout=out)
+        self.assertIn('Reclaimed 100 bytes', out.getvalue())
+        self.assertFalse(self._exists(self.orphan))
+        for name in ('uploads/recipe/kept.jpg',
+                     'uploads/recipe/renditions/kept-320.jpg', fresh):
+            self.assertTrue(self._exists(name))
+
+    def test_quarantine_and_expired_uploads(self):
+        """Test orphans can be moved aside and stale upload sessions expire."""
+        upload = ImageUpload.objects.create(
+            user=self.user, recipe=Recipe.objects.get(), filename='a.jpg',
+            size=10)
+        self._file(upload.partial_name)
+        live = ImageUpload.objects.create(
+            user=self.user, recipe=Recipe.objects.get(), filename='b.jpg',
+            size=10)
+        self._file(live.partial_name)
+        ImageUpload.objects.filter(pk=upload.pk).update(
+            updated_at=timezone.now() - timedelta(days=2))
+
+        call_command('gc_media', '--quarantine', self.quarantined.name,
+                     stdout=StringIO())
+
+        self.assertFalse(self._exists(self.orphan))
+        self.assertTrue(os.path.exists(
+            os.path.join(self.quarantined.name, self.orphan)))
+        self.assertFalse(self._exists(upload.partial_name))
+        self.assertTrue(self._exists(live.partial_name))
+        self.assertEqual(list(ImageUpload.objects.all()), [live])
+
+
+class LoadTestCommandTests(TempMediaRootMixin, LiveServerTestCase):
+    """Test the load_test command against a live server."""
+
+    def test_report(self):
+        """Test every operation runs and the JSON results can be compared."""
+        output = os.path.join(self.media.name, 'results.json')
+        operations = ['login', 'list', 'filter', 'detail', 'create', 'update',
+                      'upload']
+        mix = ','.join(f'{operation}=1' for operation in operations)
+        call_command('load_test', '--url', self.live_server_url,
+                     '--users', '2', '--requests', '60', '--concurrency', '2',
+                     '--output', output, '--mix', mix, stdout=StringIO())
+        with open(output) as fp:
+            results = json.load(fp)
+
+        self.assertEqual(set(results['endpoints']), set(operations))
+        self.assertEqual(results['total']['requests'], 60)
+        self.assertEqual(results['total']['errors'], 0)
+        # The filter operation matches the seeded recipes' tag arrays.
+        seeded = Recipe.objects.filter(title__startswith='Load test recipe')
+        self.assertTrue(seeded.exclude(tag_ids=[]).exists())
+        for recipe in seeded.prefetch_related('tags'):
+            self.assertEqual(sorted(recipe.tag_ids),
+                             sorted(tag.id for tag in recipe.tags.all()))
+        for row in results['endpoints'].values():
+            self.assertLessEqual(row['p50_ms'], row['p95_ms'])
+            self.assertLessEqual(row['p95_ms'], row['p99_ms'])
+
+        out = StringIO()
+        call_command('load_test', '--url', self.live_server_url,
+                     '--users', '2', '--requests', '10', '--mix', 'list=1',
+                     '--baseline', output, stdout=out)
+        self.assertIn('Change against baseline', out.getvalue())
+
+
+class SeedDataCommandTests(TempMediaRootMixin, TestCase):
+    """Test the seed_data command."""
+
+    def seed(self, prefix, *args):
+        call_command('seed_data', '--users', '6', '--recipes', '300',
+                     '--user-batch', '4', '--chunk-size', '70',
+                     '--email-prefix', prefix, *args, stdout=StringIO())
+        return Recipe.objects.filter(user__email__startswith=prefix)
+
+    def sizes(self, prefix):
+        users = (User.objects.filter(email__startswith=prefix)
+                 .annotate(recipes=Count('recipe')))
+        return [
+            users.get(email=f'{prefix}{number}@example.com').recipes
+            for number in range(6)
+        ]
+
+    def test_seed_data(self):
+        """Test the generated recipes are consistent and reproducible."""
+        recipes = self.seed('alpha', '--images', '0.5')
+
+        self.assertEqual(recipes.count(), 300)
+        for recipe in recipes.with_computed_arrays():
+            self.assertEqual(recipe.tag_ids, sorted(recipe.computed_tag_ids))
+            self.assertEqual(sorted(recipe.ingredient_names),
+                             sorted(recipe.computed_ingredient_names))
+            self.assertTrue(recipe.ingredient_ids)
+            self.assertIsNotNone(recipe.search_vector)
+        with_image = recipes.filter(image_status='ready')
+        self.assertTrue(0 < with_image.count() < 300)
+        name = with_image.first().image.name
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(ImageBlob.objects.get(name=name).ref_count,
+                         with_image.count())
+        user = User.objects.get(email='alpha0@example.com')
+        self.assertTrue(user.check_password('seed-pass123'))
+
+        self.seed('beta')
+        self.assertEqual(self.sizes('alpha'), self.sizes('beta'))
+
+    def test_existing_prefix(self):
+        """Test seeding refuses to reuse an email prefix."""
+        self.seed('gamma')
+        with self.assertRaises(CommandError):
+            self.seed('gamma')
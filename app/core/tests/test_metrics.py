@@ -0,0 +1,215 @@
+"""Tests for request metrics and on-demand profiling."""
+
+import os
+import pstats
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+
+from core.metrics import mark_process_dead
+from core.profiling import make_token as make_profile_token
+from recipe.tests.test_recipe_api import RECIPE_URL, create_recipe, create_user
+
+
+class RequestMetricsTests(TestCase):
+    """Test the Server-Timing header and the metrics endpoint."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user(email='metrics@example.com',
+                                password='testpass123')
+        create_recipe(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_server_timing(self):
+        """Test each phase of a request is reported."""
+        res = self.client.get(RECIPE_URL)
+
+        timings = dict(
+            part.strip().split(';', 1)
+            for part in res['Server-Timing'].split(',')
+        )
+        self.assertEqual(set(timings), {'db', 'serialize', 'render', 'total'})
+        queries = int(timings['db'].split('desc="')[1].split()[0])
+        self.assertGreater(queries, 0)
+        total = float(timings['total'].split('dur=')[1])
+        db = float(timings['db'].split('dur=')[1].split(';')[0])
+        self.assertLessEqual(db, total)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_endpoint(self):
+        """Test per-view histograms are exposed in the Prometheus format."""
+        self.client.get(RECIPE_URL)
+
+        res = self.client.get(reverse('metrics'),
+                              HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        body = res.content.decode()
+        self.assertIn('http_request_phase_seconds_count'
+                      '{phase="total",route="api/recipe/recipe-list/"}', body)
+        self.assertIn('http_request_db_queries_bucket'
+                      '{le="1.0",route="api/recipe/recipe-list/"}', body)
+        self.assertIn('db_pool{alias="default",stat="connects"}', body)
+
+    @override_settings(METRICS_TOKEN='secret',
+                       LOGIN_RATE_LIMITS={'ip': (1, 60), 'email': (1, 60)})
+    def test_rate_limit_rejections_exposed(self):
+        """Test login attempts refused by the rate limit are counted."""
+        payload = {'email': 'metrics@example.com', 'password': 'wrong'}
+        for _ in range(2):
+            APIClient().post(reverse('user:token'), payload)
+
+        res = self.client.get(reverse('metrics'),
+                              HTTP_AUTHORIZATION='Bearer secret')
+        body = res.content.decode()
+        rejected = 'login_rate_limit_rejected_total{scope="%s"} %s'
+        self.assertIn(rejected % ('ip', '1.0'), body)
+        self.assertIn(rejected % ('email', '0.0'), body)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_token(self):
+        """Test the metrics endpoint can require a bearer token."""
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url).status_code,
+                         status.HTTP_403_FORBIDDEN)
+        res = self.client.get(url, HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_metrics_closed_without_token(self):
+        """Test the metrics endpoint is refused until a token is configured."""
+        res = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer ')
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_mark_process_dead(self):
+        """Test an exiting worker removes its live gauge samples."""
+        with tempfile.TemporaryDirectory() as directory:
+            live = os.path.join(directory, f'gauge_livesum_{os.getpid()}.db')
+            kept = os.path.join(directory, f'histogram_{os.getpid()}.db')
+            for path in (live, kept):
+                open(path, 'wb').close()
+
+            environ = {'PROMETHEUS_MULTIPROC_DIR': directory}
+            with patch.dict(os.environ, environ):
+                mark_process_dead()
+
+            self.assertFalse(os.path.exists(live))
+            self.assertTrue(os.path.exists(kept))
+
+
+class RequestProfilingTests(TestCase):
+    """Test requests are profiled on demand."""
+
+    def setUp(self):
+        self.profile_dir = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(
+            PROFILE_DIR=self.profile_dir.name)
+        self.settings_override.enable()
+        cache.clear()
+        self.user = create_user(email='profile@example.com',
+                                password='testpass123', is_staff=True)
+        create_recipe(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.profile_dir.cleanup()
+
+    def get(self, token, **extra):
+        return self.client.get(RECIPE_URL, HTTP_X_PROFILE=token, **extra)
+
+    def test_signed_header_writes_profile(self):
+        """Test a valid token writes pstats and collapsed stacks."""
+        res = self.get(make_profile_token(self.user),
+                       HTTP_X_REQUEST_ID='req-42')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        name = res['X-Profile-Id']
+        self.assertTrue(name.startswith('recipe.recipe-list/'))
+        self.assertTrue(name.endswith('-req-42'))
+        path = os.path.join(self.profile_dir.name, name)
+        stats = pstats.Stats(f'{path}.pstats')
+        self.assertTrue(any(func[2] == 'list' for func in stats.stats))
+        with open(f'{path}.collapsed') as fp:
+            for line in fp:
+                stack, count = line.rsplit(' ', 1)
+                self.assertGreater(int(count), 0)
+
+    def test_query_param_ignored(self):
+        """Test the token is not taken from the URL, where logs keep it."""
+        res = self.client.get(RECIPE_URL,
+                              {'_profile': make_profile_token(self.user)})
+
+        self.assertNotIn('X-Profile-Id', res)
+
+    def test_token_bound_to_staff_user(self):
+        """Test a token profiles nothing for anyone but its staff user."""
+        token = make_profile_token(self.user)
+        other = create_user(email='other@example.com', password='testpass123')
+        self.client.force_authenticate(other)
+        self.assertNotIn('X-Profile-Id', self.get(token))
+
+        self.client.force_authenticate(None)
+        self.assertNotIn('X-Profile-Id', self.get(token))
+
+        other.is_staff = True
+        other.save()
+        self.client.force_authenticate(other)
+        self.assertNotIn('X-Profile-Id', self.get(token))
+        self.assertEqual(os.listdir(self.profile_dir.name), [])
+
+    @override_settings(PROFILE_MAX_COUNT=2)
+    def test_old_profiles_pruned(self):
+        """Test only the newest PROFILE_MAX_COUNT profiles are kept."""
+        token = make_profile_token(self.user)
+        names = [self.get(token)['X-Profile-Id'] for _ in range(3)]
+
+        kept = sorted(
+            os.path.join(view, name)
+            for view in os.listdir(self.profile_dir.name)
+            for name in os.listdir(os.path.join(self.profile_dir.name, view))
+        )
+        self.assertEqual(len(kept), 4)
+        self.assertNotIn(f'{names[0]}.pstats', kept)
+
+    def test_invalid_token_not_profiled(self):
+        """Test unsigned or expired tokens do not profile the request."""
+        res = self.client.get(RECIPE_URL, HTTP_X_PROFILE='profile')
+        self.assertNotIn('X-Profile-Id', res)
+
+        with override_settings(PROFILE_TOKEN_MAX_AGE=-1):
+            res = self.get(make_profile_token(self.user))
+        self.assertNotIn('X-Profile-Id', res)
+        self.assertEqual(os.listdir(self.profile_dir.name), [])
+
+    def test_sample_rate(self):
+        """Test requests are sampled at PROFILE_SAMPLE_RATE."""
+        self.assertNotIn('X-Profile-Id', self.client.get(RECIPE_URL))
+
+        with override_settings(PROFILE_SAMPLE_RATE=1.0):
+            res = self.client.get(RECIPE_URL)
+        self.assertIn('X-Profile-Id', res)
+
+    def test_profile_token_command(self):
+        """Test the command prints a token that enables profiling."""
+        out = StringIO()
+        call_command('profile_token', '--email', self.user.email,
+                     stdout=out, stderr=StringIO())
+
+        res = self.client.get(RECIPE_URL,
+                              HTTP_X_PROFILE=out.getvalue().strip())
+        self.assertIn('X-Profile-Id', res)
+
+        with self.assertRaises(CommandError):
+            call_command('profile_token', '--email', 'nobody@example.com',
+                         stdout=StringIO(), stderr=StringIO())
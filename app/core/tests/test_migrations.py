@@ -0,0 +1,45 @@
+"""Tests for data migrations."""
+
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+
+
+class RelatedArraysMigrationTests(TransactionTestCase):
+    """Test 0008 fills the arrays of recipes that already exist."""
+
+    before = [('core', '0007_recipe_search_vector')]
+    after = [('core', '0008_recipe_related_arrays')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_existing_links_backfilled(self):
+        """Test migrated recipes keep their tags and ingredients."""
+        apps = self.migrate(self.before)
+        user = apps.get_model('core', 'User').objects.create(
+            email='old@example.com')
+        recipe = apps.get_model('core', 'Recipe').objects.create(
+            user=user, title='Old', time_minutes=5, price='1.00')
+        Tag = apps.get_model('core', 'Tag')
+        tags = [Tag.objects.create(user=user, name=name)
+                for name in ('Vegan', 'Dinner')]
+        salt = apps.get_model('core', 'Ingredient').objects.create(
+            user=user, name='Salt')
+        recipe.tags.set(tags)
+        recipe.ingredients.set([salt])
+
+        apps = self.migrate(self.after)
+
+        recipe = apps.get_model('core', 'Recipe').objects.get(pk=recipe.pk)
+        self.assertEqual(recipe.tag_ids, [tag.id for tag in tags])
+        self.assertEqual(recipe.tag_names, ['Vegan', 'Dinner'])
+        self.assertEqual(recipe.ingredient_ids, [salt.id])
+        self.assertEqual(recipe.ingredient_names, ['Salt'])
@@ -0,0 +1,17 @@
+"""Helpers shared by the test suites."""
+
+import tempfile
+
+from django.test import override_settings
+
+
+class TempMediaRootMixin:
+    """Run each test with an empty MEDIA_ROOT of its own, ``self.media``."""
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=self.media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        super().setUp()
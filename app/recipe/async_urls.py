@@ -0,0 +1,14 @@
+"""Async URLs for the recipe read endpoints, for ASGI deployments."""
+
+from django.urls import path
+
+from recipe import async_views
+
+app_name = 'recipe-async'
+
+urlpatterns = [
+    path('recipes/', async_views.recipe_list, name='recipe-list'),
+    path('recipes/<int:pk>/', async_views.recipe_detail, name='recipe-detail'),
+    path('tags/', async_views.tag_list, name='tag-list'),
+    path('ingredients/', async_views.ingredient_list, name='ingredient-list'),
+]
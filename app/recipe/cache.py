@@ -0,0 +1,155 @@
+"""Per-user versioned response cache and ETags for the recipe endpoints.
+
+Every user has a version counter. Cached responses are keyed by user,
+version, host, endpoint and normalized query params, so bumping the
+counter invalidates all of a user's cached lists in O(1); stale entries
+simply age out of the backend. The counters must be seen by every worker,
+so the cache has to be shared (see core.checks).
+
+A bump also pins the user to the primary database. Writers outside a
+request, such as process_images or import_recipes, bump without going
+through PrimaryPinMiddleware, and a lagging replica would otherwise fill
+the fresh version with the old rows.
+"""
+
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from core.db.routers import pin_to_primary, replicas
+
+VERSION_KEY = 'recipe:version:{user_id}'
+RESPONSE_KEY = 'recipe:response:{user_id}:{version}:{url}'
+STATS_KEYS = {'hits': 'recipe:stats:hits', 'misses': 'recipe:stats:misses'}
+
+
+def get_cache():
+    """Return the configured cache backend."""
+    return caches[getattr(settings, 'RECIPE_CACHE_ALIAS', 'default')]
+
+
+def _fresh_version():
+    # Start from the clock rather than 1 so that a version key evicted by
+    # the backend can never collide with responses cached under it.
+    return int(time.time() * 1000)
+
+
+def get_version(user_id):
+    """Return the current data version for a user."""
+    cache = get_cache()
+    key = VERSION_KEY.format(user_id=user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _fresh_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(user_id):
+    """Invalidate every cached response for a user."""
+    if replicas():
+        pin_to_primary(user_id)
+    cache = get_cache()
+    key = VERSION_KEY.format(user_id=user_id)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = _fresh_version()
+        cache.set(key, version, timeout=None)
+        return version
+
+
+def response_key(request):
+    """Return the cache key for a list request."""
+    params = urlencode(sorted(
+        (name, value)
+        for name, values in request.query_params.lists()
+        for value in values
+    ))
+    # Responses hold absolute next/previous links, so the scheme and host
+    # are part of the key too.
+    url = f'{request.scheme}://{request.get_host()}{request.path}?{params}'
+    return RESPONSE_KEY.format(
+        user_id=request.user.pk,
+        version=get_version(request.user.pk),
+        url=hashlib.md5(url.encode()).hexdigest(),
+    )
+
+
+def etag_for(request):
+    """Return a strong ETag for a read request.
+
+    It is derived from the user's data version rather than the body, so
+    it can be checked without touching the database or serializing.
+    """
+    fingerprint = f'{response_key(request)}:{request.accepted_media_type}'
+    return quote_etag(hashlib.md5(fingerprint.encode()).hexdigest())
+
+
+def _count(stat):
+    cache = get_cache()
+    key = STATS_KEYS[stat]
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def stats():
+    """Return the shared hit/miss counters."""
+    values = get_cache().get_many(STATS_KEYS.values())
+    return {stat: values.get(key, 0) for stat, key in STATS_KEYS.items()}
+
+
+class CachedListMixin:
+    """Serve ``list()`` from the per-user versioned response cache."""
+
+    def list(self, request, *args, **kwargs):
+        cache = get_cache()
+        key = response_key(request)
+        data = cache.get(key)
+        if data is not None:
+            _count('hits')
+            return Response(data)
+
+        _count('misses')
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data,
+                      timeout=getattr(settings, 'RECIPE_CACHE_TIMEOUT', 300))
+        return response
+
+
+class ConditionalGetMixin:
+    """Answer ``If-None-Match`` polls on list/retrieve with 304.
+
+    The ETag is only as fresh as the user's version counter, which is why
+    the cache holding it must be shared by every worker.
+    """
+
+    def _conditional(self, handler, request, *args, **kwargs):
+        etag = etag_for(request)
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ['Authorization'])
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self._conditional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._conditional(super().retrieve, request, *args, **kwargs)
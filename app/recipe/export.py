@@ -0,0 +1,61 @@
+"""Streaming NDJSON/CSV export of a user's recipes."""
+
+import csv
+import json
+
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FIELDS = ['id', 'title', 'description', 'time_minutes', 'price', 'link',
+                 'image', 'ingredient_ids', 'ingredient_names', 'tag_ids',
+                 'tag_names']
+LIST_FIELDS = {'ingredient_ids', 'ingredient_names', 'tag_ids', 'tag_names'}
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def _rows(queryset):
+    # A server-side cursor keeps only one chunk in memory at a time, and the
+    # denormalized name arrays mean no per-chunk prefetch is needed.
+    rows = queryset.values(*EXPORT_FIELDS)
+    for row in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        if row['image']:
+            row['image'] = default_storage.url(row['image'])
+        yield row
+
+
+def iter_ndjson(queryset):
+    """Yield one JSON document per recipe."""
+    for row in _rows(queryset):
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+class _Echo:
+    """File-like object that returns what is written to it."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(queryset):
+    """Yield a header line and one CSV line per recipe.
+
+    List columns are joined with ``|``.
+    """
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in _rows(queryset):
+        yield writer.writerow([
+            '|'.join(map(str, row[field])) if field in LIST_FIELDS
+            else row[field]
+            for field in EXPORT_FIELDS
+        ])
+
+
+EXPORTERS = {
+    'ndjson': iter_ndjson,
+    'csv': iter_csv,
+}
@@ -0,0 +1,151 @@
+"""Pagination for the recipe API."""
+
+import json
+import math
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    """Keyset pagination on the primary key.
+
+    Pages are selected with ``WHERE id < <cursor> ORDER BY -id LIMIT n``,
+    so every page costs the same and no ``COUNT(*)`` is run. Querysets
+    annotated with a search ``rank`` are paged on ``(rank, id)`` instead.
+    """
+    ordering = ('-id',)
+    rank_field = 'rank'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def get_ordering(self, request, queryset, view):
+        """Order by rank first when the queryset carries one."""
+        if self.rank_field in queryset.query.annotations:
+            return ('-' + self.rank_field, '-id')
+        return self.ordering
+
+    def decode_cursor(self, request):
+        """Decode the cursor, discarding any offset it carries.
+
+        Positions are unique so the cursors we emit never need an offset,
+        and a hand-crafted one must not be able to trigger an ``OFFSET``.
+        """
+        cursor = super().decode_cursor(request)
+        if cursor is None:
+            return None
+        return Cursor(offset=0, reverse=cursor.reverse,
+                      position=cursor.position)
+
+    def _get_position_from_instance(self, instance, ordering):
+        return json.dumps(
+            [getattr(instance, field.lstrip('-')) for field in ordering]
+        )
+
+    def _coerce(self, name, value):
+        if isinstance(value, (dict, list, str)):
+            raise TypeError(value)
+        if name == self.rank_field:
+            value = float(value)
+            if not math.isfinite(value):
+                raise ValueError(value)
+            return value
+        return int(value)
+
+    def _keyset_filter(self, position, reverse):
+        """Return a Q selecting rows strictly after ``position``."""
+        try:
+            values = json.loads(position)
+            if (not isinstance(values, list)
+                    or len(values) != len(self.ordering)):
+                raise ValueError(position)
+            # Cursors come from the client: coerce every value to its
+            # field's type before it reaches the query.
+            values = [
+                self._coerce(field.lstrip('-'), value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except (TypeError, ValueError, OverflowError):
+            raise NotFound(self.invalid_cursor_message)
+
+        keyset = Q()
+        equal = {}
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            lookup = '__lt' if field.startswith('-') != reverse else '__gt'
+            keyset |= Q(**equal, **{name + lookup: value})
+            equal[name] = value
+        return keyset
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            reverse, current_position = False, None
+        else:
+            reverse = self.cursor.reverse
+            current_position = self.cursor.position
+
+        if reverse:
+            queryset = queryset.order_by(
+                *[f[1:] if f.startswith('-') else '-' + f
+                  for f in self.ordering]
+            )
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if current_position is not None:
+            queryset = queryset.filter(
+                self._keyset_filter(current_position, reverse)
+            )
+
+        # Fetch one extra row to learn whether a following page exists.
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_following = len(results) > len(self.page)
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = current_position is not None
+            self.has_previous = has_following
+        else:
+            self.has_next = has_following
+            self.has_previous = current_position is not None
+        self.next_position = self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        position = self.next_position
+        if self.page:
+            position = self._get_position_from_instance(
+                self.page[-1], self.ordering
+            )
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=False, position=position)
+        )
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        position = self.previous_position
+        if self.page:
+            position = self._get_position_from_instance(
+                self.page[0], self.ordering
+            )
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=True, position=position)
+        )
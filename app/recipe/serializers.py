@@ -4,23 +4,90 @@ from rest_framework import status
 from httpcore import Response
 from rest_framework import serializers
 
-from core.models import Recipe, Tag, Ingredient
- 
-class RecipeImageSerializer(serializers.ModelSerializer):
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from core.metrics import TimedSerializerMixin
+from core.models import RELATED_ARRAYS, ImageUpload, Recipe, Tag, Ingredient
+from recipe.uploads import max_upload_size
+
+BULK_BATCH_SIZE = 1000
+
+
+class ImageRenditionsField(serializers.ReadOnlyField):
+    """Rendition storage names as URLs, absolute given a request."""
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        urls = {}
+        for fmt, widths in value.items():
+            urls[fmt] = {}
+            for width, name in widths.items():
+                url = default_storage.url(name)
+                if request:
+                    url = request.build_absolute_uri(url)
+                urls[fmt][width] = url
+        return urls
+
+
+class RecipeImageSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     "serializes for uploading images to recipes."""
     image = serializers.ImageField(max_length=None, use_url=True)
+    image_renditions = ImageRenditionsField()
     class Meta:
         model = Recipe
-        fields = ['id', 'image']
-        read_only_fields = ['id']
+        fields = ['id', 'image', 'image_status', 'image_renditions']
+        read_only_fields = ['id', 'image_status']
         extra_kwargs = {'image': {'required': False}}
 
+    def update(self, instance, validated_data):
+        """Store the upload and queue it for off-request processing."""
+        if 'image' in validated_data:
+            instance.image_status = 'pending'
+            instance.image_renditions = {}
+        return super().update(instance, validated_data)
+
 
-class IngredientSerializer(serializers.ModelSerializer):
+class ImageUploadSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """Serializes a resumable image upload session."""
+    class Meta:
+        model = ImageUpload
+        fields = ['id', 'filename', 'size', 'offset']
+        read_only_fields = ['id', 'offset']
+
+    def validate_size(self, value):
+        limit = max_upload_size()
+        if not 0 < value <= limit:
+            raise serializers.ValidationError(
+                f'Must be between 1 and {limit} bytes.')
+        return value
+
+
+DUPLICATE_NAME_MESSAGE = 'You already have one with this name.'
+
+
+def validate_unique_name(serializer, value):
+    """Reject a name the user already has, ignoring case."""
+    request = serializer.context.get('request')
+    if request is None:
+        return value
+    existing = serializer.Meta.model.objects.filter(user=request.user,
+                                                    name__iexact=value)
+    if serializer.instance is not None:
+        existing = existing.exclude(pk=serializer.instance.pk)
+    if existing.exists():
+        raise serializers.ValidationError(DUPLICATE_NAME_MESSAGE)
+    return value
+
+
+class IngredientSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Ingredient
         fields = ['id', 'name']
         read_only_fields = ['id']
+
+    def validate_name(self, value):
+        return validate_unique_name(self, value)
     
     def create(self, validated_data):
         """Create and return an ingredient."""
@@ -32,12 +99,16 @@ class IngredientDetailSerializer(IngredientSerializer):
         fields = IngredientSerializer.Meta.fields + ['recipe']
         read_only_fields = IngredientSerializer.Meta.read_only_fields + ['recipe']  
         
-class TagSerializer(serializers.ModelSerializer):
+
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Tag
         fields = ['id', 'name']
         read_only_fields = ['id']
 
+    def validate_name(self, value):
+        return validate_unique_name(self, value)
+
     def create(self, validated_data):
         """Create and return a tag."""
         return Tag.objects.create(**validated_data)
@@ -46,17 +117,51 @@ class TagDetailSerializer(TagSerializer):
     class Meta(TagSerializer.Meta):
         fields = TagSerializer.Meta.fields + ['recipe']
         read_only_fields = TagSerializer.Meta.read_only_fields + ['recipe']
-        
-class RecipeSerializer(serializers.ModelSerializer):
-    ingredients = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all(), many=True)
-    tags = serializers.PrimaryKeyRelatedField(queryset=Tag.objects.all(), many=True)
-    ingredient_names = serializers.SerializerMethodField()
-    tag_names = serializers.SerializerMethodField() 
+
+
+class IdArrayRelatedField(serializers.ManyRelatedField):
+    """Writable many-to-many id field that reads a denormalized id array."""
+
+    def __init__(self, array_attr, **kwargs):
+        self.array_attr = array_attr
+        super().__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        return getattr(instance, self.array_attr)
+
+    def to_representation(self, iterable):
+        return list(iterable)
+
+
+class NameListSerializer(serializers.Serializer):
+    """A list of tag or ingredient names for bulk get-or-create."""
+    names = serializers.ListField(
+        child=serializers.CharField(max_length=255),
+        allow_empty=False,
+        max_length=1000,
+    )
+
+
+class RecipeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    ingredients = IdArrayRelatedField(
+        'ingredient_ids',
+        child_relation=serializers.PrimaryKeyRelatedField(
+            queryset=Ingredient.objects.all()),
+    )
+    tags = IdArrayRelatedField(
+        'tag_ids',
+        child_relation=serializers.PrimaryKeyRelatedField(
+            queryset=Tag.objects.all()),
+    )
+    image_renditions = ImageRenditionsField()
     class Meta:
         model = Recipe
         fields = ['id', 'title', 'description', 'time_minutes', 'price', 'link', 'ingredients', 
-                  'tags', 'ingredient_names', 'tag_names','image']
-        read_only_fields = ['id']
+                  'tags', 'ingredient_names', 'tag_names', 'image',
+                  'image_status', 'image_renditions']
+        # Images go through upload-image, which queues their renditions.
+        read_only_fields = ['id', 'ingredient_names', 'tag_names', 'image',
+                            'image_status']
     
     def create(self, validated_data):
         """Create and return a recipe."""
@@ -83,13 +188,6 @@ class RecipeSerializer(serializers.ModelSerializer):
         return instance  # Return the updated instance  to the  database    
          
     
-    def get_ingredient_names(self, obj):
-        return [ingredient.name for ingredient in obj.ingredients.all()]
-
-    # Method to get the tag names
-    def get_tag_names(self, obj):
-        return [tag.name for tag in obj.tags.all()]
-    
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context['request'] = self.request
@@ -99,4 +197,72 @@ class RecipeDetailSerializer(RecipeSerializer):
     class Meta(RecipeSerializer.Meta):
         fields = RecipeSerializer.Meta.fields + ['ingredients', 'tags']
         read_only_fields = RecipeSerializer.Meta.read_only_fields
-        
+
+
+class RecipeBulkListSerializer(serializers.ListSerializer):
+    """Validate and insert a batch of recipes in a fixed number of queries."""
+
+    def to_internal_value(self, data):
+        items = super().to_internal_value(data)
+        user = self.context['request'].user
+        errors = [{} for _ in items]
+        self.related_names = {}
+        for relation, model in (('ingredients', Ingredient), ('tags', Tag)):
+            ids = {pk for item in items for pk in item[relation]}
+            names = dict(model.objects.filter(user=user, pk__in=ids)
+                         .values_list('id', 'name'))
+            self.related_names[relation] = names
+            for error, item in zip(errors, items):
+                missing = sorted(set(item[relation]) - names.keys())
+                if missing:
+                    error[relation] = [
+                        f'Invalid pk "{pk}" - object does not exist.'
+                        for pk in missing
+                    ]
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return items
+
+    def create(self, validated_data):
+        """Insert the recipes, then each relation's links, atomically."""
+        user = self.context['request'].user
+        recipes, links = [], []
+        for item in validated_data:
+            related = {relation: sorted(set(item.pop(relation)))
+                       for relation in RELATED_ARRAYS}
+            recipe = Recipe(user=user, **item)
+            for relation, ids in related.items():
+                ids_field, names_field = RELATED_ARRAYS[relation]
+                setattr(recipe, ids_field, ids)
+                names = self.related_names[relation]
+                setattr(recipe, names_field, [names[pk] for pk in ids])
+            recipes.append(recipe)
+            links.append(related)
+
+        with transaction.atomic():
+            Recipe.objects.bulk_create(recipes, batch_size=BULK_BATCH_SIZE)
+            for relation in RELATED_ARRAYS:
+                field = Recipe._meta.get_field(relation)
+                through = field.remote_field.through
+                source = field.m2m_column_name()
+                target = field.m2m_reverse_name()
+                through.objects.bulk_create([
+                    through(**{source: recipe.pk, target: pk})
+                    for recipe, related in zip(recipes, links)
+                    for pk in related[relation]
+                ], batch_size=BULK_BATCH_SIZE)
+        return recipes
+
+
+class RecipeBulkItemSerializer(serializers.ModelSerializer):
+    """One recipe of a bulk create request."""
+    ingredients = serializers.ListField(child=serializers.IntegerField(),
+                                        default=list)
+    tags = serializers.ListField(child=serializers.IntegerField(),
+                                 default=list)
+
+    class Meta:
+        model = Recipe
+        fields = ['title', 'description', 'time_minutes', 'price', 'link',
+                  'ingredients', 'tags']
+        list_serializer_class = RecipeBulkListSerializer
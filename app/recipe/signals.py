@@ -0,0 +1,22 @@
+"""Signal handlers invalidating the per-user response cache."""
+
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from core.models import Ingredient, Recipe, Tag
+from recipe.cache import bump_version
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def invalidate_user_cache(sender, instance, action=None, **kwargs):
+    """Bump the owner's data version whenever their data changes."""
+    if action is not None and not action.startswith('post_'):
+        return
+    bump_version(instance.user_id)
@@ -3,20 +3,48 @@
 from decimal import Decimal
 
 from django.contrib.auth import get_user_model
-from django.test import TestCase 
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
+from io import BytesIO, StringIO
+from django.db import connection, connections
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.storage import default_storage
+from django.core.files.base import ContentFile
+from django.core.cache import cache
+from django.test import override_settings
 from rest_framework.reverse import reverse 
 from rest_framework import status
-from rest_framework.test import APIClient 
+from rest_framework.test import (APIClient, APIRequestFactory,
+                                 force_authenticate)
 from rest_framework.response import Response
-from core.models import Recipe, Tag, Ingredient
+from rest_framework.authtoken.models import Token
+from core.models import ImageBlob, ImageUpload, Recipe, Tag, Ingredient
 from core.models import User,recipe_image_file_path
 from unittest.mock import patch
 from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
+from recipe import uploads
+from recipe.views import TagDetail
+from recipe.async_views import AsyncReadHandler, db_executor
+from recipe.cache import bump_version, stats as cache_stats
+from core.checks import check_shared_caches
+from core.tests.utils import TempMediaRootMixin
+from core.images import evict_resized, resize_cache_dir, resize_stats
 from PIL import Image
+import base64
+import csv
+import hashlib
+import json
 import os
 import tempfile
+import threading
+from concurrent.futures import wait
+from urllib.parse import urlencode
+
+from asgiref.sync import async_to_sync
 RECIPE_URL = reverse('recipe:recipe-list')
+BULK_URL = reverse('recipe:recipe-bulk')
+EXPORT_URL = reverse('recipe:recipe-export')
 
 
 def create_user(**params):
@@ -46,11 +74,11 @@ def create_recipe(user, **params):
     recipe = Recipe.objects.create(user=user, **defaults)
 
     # 创建 Ingredient，并关联 user
-    ingredient = Ingredient.objects.create(user=user, name="Salt")
+    ingredient, _ = Ingredient.objects.get_or_create(user=user, name="Salt")
     recipe.ingredients.add(ingredient)  # 关联 ManyToMany 关系
 
     # 创建 Tag，并关联 user
-    tag = Tag.objects.create(user=user, name="Dinner")
+    tag, _ = Tag.objects.get_or_create(user=user, name="Dinner")
     recipe.tags.add(tag)  # 关联 ManyToMany 关系
     recipe.status_code = status.HTTP_201_CREATED
 
@@ -88,7 +116,7 @@ class PrivateRecipeApiTests(TestCase):
         recipes = Recipe.objects.all().order_by('-id')
         serializer = RecipeSerializer(recipes, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
     def test_recipe_list_limited_to_user(self):
         """Test list of recipes is limited to authenticated user."""
@@ -104,7 +132,168 @@ class PrivateRecipeApiTests(TestCase):
         recipes = Recipe.objects.filter(user=self.user)
         serializer = RecipeSerializer(recipes, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
+
+    def test_list_query_count_constant(self):
+        """Test listing recipes takes the same queries for any page size."""
+        create_recipe(user=self.user)
+        with self.assertNumQueries(1):
+            self.client.get(RECIPE_URL)
+
+        for _ in range(5):
+            create_recipe(user=self.user)
+        with self.assertNumQueries(1):
+            res = self.client.get(RECIPE_URL)
+
+        self.assertEqual(len(res.data['results']), 6)
+        self.assertEqual(res.data['results'][0]['ingredient_names'], ['Salt'])
+        self.assertEqual(res.data['results'][0]['tag_names'], ['Dinner'])
+
+    def test_list_cursor_pagination(self):
+        """Test recipes are paged by id with opaque cursors."""
+        recipes = [create_recipe(user=self.user) for _ in range(5)]
+        expected = [r.id for r in reversed(recipes)]
+
+        res = self.client.get(RECIPE_URL, {'page_size': 2})
+        self.assertEqual([r['id'] for r in res.data['results']], expected[:2])
+        self.assertIsNone(res.data['previous'])
+        self.assertNotIn('count', res.data)
+
+        res = self.client.get(res.data['next'])
+        self.assertEqual([r['id'] for r in res.data['results']], expected[2:4])
+
+        with CaptureQueriesContext(connection) as queries:
+            last = self.client.get(res.data['next'])
+        self.assertEqual([r['id'] for r in last.data['results']], expected[4:])
+        self.assertIsNone(last.data['next'])
+        for query in queries.captured_queries:
+            self.assertNotIn('OFFSET', query['sql'])
+            self.assertNotIn('COUNT(', query['sql'])
+
+        res = self.client.get(last.data['previous'])
+        self.assertEqual([r['id'] for r in res.data['results']], expected[2:4])
+
+    def test_tampered_cursor_rejected(self):
+        """Test cursors with values of the wrong type return 404, not 500."""
+        create_recipe(user=self.user)
+
+        for position in ('["abc"]', '[{}]', '[null]', '[1, 2]', '1'):
+            query = urlencode({'p': position}).encode()
+            cursor = base64.b64encode(query).decode()
+            res = self.client.get(RECIPE_URL, {'cursor': cursor})
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND,
+                             position)
+
+        cursor = base64.b64encode(
+            urlencode({'p': '[NaN, 1]'}).encode()).decode()
+        res = self.client.get(RECIPE_URL, {'search': 'x', 'cursor': cursor})
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_search_recipes_ranked(self):
+        """Test searching matches title and description ranked by relevance."""
+        in_desc = create_recipe(user=self.user, title='Stew',
+                                description='Slow cooked with curry paste')
+        in_title = create_recipe(user=self.user, title='Thai green curry',
+                                 description='Quick weeknight dinner')
+        create_recipe(user=self.user, title='Pancakes', description='Sweet')
+
+        res = self.client.get(RECIPE_URL, {'search': 'curry'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['id'] for r in res.data['results']],
+                         [in_title.id, in_desc.id])
+
+    def test_search_vector_updated_on_save(self):
+        """Test the search vector follows title changes."""
+        recipe = create_recipe(user=self.user, title='Pancakes')
+        recipe.title = 'Waffles'
+        recipe.save()
+
+        self.assertFalse(Recipe.objects.search('pancakes').exists())
+        self.assertTrue(Recipe.objects.search('waffle').exists())
+
+    def test_search_pagination_with_equal_rank(self):
+        """Test search results with tied rank are paged without gaps."""
+        recipes = [create_recipe(user=self.user, title='Soup')
+                   for _ in range(5)]
+
+        seen = []
+        res = self.client.get(RECIPE_URL, {'search': 'soup', 'page_size': 2})
+        seen += [r['id'] for r in res.data['results']]
+        while res.data['next']:
+            res = self.client.get(res.data['next'])
+            seen += [r['id'] for r in res.data['results']]
+
+        self.assertEqual(seen, [r.id for r in reversed(recipes)])
+
+    def test_filter_by_ingredients_match_any_and_all(self):
+        """Test match=any/all ingredient filtering without duplicates."""
+        sugar = Ingredient.objects.create(user=self.user, name='Sugar')
+        pepper = Ingredient.objects.create(user=self.user, name='Pepper')
+        both = create_recipe(user=self.user, title='Both')
+        both.ingredients.add(sugar, pepper)
+        only_sugar = create_recipe(user=self.user, title='Only sugar')
+        only_sugar.ingredients.add(sugar)
+        create_recipe(user=self.user, title='Neither')
+        ids = f'{sugar.id},{pepper.id}'
+
+        res = self.client.get(RECIPE_URL, {'ingredients': ids})
+        self.assertEqual([r['id'] for r in res.data['results']],
+                         [only_sugar.id, both.id])
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(RECIPE_URL,
+                                  {'ingredients': ids, 'match': 'all'})
+        self.assertEqual([r['id'] for r in res.data['results']], [both.id])
+        self.assertNotIn('DISTINCT', queries.captured_queries[0]['sql'])
+
+    def test_filter_invalid_params(self):
+        """Test non-digit ids are ignored and bad match values rejected."""
+        recipe = create_recipe(user=self.user)
+        tag = recipe.tags.first()
+
+        res = self.client.get(RECIPE_URL, {'tags': f'abc,{tag.id}'})
+        self.assertEqual(len(res.data['results']), 1)
+
+        res = self.client.get(detail_url(recipe.id), {'tags': 'abc'})
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+        res = self.client.get(RECIPE_URL, {'tags': tag.id, 'match': 'most'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_related_arrays_follow_m2m_changes(self):
+        """Test tag/ingredient arrays track adds, renames and deletes."""
+        recipe = create_recipe(user=self.user)
+        salt = recipe.ingredients.get()
+        pepper = Ingredient.objects.create(user=self.user, name='Pepper')
+        pepper.recipe_set.add(recipe)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.ingredient_ids, [salt.id, pepper.id])
+        self.assertEqual(recipe.ingredient_names, ['Salt', 'Pepper'])
+
+        salt.name = 'Sea salt'
+        salt.save()
+        pepper.delete()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.ingredient_names, ['Sea salt'])
+
+        tag = recipe.tags.get()
+        tag.recipe_set.clear()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.tag_ids, [])
+
+    def test_save_keeps_concurrently_synced_arrays(self):
+        """Test saving a stale instance does not overwrite newer arrays."""
+        recipe = create_recipe(user=self.user)
+        stale = Recipe.objects.get(pk=recipe.pk)
+        recipe.tags.add(Tag.objects.create(user=self.user, name='Vegan'))
+
+        stale.title = 'Renamed'
+        stale.save()
+
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.title, 'Renamed')
+        self.assertEqual(recipe.tag_names, ['Dinner', 'Vegan'])
 
     def test_get_recipe_detail(self):
         """Test get recipe detail.""" 
@@ -212,7 +401,173 @@ class PrivateRecipeApiTests(TestCase):
         req.return_value = 'test'
         self.assertEqual(recipe_image_file_path(None,filename), 
                          f'uploads/recipe/{filename}')
-        
+
+
+class BulkRecipeApiTests(TestCase):
+    """Test the bulk recipe create endpoint."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='bulk@example.com',
+                                password='testpass123')
+        self.client.force_authenticate(self.user)
+        self.salt = Ingredient.objects.create(user=self.user, name='Salt')
+        self.tag = Tag.objects.create(user=self.user, name='Dinner')
+
+    def _payload(self, count):
+        return [{
+            'title': f'Recipe {i}',
+            'time_minutes': 10,
+            'price': '2.50',
+            'ingredients': [self.salt.id],
+            'tags': [self.tag.id],
+        } for i in range(count)]
+
+    def test_bulk_create(self):
+        """Test a batch is inserted with a constant number of queries."""
+        with self.assertNumQueries(7):
+            res = self.client.post(BULK_URL, self._payload(20), format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.data), 20)
+        self.assertEqual(res.data[0]['ingredient_names'], ['Salt'])
+        recipe = Recipe.objects.get(id=res.data[0]['id'])
+        self.assertEqual(list(recipe.ingredients.all()), [self.salt])
+        self.assertEqual(list(recipe.tags.all()), [self.tag])
+        self.assertTrue(Recipe.objects.search('recipe').exists())
+
+    def test_bulk_create_reports_item_errors(self):
+        """Test an invalid item rejects the batch with per-item errors."""
+        other = create_user(email='other-bulk@example.com',
+                            password='testpass123')
+        foreign = Ingredient.objects.create(user=other, name='Pepper')
+        payload = self._payload(3)
+        payload[1]['ingredients'] = [foreign.id]
+        del payload[2]['title']
+
+        res = self.client.post(BULK_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data[0], {})
+        self.assertIn('title', res.data[2])
+        self.assertFalse(Recipe.objects.filter(user=self.user).exists())
+
+        res = self.client.post(BULK_URL, payload[:2], format='json')
+        self.assertIn('ingredients', res.data[1])
+        self.assertFalse(Recipe.objects.filter(user=self.user).exists())
+
+
+class ExportApiTests(TestCase):
+    """Test the streaming recipe export."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='export@example.com',
+                                password='testpass123')
+        self.client.force_authenticate(self.user)
+
+    def test_export_ndjson(self):
+        """Test every recipe of the user is streamed as one JSON line."""
+        recipes = [create_recipe(user=self.user, title=f'R{i}')
+                   for i in range(3)]
+        create_recipe(user=create_user(email='x@example.com',
+                                       password='pass12345'))
+
+        res = self.client.get(EXPORT_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.streaming)
+        body = b''.join(res.streaming_content)
+        lines = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([line['id'] for line in lines],
+                         [r.id for r in recipes])
+        self.assertEqual(lines[0]['ingredient_names'], ['Salt'])
+        self.assertEqual(lines[0]['price'], '5.25')
+
+    def test_export_csv(self):
+        """Test the CSV export has a header and joined list columns."""
+        recipe = create_recipe(user=self.user)
+        recipe.tags.add(Tag.objects.create(user=self.user, name='Quick'))
+
+        res = self.client.get(EXPORT_URL, {'type': 'csv'})
+
+        rows = list(csv.DictReader(
+            b''.join(res.streaming_content).decode().splitlines()
+        ))
+        self.assertEqual(res['Content-Type'], 'text/csv')
+        self.assertEqual(rows[0]['tag_names'], 'Dinner|Quick')
+
+        res = self.client.get(EXPORT_URL, {'type': 'xml'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class NameBulkUpsertApiTests(TestCase):
+    """Test bulk get-or-create of tags and ingredients by name."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='names@example.com',
+                                password='testpass123')
+        self.client.force_authenticate(self.user)
+
+    def test_bulk_upsert_ingredients(self):
+        """Test names are normalized, deduped and resolved to ids."""
+        salt = Ingredient.objects.create(user=self.user, name='Salt')
+        payload = {'names': ['salt', 'Olive  oil', ' olive oil ', 'Basil']}
+
+        with self.assertNumQueries(3):
+            res = self.client.post(reverse('recipe:ingredient-bulk'), payload,
+                                   format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data['created'], ['Olive oil', 'Basil'])
+        self.assertEqual(res.data['ids']['salt'], salt.id)
+        self.assertEqual(res.data['ids']['Olive  oil'],
+                         res.data['ids']['olive oil'])
+        self.assertEqual(Ingredient.objects.filter(user=self.user).count(), 3)
+
+        res = self.client.post(reverse('recipe:ingredient-bulk'), payload,
+                               format='json')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['created'], [])
+
+    def test_duplicate_tag_name_rejected(self):
+        """Test creating a tag that differs only in case is rejected."""
+        Tag.objects.create(user=self.user, name='Vegan')
+        res = self.client.post(reverse('recipe:tag-create'), {'name': 'vegan'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 1)
+
+    def test_concurrent_duplicate_name_rejected(self):
+        """Test a duplicate that slips past validation is a 400, not a 500."""
+        Tag.objects.create(user=self.user, name='Vegan')
+        tag = Tag.objects.create(user=self.user, name='Quick')
+
+        # As if a concurrent request created the name after the check.
+        with patch('recipe.serializers.validate_unique_name',
+                   lambda serializer, value: value):
+            res = self.client.post(reverse('recipe:tag-create'),
+                                   {'name': 'vegan'})
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+            request = APIRequestFactory().patch('/', {'name': 'VEGAN'})
+            force_authenticate(request, self.user)
+            res = TagDetail.as_view()(request, pk=tag.id)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_upsert_unicode_case(self):
+        """Test names whose case folds differ between Python and PostgreSQL."""
+        payload = {'names': ['İstanbul spice', 'ẞ mix', 'ß mix', 'STRASSE']}
+
+        res = self.client.post(reverse('recipe:tag-bulk'), payload,
+                               format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(set(res.data['ids']), set(payload['names']))
+        self.assertEqual(Tag.objects.filter(user=self.user).count(),
+                         len(set(res.data['ids'].values())))
+
+
 class ImageUploadTestCase(TestCase):
     """Test recipe image upload."""
     def setUp(self):
@@ -239,6 +594,50 @@ class ImageUploadTestCase(TestCase):
         self.assertTrue(os.path.exists(self.recipe.image.path))
         self.assertIn('image',res.data)
 
+    def test_image_processed_off_request(self):
+        """Test uploads are queued and rendered by the worker command."""
+        url = reverse('recipe:recipe-upload-image', args=[self.recipe.id])
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as image_file:
+            img = Image.new('RGB', (800, 400))
+            exif = img.getexif()
+            exif[0x0112] = 6  # Orientation: rotate 90 degrees clockwise.
+            img.save(image_file, format='JPEG', exif=exif.tobytes())
+            image_file.seek(0)
+            res = self.client.post(url, {'image': image_file},
+                                   format='multipart')
+
+        self.assertEqual(res.data['image_status'], 'pending')
+        self.assertEqual(res.data['image_renditions'], {})
+
+        call_command('process_images', '--once', stdout=StringIO())
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.image_status, 'ready')
+        small = self.recipe.image_renditions['jpeg']['320']
+        with default_storage.open(small) as rendition:
+            rendered = Image.open(rendition)
+            self.assertEqual(rendered.size, (320, 640))
+            self.assertNotIn(0x0112, rendered.getexif())
+        res = self.client.get(detail_url(self.recipe.id))
+        small_url = res.data['image_renditions']['jpeg']['320']
+        self.assertTrue(small_url.startswith('http'))
+        for widths in self.recipe.image_renditions.values():
+            for name in widths.values():
+                default_storage.delete(name)
+
+    def test_recipe_update_ignores_image(self):
+        """Test images are only replaced through the upload endpoint."""
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as image_file:
+            Image.new('RGB', (10, 10)).save(image_file, format='JPEG')
+            image_file.seek(0)
+            res = self.client.patch(detail_url(self.recipe.id),
+                                    {'image': image_file}, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.recipe.refresh_from_db()
+        self.assertFalse(self.recipe.image)
+        self.assertEqual(self.recipe.image_status, 'none')
+
     def test_upload_image_not_image(self):
         """Test uploading a non-image file to a recipe."""
         url = reverse('recipe:recipe-upload-image', args=[self.recipe.id])
@@ -248,4 +647,481 @@ class ImageUploadTestCase(TestCase):
             payload = {'image': text_file}
             res = self.client.post(url, payload, format='multipart')
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
-        
\ No newline at end of file
+
+
+class ResumableUploadApiTests(TempMediaRootMixin, TestCase):
+    """Test resumable, chunked recipe image uploads."""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = create_user(email='chunks@example.com',
+                                password='testpass123')
+        self.client.force_authenticate(self.user)
+        self.recipe = create_recipe(user=self.user)
+        buffer = BytesIO()
+        Image.new('RGB', (40, 40), 'blue').save(buffer, format='PNG')
+        self.data = buffer.getvalue()
+
+    def _start(self, size=None):
+        url = reverse('recipe:recipe-create-upload', args=[self.recipe.id])
+        res = self.client.post(url, {'filename': 'photo.png',
+                                     'size': size or len(self.data)})
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        return reverse('recipe:recipe-upload-chunk',
+                       args=[self.recipe.id, res.data['id']])
+
+    def _patch(self, url, start, end):
+        return self.client.generic(
+            'PATCH', url, self.data[start:end],
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end - 1}/{len(self.data)}')
+
+    def test_chunked_upload_resumes_and_finalizes(self):
+        """Test chunks append at the offset and finalize attaches the image."""
+        url = self._start()
+        half = len(self.data) // 2
+
+        res = self._patch(url, 0, half)
+        self.assertEqual(res.data['offset'], half)
+        # A retried or skipped chunk is refused with the offset to resume at.
+        res = self._patch(url, 0, half)
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(res.data['offset'], half)
+        self.assertEqual(self.client.get(url).data['offset'], half)
+
+        res = self.client.post(f'{url}finalize/')
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+
+        self._patch(url, half, len(self.data))
+        res = self.client.post(f'{url}finalize/')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['image_status'], 'pending')
+        self.recipe.refresh_from_db()
+        with self.recipe.image.open('rb') as image:
+            self.assertEqual(image.read(), self.data)
+        self.assertFalse(ImageUpload.objects.exists())
+
+    def test_chunk_read_before_row_lock(self):
+        """Test the request body is spooled outside the locking transaction."""
+        url = self._start()
+        depths = {}
+
+        def record(name, func):
+            def wrapper(*args):
+                depths[name] = len(connection.savepoint_ids)
+                return func(*args)
+            return wrapper
+
+        read = record('read', uploads.spool_chunk)
+        write = record('write', uploads.append_chunk)
+        with patch('recipe.uploads.spool_chunk', read), \
+                patch('recipe.uploads.append_chunk', write):
+            res = self._patch(url, 0, len(self.data))
+
+        self.assertEqual(res.data['offset'], len(self.data))
+        self.assertLess(depths['read'], depths['write'])
+
+    def test_chunk_without_body(self):
+        """Test a chunk request with no body is rejected."""
+        url = self._start()
+        res = self.client.generic(
+            'PATCH', url, b'',
+            HTTP_CONTENT_RANGE=f'bytes 0-9/{len(self.data)}')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url).data['offset'], 0)
+
+    def test_short_chunk_not_appended(self):
+        """Test a body shorter than its Content-Range is rejected."""
+        url = self._start()
+        res = self.client.generic(
+            'PATCH', url, self.data[:5],
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes 0-9/{len(self.data)}')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url).data['offset'], 0)
+        self.assertEqual(self._patch(url, 0, 10).data['offset'], 10)
+
+    def test_upload_limits(self):
+        """Test oversized uploads and chunks are rejected."""
+        url = reverse('recipe:recipe-create-upload', args=[self.recipe.id])
+        res = self.client.post(url, {'filename': 'huge.png', 'size': 10 ** 12})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        url = self._start()
+        with override_settings(RECIPE_IMAGE_UPLOAD_CHUNK_BYTES=10):
+            res = self._patch(url, 0, 11)
+        self.assertEqual(res.status_code,
+                         status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    def test_finalize_rejects_non_image(self):
+        """Test finalizing a non-image fails and drops the session."""
+        self.data = b'not an image at all'
+        url = self._start()
+        self._patch(url, 0, len(self.data))
+        res = self.client.post(f'{url}finalize/')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(ImageUpload.objects.exists())
+
+
+class ContentAddressedImageTests(TempMediaRootMixin, TestCase):
+    """Test identical uploads share one reference-counted file."""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = create_user(email='blobs@example.com',
+                                password='testpass123')
+        self.client.force_authenticate(self.user)
+        buffer = BytesIO()
+        Image.new('RGB', (10, 10), 'red').save(buffer, format='JPEG')
+        self.image_bytes = buffer.getvalue()
+
+    def _upload(self, recipe):
+        url = reverse('recipe:recipe-upload-image', args=[recipe.id])
+        upload = SimpleUploadedFile('photo.jpg', self.image_bytes,
+                                    'image/jpeg')
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(url, {'image': upload}, format='multipart')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        recipe.refresh_from_db()
+        return recipe.image.name
+
+    def test_identical_uploads_share_file(self):
+        """Test the same bytes are stored once under their digest."""
+        first = create_recipe(user=self.user)
+        second = create_recipe(user=self.user)
+        name = self._upload(first)
+
+        self.assertEqual(self._upload(second), name)
+        self.assertIn(hashlib.sha256(self.image_bytes).hexdigest(), name)
+        blob = ImageBlob.objects.get(name=name)
+        self.assertEqual((blob.size, blob.ref_count),
+                         (len(self.image_bytes), 2))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(default_storage.exists(name))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(ImageBlob.objects.filter(name=name).exists())
+
+    def test_reupload_keeps_reference_count(self):
+        """Test replacing an image with the same bytes keeps one reference."""
+        recipe = create_recipe(user=self.user)
+        name = self._upload(recipe)
+        self._upload(recipe)
+
+        self.assertEqual(ImageBlob.objects.get(name=name).ref_count, 1)
+
+    def test_replacing_outside_api_releases_old_file(self):
+        """Test any save storing a new image releases the replaced one."""
+        recipe = create_recipe(user=self.user)
+        old_name = self._upload(recipe)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.image.save('other.jpg', ContentFile(b'other bytes'))
+        self.assertFalse(default_storage.exists(old_name))
+        self.assertFalse(ImageBlob.objects.filter(name=old_name).exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.image.save('again.jpg', ContentFile(b'other bytes'))
+        blob = ImageBlob.objects.get(name=recipe.image.name)
+        self.assertEqual(blob.ref_count, 1)
+
+    def test_save_after_concurrent_delete(self):
+        """Test storing bytes whose blob row was just deleted recreates it."""
+        recipe = create_recipe(user=self.user)
+        name = self._upload(recipe)
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+
+        other = create_recipe(user=self.user)
+        self.assertEqual(self._upload(other), name)
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(ImageBlob.objects.get(name=name).ref_count, 1)
+
+
+class ImageResizeApiTests(TempMediaRootMixin, TestCase):
+    """Test the on-demand image resize endpoint and its disk cache."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.client = APIClient()
+        self.user = create_user(email='resize@example.com',
+                                password='testpass123')
+        self.client.force_authenticate(self.user)
+        self.recipe = create_recipe(user=self.user)
+        buffer = BytesIO()
+        Image.new('RGB', (1600, 800)).save(buffer, format='JPEG')
+        self.recipe.image.save('big.jpg', ContentFile(buffer.getvalue()))
+        self.url = reverse('recipe:recipe-image', args=[self.recipe.id])
+
+    def test_variant_rendered_once(self):
+        """Test a variant is rendered on the first request and then reused."""
+        res = self.client.get(self.url, {'width': 320})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        body = b''.join(res.streaming_content)
+        self.assertEqual(Image.open(BytesIO(body)).size, (320, 160))
+
+        res = self.client.get(self.url, {'width': 320})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(resize_stats(),
+                         {'hits': 1, 'renders': 1, 'evictions': 0})
+
+        res = self.client.get(self.url, {'width': 320},
+                              HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_width_and_type_allow_list(self):
+        """Test widths and formats outside the allow-list are rejected."""
+        res = self.client.get(self.url, {'width': 321})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        res = self.client.get(self.url, {'width': 320, 'type': 'gif'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_least_recently_used_evicted(self):
+        """Test the cache evicts the least recently used variant when full."""
+        for width in (128, 64, 256, 128):
+            self.client.get(self.url, {'width': width})
+        total = sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, files in os.walk(resize_cache_dir())
+            for name in files if not name.endswith('.lock')
+        )
+        with override_settings(RECIPE_IMAGE_CACHE_MAX_BYTES=total - 1):
+            self.assertEqual(evict_resized(), 1)
+
+        self.client.get(self.url, {'width': 64})
+        self.client.get(self.url, {'width': 256})
+        self.assertEqual(resize_stats(),
+                         {'hits': 2, 'renders': 4, 'evictions': 1})
+
+    def test_cache_walked_only_past_cap(self):
+        """Test misses count bytes instead of walking the cache each time."""
+        with patch('core.images.evict_resized', wraps=evict_resized) as evict:
+            for width in (64, 128, 256):
+                self.client.get(self.url, {'width': width})
+            # The first miss finds no count yet and recounts from disk.
+            self.assertEqual(evict.call_count, 1)
+
+            with override_settings(RECIPE_IMAGE_CACHE_MAX_BYTES=1):
+                self.client.get(self.url, {'width': 320})
+            self.assertEqual(evict.call_count, 2)
+        self.assertEqual(resize_stats()['evictions'], 3)
+
+    def test_variant_evicted_while_served(self):
+        """Test a variant deleted after lookup is still served in full."""
+        res = self.client.get(self.url, {'width': 320})
+        for root, _, files in os.walk(resize_cache_dir()):
+            for name in files:
+                os.unlink(os.path.join(root, name))
+
+        body = b''.join(res.streaming_content)
+        self.assertEqual(Image.open(BytesIO(body)).size, (320, 160))
+
+    def test_undecodable_image_not_found(self):
+        """Test an image that cannot be decoded is a 404, not a 500."""
+        self.recipe.image.save('broken.jpg', ContentFile(b'not an image'))
+
+        res = self.client.get(self.url, {'width': 320})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+def close_db_connections():
+    """Close the persistent connection held by every ``db_executor`` thread."""
+    workers = db_executor._max_workers
+    # Every task blocks until all have started, so each runs in its own thread.
+    barrier = threading.Barrier(workers)
+
+    def close():
+        barrier.wait()
+        connections.close_all()
+
+    wait([db_executor.submit(close) for _ in range(workers)])
+
+
+class AsyncReadApiTests(TransactionTestCase):
+    """Test the async read endpoints match the sync ones."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user(email='async@example.com',
+                                password='testpass123')
+        self.recipe = create_recipe(user=self.user)
+        self.client = APIClient()
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def tearDown(self):
+        # Executor threads keep their connections open (CONN_MAX_AGE).
+        close_db_connections()
+
+    def test_read_endpoints(self):
+        """Test the async endpoints serve the same data as the sync ones."""
+        pairs = [
+            (reverse('recipe-async:recipe-list'), RECIPE_URL),
+            (reverse('recipe-async:recipe-detail', args=[self.recipe.id]),
+             detail_url(self.recipe.id)),
+            (reverse('recipe-async:tag-list'), reverse('recipe:tag-list')),
+            (reverse('recipe-async:ingredient-list'),
+             reverse('recipe:ingredient-list')),
+        ]
+        for async_url, sync_url in pairs:
+            res = self.client.get(async_url)
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(res.json(), self.client.get(sync_url).json())
+
+    def test_handler_runs_middleware(self):
+        """Test the ASGI handler applies the configured middleware."""
+        key = Token.objects.get(user=self.user).key
+        scope = {
+            'type': 'http', 'method': 'GET', 'query_string': b'',
+            'path': reverse('recipe-async:recipe-list'),
+            'headers': [(b'host', b'testserver'),
+                        (b'authorization', f'Token {key}'.encode())],
+        }
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            sent.append(message)
+
+        async_to_sync(AsyncReadHandler())(scope, receive, send)
+
+        self.assertEqual(sent[0]['status'], status.HTTP_200_OK)
+        headers = dict(sent[0]['headers'])
+        self.assertEqual(headers[b'X-Content-Type-Options'], b'nosniff')
+        self.assertEqual(headers[b'X-Frame-Options'], b'DENY')
+        self.assertIn(b'db;', headers[b'Server-Timing'])
+
+    def test_read_only_and_authenticated(self):
+        """Test the async endpoints reject writes and anonymous requests."""
+        url = reverse('recipe-async:recipe-detail', args=[self.recipe.id])
+        res = self.client.patch(url, {'title': 'Changed'})
+        self.assertEqual(res.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+        res = APIClient().get(reverse('recipe-async:recipe-list'))
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class ResponseCacheTests(TestCase):
+    """Test the per-user versioned list response cache."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='cache@example.com',
+                                password='testpass123')
+        self.client.force_authenticate(self.user)
+
+    def test_list_served_from_cache(self):
+        """Test repeated list requests hit the cache without queries."""
+        create_recipe(user=self.user)
+        before = cache_stats()
+        first = self.client.get(RECIPE_URL, {'page_size': 5, 'match': 'any'})
+
+        with self.assertNumQueries(0):
+            second = self.client.get(RECIPE_URL,
+                                     {'match': 'any', 'page_size': 5})
+
+        self.assertEqual(first.data, second.data)
+        after = cache_stats()
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 1)
+
+    @override_settings(ALLOWED_HOSTS=['a.example.com', 'b.example.com'])
+    def test_cache_keyed_by_host(self):
+        """Test cached pages keep the next link of the host they are for."""
+        create_recipe(user=self.user)
+        create_recipe(user=self.user)
+        self.client.get(RECIPE_URL, {'page_size': 1},
+                        HTTP_HOST='a.example.com')
+
+        res = self.client.get(RECIPE_URL, {'page_size': 1},
+                              HTTP_HOST='b.example.com')
+
+        self.assertTrue(res.data['next'].startswith('http://b.example.com/'))
+
+    def test_local_cache_refused(self):
+        """Test the deploy check reports process-local caches."""
+        errors = check_shared_caches(None)
+        self.assertEqual({error.id for error in errors}, {'core.E001'})
+        self.assertEqual(len(errors), 4)
+        self.assertIn('RECIPE_CACHE_ALIAS', errors[0].msg)
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': tempfile.gettempdir(),
+        }}):
+            self.assertEqual(check_shared_caches(None), [])
+
+    def test_writes_invalidate_cache(self):
+        """Test recipe, tag and m2m changes invalidate the user's lists."""
+        recipe = create_recipe(user=self.user)
+        self.client.get(RECIPE_URL)
+
+        recipe.title = 'Renamed'
+        recipe.save()
+        res = self.client.get(RECIPE_URL)
+        self.assertEqual(res.data['results'][0]['title'], 'Renamed')
+
+        tag = Tag.objects.create(user=self.user, name='Lunch')
+        recipe.tags.add(tag)
+        res = self.client.get(RECIPE_URL)
+        self.assertIn('Lunch', res.data['results'][0]['tag_names'])
+
+        res = self.client.get(reverse('recipe:tag-list'))
+        tag.delete()
+        res = self.client.get(reverse('recipe:tag-list'))
+        self.assertNotIn('Lunch', [t['name'] for t in res.data['results']])
+
+    def test_conditional_get_not_modified(self):
+        """Test an unchanged poll returns 304 without queries."""
+        recipe = create_recipe(user=self.user)
+        url = detail_url(recipe.id)
+        res = self.client.get(url)
+        etag = res['ETag']
+        self.assertFalse(etag.startswith('W/'))
+
+        with self.assertNumQueries(0):
+            res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res['ETag'], etag)
+
+        recipe.title = 'Changed'
+        recipe.save()
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res['ETag'], etag)
+
+    def test_etag_follows_version_bumped_elsewhere(self):
+        """Test a version bump from another process ends 304 answers."""
+        recipe = create_recipe(user=self.user)
+        url = detail_url(recipe.id)
+        etag = self.client.get(url)['ETag']
+
+        # E.g. `manage.py process_images`, sharing only the cache.
+        bump_version(self.user.pk)
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_list_etag_depends_on_params(self):
+        """Test list ETags differ per query and match on repeat polls."""
+        create_recipe(user=self.user)
+        etag = self.client.get(RECIPE_URL)['ETag']
+
+        res = self.client.get(RECIPE_URL, {'page_size': 1},
+                              HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        res = self.client.get(RECIPE_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
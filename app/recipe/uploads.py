@@ -0,0 +1,79 @@
+"""Resumable, chunked recipe image uploads.
+
+A client creates a session with the file's name and size, then sends the
+bytes as ``PATCH`` requests carrying ``Content-Range: bytes start-end/size``.
+Each chunk must start at the session's current offset, so after a dropped
+connection the client asks for the offset and carries on from there.
+"""
+
+import os
+import re
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+COPY_BUFFER_SIZE = 64 * 1024
+
+
+def max_upload_size():
+    return getattr(settings, 'RECIPE_IMAGE_UPLOAD_MAX_BYTES', 20 * 1024 * 1024)
+
+
+def max_chunk_size():
+    return getattr(settings, 'RECIPE_IMAGE_UPLOAD_CHUNK_BYTES', 1024 * 1024)
+
+
+def parse_content_range(header):
+    """Return ``(start, length, total)`` from a Content-Range header."""
+    match = CONTENT_RANGE.match(header or '')
+    if not match:
+        return None
+    start, end, total = map(int, match.groups())
+    if end < start:
+        return None
+    return start, end - start + 1, total
+
+
+def spool_chunk(stream, length):
+    """Read ``length`` bytes of ``stream`` into a temporary file.
+
+    Runs before the upload row is locked, so a slow client holds no lock.
+    Returns the file rewound, or None if the body ended short, e.g. when
+    the client went away; a partial chunk is never appended.
+    """
+    chunk = tempfile.TemporaryFile()
+    remaining = length
+    while remaining:
+        data = stream.read(min(COPY_BUFFER_SIZE, remaining))
+        if not data:
+            chunk.close()
+            return None
+        chunk.write(data)
+        remaining -= len(data)
+    chunk.seek(0)
+    return chunk
+
+
+def append_chunk(upload, chunk):
+    """Write a spooled chunk at the upload's offset.
+
+    The file is truncated to the offset first, dropping whatever a chunk
+    that failed half-way left behind. Returns the number of bytes written.
+    """
+    path = default_storage.path(upload.partial_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'ab') as partial:
+        partial.truncate(upload.offset)
+        shutil.copyfileobj(chunk, partial, COPY_BUFFER_SIZE)
+        written = chunk.tell()
+        partial.flush()
+        os.fsync(partial.fileno())
+    return written
+
+
+def discard(upload):
+    """Delete an upload's partial file."""
+    default_storage.delete(upload.partial_name)
@@ -18,9 +18,12 @@ urlpatterns = [
     path('recipe-create/', views.RecipeCreate.as_view(), name='recipe-create'),
     path('ingredients/create/', views.IngredientCreate.as_view(), name='ingredient-create'),
     path('ingredients/', views.IngredientList.as_view(), name='ingredient-list'),
+    path('ingredients/bulk/', views.IngredientBulkUpsert.as_view(),
+         name='ingredient-bulk'),
     path('ingredients/<int:id>/', views.IngredientDetail.as_view(), name='ingredient-detail'),
     path('tags/create/', views.TagCreate.as_view(), name='tag-create'),
     path('tags/', views.TagList.as_view(), name='tag-list'),
+    path('tags/bulk/', views.TagBulkUpsert.as_view(), name='tag-bulk'),
     path('tags/<int:id>/', views.TagDetail.as_view(), name='tag-detail'),
     
 ]
\ No newline at end of file
@@ -1,24 +1,68 @@
+import hashlib
+
 from django.shortcuts import render
 from django.test import tag
-from django.db import transaction
+from django.db import IntegrityError, transaction
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.http import (FileResponse, HttpResponseNotModified,
+                         StreamingHttpResponse)
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
 from django_filters.rest_framework import DjangoFilterBackend
 
 from rest_framework import viewsets,generics,mixins,status
-from rest_framework.authentication import TokenAuthentication
+from core.authentication import CachedTokenAuthentication
+from core.db.routers import ReplicaReadMixin
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.views import APIView
 from rest_framework.generics import  RetrieveAPIView
-from core.models import Recipe, Ingredient, Tag
+from core.images import (UnreadableImage, open_resized_image,
+                         rendition_formats, resize_widths)
+from core.models import ImageUpload, Recipe, Ingredient, Tag, normalize_name
+from core.storage import is_content_addressed
+from recipe.cache import CachedListMixin, ConditionalGetMixin, bump_version
+from recipe.export import CONTENT_TYPES, EXPORTERS
+from recipe.pagination import IdCursorPagination
+from recipe import uploads
 from recipe.serializers import (RecipeSerializer, RecipeDetailSerializer,IngredientSerializer,TagSerializer,
-RecipeImageSerializer)
+                                RecipeImageSerializer,
+                                RecipeBulkItemSerializer,
+                                NameListSerializer, ImageUploadSerializer,
+                                DUPLICATE_NAME_MESSAGE)
 from drf_spectacular.utils import (extend_schema, 
                                    extend_schema_view,
                                    OpenApiParameter,
                                    OpenApiTypes
                             )
 
+MATCH_CHOICES = ('any', 'all')
+BULK_MAX_ITEMS = 5000
+
+
+def _params_to_ints(qs):
+    """Convert a comma-separated string of IDs to a list of integers"""
+    return [int(pk) for pk in qs.split(',') if pk.strip().isdigit()]
+
+
+def filter_by_related_ids(queryset, query_params):
+    """Apply the ?ingredients=, ?tags= and ?match=any|all filters"""
+    match = query_params.get('match', 'any')
+    if match not in MATCH_CHOICES:
+        raise ValidationError(
+            {'match': f'Must be one of: {", ".join(MATCH_CHOICES)}.'})
+    for relation in ('ingredients', 'tags'):
+        ids = query_params.get(relation, None)
+        if ids is not None:
+            queryset = queryset.with_related_ids(
+                relation, _params_to_ints(ids), match)
+    return queryset
+
+
 # Create your views here.
 # @extend_schema_view(
 #     list=extend_schema(
@@ -36,39 +80,40 @@ from drf_spectacular.utils import (extend_schema,
 #         ]
 #     )
 # )
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ReplicaReadMixin, ConditionalGetMixin, CachedListMixin,
+                    viewsets.ModelViewSet):
     """Manage recipes in the database"""
     serializer_class = RecipeSerializer
-    queryset = Recipe.objects.all()
-    authentication_classes = (TokenAuthentication,)
+    queryset = Recipe.objects.defer('search_vector')
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
+    pagination_class = IdCursorPagination
     
-    def _params_to_ints(self,qs):
-        return [int(pk) for pk in qs.split(',') if pk.isdigit()]
-        
+    def use_replica(self, request):
+        return self.action in ('list', 'retrieve')
+
     def perform_update(self, serializer):
         """Override update to ensure update works properly"""
         serializer.save()
 
     def get_queryset(self):
         """Retrieve recipes for the authenticated user"""
-        qs = self.request.query_params.get('ingredients',None)
-        if qs is not None:
-            qs = self._params_to_ints(qs)
-            recipe_ingredients = Ingredient.objects.filter(pk__in=qs)
-            self.queryset = self.queryset.filter(ingredients__in=recipe_ingredients)
-        qs =self.request.query_params.get('tags',None)
-        if qs is not None:
-            qs = self._params_to_ints(qs)
-            recipe_tags = Tag.objects.filter(pk__in=qs)
-            self.queryset = self.queryset.filter(tags__in=recipe_tags)
+        self.queryset = filter_by_related_ids(self.queryset,
+                                              self.request.query_params)
+        search = self.request.query_params.get('search')
+        if search:
+            self.queryset = self.queryset.search(search)
         return self.queryset.filter(user=self.request.user).order_by('-id')
     
     def get_serializer_class(self):
         if self.action == 'list':
             return RecipeSerializer
-        if self.action == 'upload_image':
+        if self.action in ('upload_image', 'finalize_upload'):
             return RecipeImageSerializer
+        if self.action in ('create_upload', 'upload_chunk'):
+            return ImageUploadSerializer
+        if self.action == 'bulk':
+            return RecipeBulkItemSerializer
         return self.serializer_class
     @action(methods=['POST'],detail=True,url_path='upload-image')
     def upload_image(self, request, pk=None):
@@ -80,6 +125,147 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return Response(serializer.data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(methods=['POST'], detail=True, url_path='uploads')
+    def create_upload(self, request, pk=None):
+        """Start a resumable upload of the recipe image"""
+        recipe = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save(user=request.user, recipe=recipe)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def _get_upload(self, upload_id, lock=False):
+        queryset = ImageUpload.objects.filter(recipe=self.get_object(),
+                                              user=self.request.user)
+        if lock:
+            queryset = queryset.select_for_update()
+        try:
+            return queryset.get(pk=upload_id)
+        except (ImageUpload.DoesNotExist, DjangoValidationError):
+            raise NotFound()
+
+    @action(methods=['GET', 'PATCH', 'DELETE'], detail=True,
+            url_path=r'uploads/(?P<upload_id>[^/.]+)')
+    def upload_chunk(self, request, pk=None, upload_id=None):
+        """Report, append a Content-Range chunk to, or cancel an upload"""
+        if request.method == 'GET':
+            upload = self._get_upload(upload_id)
+            return Response(self.get_serializer(upload).data)
+        if request.method == 'DELETE':
+            upload = self._get_upload(upload_id)
+            uploads.discard(upload)
+            upload.delete()
+            return Response(status=status.HTTP_204_NO_CONTENT)
+
+        content_range = uploads.parse_content_range(
+            request.META.get('HTTP_CONTENT_RANGE'))
+        if content_range is None:
+            return Response(
+                {'detail': 'Expected a "Content-Range: bytes start-end/size" '
+                           'header.'},
+                status=status.HTTP_400_BAD_REQUEST)
+        start, length, total = content_range
+        if length > uploads.max_chunk_size():
+            return Response(
+                {'detail': f'Chunks are limited to {uploads.max_chunk_size()} '
+                           'bytes.'},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        # Checked before the body is read, and again under the row lock.
+        rejected = self._reject_chunk(self._get_upload(upload_id), start,
+                                      length, total)
+        if rejected:
+            return rejected
+        # No stream at all when the request has no body.
+        chunk = request.stream and uploads.spool_chunk(request.stream, length)
+        if chunk is None:
+            return Response({'detail': f'Expected a body of {length} bytes.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        with chunk:
+            with transaction.atomic():
+                upload = self._get_upload(upload_id, lock=True)
+                rejected = self._reject_chunk(upload, start, length, total)
+                if rejected:
+                    return rejected
+                upload.offset += uploads.append_chunk(upload, chunk)
+                upload.save(update_fields=['offset', 'updated_at'])
+        return Response(self.get_serializer(upload).data)
+
+    def _reject_chunk(self, upload, start, length, total):
+        if total != upload.size or start + length > upload.size:
+            return Response({'detail': 'Range does not fit the upload size.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if start != upload.offset:
+            # The client lost track, e.g. after a dropped connection:
+            # tell it where to resume.
+            return Response(self.get_serializer(upload).data,
+                            status=status.HTTP_409_CONFLICT)
+        return None
+
+    @action(methods=['POST'], detail=True,
+            url_path=r'uploads/(?P<upload_id>[^/.]+)/finalize')
+    def finalize_upload(self, request, pk=None, upload_id=None):
+        """Attach a completed upload as the recipe image"""
+        with transaction.atomic():
+            upload = self._get_upload(upload_id, lock=True)
+            if upload.offset != upload.size:
+                return Response(ImageUploadSerializer(upload).data,
+                                status=status.HTTP_409_CONFLICT)
+            with default_storage.open(upload.partial_name) as partial:
+                image = File(partial, name=upload.filename)
+                serializer = self.get_serializer(
+                    upload.recipe, data={'image': image}, partial=True)
+                valid = serializer.is_valid()
+                if valid:
+                    serializer.save()
+            partial_name = upload.partial_name
+            upload.delete()
+            transaction.on_commit(lambda: default_storage.delete(partial_name))
+        if not valid:
+            return Response(serializer.errors,
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(methods=['GET'], detail=True, url_path='image')
+    def image(self, request, pk=None):
+        """Serve the recipe image resized to ``?width=`` as ``?type=``"""
+        recipe = self.get_object()
+        if not recipe.image:
+            return Response({'detail': 'Recipe has no image.'},
+                            status=status.HTTP_404_NOT_FOUND)
+        widths = resize_widths()
+        formats = {name: ext for name, _, ext in rendition_formats()}
+        try:
+            width = int(request.query_params.get('width', widths[-1]))
+        except ValueError:
+            width = None
+        if width not in widths:
+            raise ValidationError(
+                {'width': f'Must be one of: {", ".join(map(str, widths))}.'})
+        image_type = request.query_params.get('type', 'jpeg')
+        if image_type not in formats:
+            raise ValidationError(
+                {'type': f'Must be one of: {", ".join(formats)}.'})
+
+        # Image names are never reused, so the variant's identity is its ETag.
+        etag = quote_etag(hashlib.md5(
+            f'{recipe.image.name}:{width}:{image_type}'.encode()).hexdigest())
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponseNotModified()
+        else:
+            try:
+                fp = open_resized_image(recipe.image, width, image_type)
+            except UnreadableImage:
+                return Response({'detail': 'Recipe image cannot be read.'},
+                                status=status.HTTP_404_NOT_FOUND)
+            response = FileResponse(fp, content_type=f'image/{image_type}')
+        response['ETag'] = etag
+        if is_content_addressed(recipe.image.name):
+            patch_cache_control(response, private=True, max_age=31536000,
+                                immutable=True)
+        else:
+            patch_cache_control(response, private=True, max_age=86400)
+        return response
+
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context['request'] = self.request
@@ -87,11 +273,42 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return context
     
     def perform_create(self, serializer): 
-        recipe = serializer.save(user=self.request.user)        
-        recipe.ingredients.set(serializer.validated_data.get('ingredients', []))        
-        recipe.tags.set(serializer.validated_data.get('tags', []))
-        headers = self.get_success_headers(serializer.data)
-        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+        # RecipeSerializer.create() links ingredients and tags itself.
+        serializer.save(user=self.request.user)
+
+    @action(methods=['GET'], detail=False, url_path='export')
+    def export(self, request):
+        """Stream all of the user's recipes as NDJSON (default) or CSV"""
+        export_type = request.query_params.get('type', 'ndjson')
+        if export_type not in EXPORTERS:
+            raise ValidationError(
+                {'type': f'Must be one of: {", ".join(EXPORTERS)}.'})
+        queryset = Recipe.objects.filter(user=request.user).order_by('id')
+        response = StreamingHttpResponse(
+            EXPORTERS[export_type](queryset),
+            content_type=CONTENT_TYPES[export_type],
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="recipes.{export_type}"')
+        return response
+
+    @action(methods=['POST'], detail=False, url_path='bulk')
+    def bulk(self, request):
+        """Create a batch of recipes in one transaction"""
+        if not isinstance(request.data, list):
+            return Response({'detail': 'Expected a list of recipes.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(request.data) > BULK_MAX_ITEMS:
+            return Response(
+                {'detail': f'At most {BULK_MAX_ITEMS} recipes per request.'},
+                status=status.HTTP_400_BAD_REQUEST)
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        recipes = serializer.save()
+        bump_version(request.user.pk)
+        data = RecipeSerializer(recipes, many=True,
+                                context=self.get_serializer_context()).data
+        return Response(data, status=status.HTTP_201_CREATED)
 
 @extend_schema_view(
     list=extend_schema(
@@ -107,29 +324,20 @@ class RecipeViewSet(viewsets.ModelViewSet):
         ]),
     ) 
 # class RecipeDetail(RetrieveAPIView):
-class RecipeDetail(generics.RetrieveUpdateAPIView):
+class RecipeDetail(ReplicaReadMixin, ConditionalGetMixin,
+                   generics.RetrieveUpdateAPIView):
     """Retrieve a recipe by ID"""
-    queryset = Recipe.objects.all()
+    queryset = Recipe.objects.defer('search_vector')
     serializer_class = RecipeDetailSerializer
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     lookup_field = 'id'
     lookup_url_kwarg = 'pk' 
 
-    def _params_to_ints(self,qs):
-        """Convert a list of string IDs to a list of integers"""
-        return [int(str_id) for str_id in qs.split(',')]
-    
     def get_queryset(self):
         """Filter recipes by the authenticated user"""
         queryset = self.queryset.filter(user=self.request.user)
-        qs_params = self.request.query_params.get('ingredients', None)
-        if qs_params is not None:
-            queryset = queryset.filter(ingredients__id__in=self._params_to_ints(qs_params))
-        qs_params = self.request.query_params.get('tags', None)
-        if qs_params is not None:
-            queryset = queryset.filter(tags__id__in=self._params_to_ints(qs_params))
-        return queryset 
+        return filter_by_related_ids(queryset, self.request.query_params)
         
     
     
@@ -138,35 +346,37 @@ class RecipeDetail(generics.RetrieveUpdateAPIView):
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     
-class RecipeList(generics.ListAPIView):
+class RecipeList(ReplicaReadMixin, ConditionalGetMixin, CachedListMixin,
+                 generics.ListAPIView):
     serializer_class = RecipeSerializer
-    queryset = Recipe.objects.all()
-    authentication_classes = (TokenAuthentication,)
+    queryset = Recipe.objects.defer('search_vector')
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
+    pagination_class = IdCursorPagination
     filter_backends = [DjangoFilterBackend]
-    filterset_fields = ['title', 'ingredients', 'tags__name']  # Filter by title, author, and tag names
+    filterset_fields = ['title', 'tags__name']  # Filter by title and tag names
     
     def get_queryset(self):
-        return self.queryset.filter(user=self.request.user).order_by('-id')
+        queryset = self.queryset.filter(user=self.request.user)
+        queryset = filter_by_related_ids(queryset, self.request.query_params)
+        search = self.request.query_params.get('search')
+        if search:
+            queryset = queryset.search(search)
+        return queryset.order_by('-id')
     
     
 class RecipeCreate(generics.CreateAPIView):
     serializer_class = RecipeSerializer
-    queryset = Recipe.objects.all()
-    authentication_classes = (TokenAuthentication,)
+    queryset = Recipe.objects.defer('search_vector')
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     
     def perform_create(self, serializer): 
         try:
             # Start a transaction to handle any failures
             with transaction.atomic():  
+                # RecipeSerializer.create() links ingredients and tags itself.
                 recipe = serializer.save(user=self.request.user)
-                ingredients = serializer.validated_data.get('ingredients', [])
-                tags = serializer.validated_data.get('tags', [])
-                
-                # Attempt to set ingredients and tags
-                recipe.ingredients.set(ingredients)
-                recipe.tags.set(tags)
 
                 return Response(RecipeSerializer(recipe).data, status=status.HTTP_201_CREATED)
         except Exception as e:
@@ -184,34 +394,56 @@ class RecipeCreate(generics.CreateAPIView):
         context['request'] = self.request
         return context
 
-class IngredientCreate(generics.CreateAPIView):
+
+class UniqueNameMixin:
+    """Report a name taken by a concurrent request as 400, not 500.
+
+    The serializer rejects duplicates up front; the ``(user_id,
+    lower(name))`` unique index catches the race that check leaves open.
+    """
+
+    def _save_unique(self, save):
+        try:
+            with transaction.atomic():
+                save()
+        except IntegrityError:
+            raise ValidationError({'name': [DUPLICATE_NAME_MESSAGE]})
+
+    def perform_create(self, serializer):
+        self._save_unique(lambda: serializer.save(user=self.request.user))
+
+    def perform_update(self, serializer):
+        self._save_unique(serializer.save)
+
+
+class IngredientCreate(UniqueNameMixin, generics.CreateAPIView):
     serializer_class = IngredientSerializer
     queryset = Ingredient.objects.all()
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     
-    def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
-    
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context['request'] = self.request
         return context
-    
-class IngredientList(generics.ListAPIView):
+
+
+class IngredientList(ConditionalGetMixin, CachedListMixin,
+                     generics.ListAPIView):
     serializer_class = IngredientSerializer
     queryset = Ingredient.objects.all()
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,) 
+    pagination_class = IdCursorPagination
     
     def get_queryset(self):
         return self.queryset.filter(user=self.request.user).order_by('-id')
-   
-class IngredientDetail(generics.RetrieveUpdateDestroyAPIView):
+
+
+class IngredientDetail(UniqueNameMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = IngredientSerializer
     queryset = Ingredient.objects.all()
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     lookup_field = 'id'
     lookup_url_kwarg = 'pk'
@@ -219,37 +451,67 @@ class IngredientDetail(generics.RetrieveUpdateDestroyAPIView):
     def get_queryset(self):
         return self.queryset.filter(user=self.request.user).order_by('-id')
 
-class TagCreate(generics.CreateAPIView):
+
+class TagCreate(UniqueNameMixin, generics.CreateAPIView):
     serializer_class = TagSerializer
     queryset = Tag.objects.all()
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     
-    def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
-    
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context['request'] = self.request
         return context
 
-class TagList(generics.ListAPIView):
+
+class TagList(ConditionalGetMixin, CachedListMixin, generics.ListAPIView):
     serializer_class = TagSerializer
     queryset = Tag.objects.all()
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
+    pagination_class = IdCursorPagination
     
     def get_queryset(self):
         return self.queryset.filter(user=self.request.user).order_by('-id') 
-    
-class TagDetail(generics.RetrieveUpdateDestroyAPIView):
+
+
+class TagDetail(UniqueNameMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = TagSerializer
     queryset = Tag.objects.all()
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     lookup_field = 'id'
     lookup_url_kwarg = 'pk'
     
     def get_queryset(self):
-        return self.queryset.filter(user=self.request.user).order_by('-id') 
\ No newline at end of file
+        return self.queryset.filter(user=self.request.user).order_by('-id')
+
+
+class NameBulkUpsert(generics.GenericAPIView):
+    """Resolve a list of names to ids, creating the missing ones"""
+    serializer_class = NameListSerializer
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+    model = None
+
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        names = serializer.validated_data['names']
+        ids, created = self.model.objects.get_or_create_many(request.user,
+                                                             names)
+        if created:
+            bump_version(request.user.pk)
+        return Response({
+            'ids': {name: ids[normalize_name(name)]
+                    for name in names if normalize_name(name)},
+            'created': created,
+        }, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+
+class IngredientBulkUpsert(NameBulkUpsert):
+    model = Ingredient
+
+
+class TagBulkUpsert(NameBulkUpsert):
+    model = Tag
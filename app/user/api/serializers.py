@@ -5,9 +5,12 @@ from rest_framework import serializers
 from django.contrib.auth import authenticate, get_user_model
 from django.utils.translation import gettext as _
 from rest_framework.authtoken.models import Token
+from core.metrics import TimedSerializerMixin
 from core.models import User
+from core.ratelimit import check_login_rate
  
-class UserSerializer(serializers.ModelSerializer):
+
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializer for the user object"""
 
     class Meta:
@@ -48,7 +51,8 @@ class AuthTokenSerializer(serializers.Serializer):
         """Validate and authenticate the user"""
         email = attrs.get('email')
         password = attrs.get('password')
-        
+
+        check_login_rate(self.context.get('request'), email)
         user = authenticate(
             request=self.context.get('request'),
             username=email,
@@ -10,7 +10,9 @@ from rest_framework import status
 from core.models import User
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.authtoken.models import Token
-from rest_framework.authentication import TokenAuthentication
+from core.authentication import CachedTokenAuthentication
+from core.db.routers import ReplicaReadMixin
+from core.ratelimit import check_login_rate
 from user.api.serializers import UserSerializer, AuthTokenSerializer
 
 # Create your views here.
@@ -24,16 +26,18 @@ class CreateTokenView(ObtainAuthToken):
     serializer_class = AuthTokenSerializer
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
     def post(self, request, *args, **kwargs):
-        serializer = self.serializer_class(data=request.data)
+        serializer = self.serializer_class(data=request.data,
+                                           context={'request': request})
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data['user']
         token, created = Token.objects.get_or_create(user=user)
         return Response({'token': token.key})
 
-class ManageUserView(generics.RetrieveUpdateAPIView):
+
+class ManageUserView(ReplicaReadMixin, generics.RetrieveUpdateAPIView):
     """Manage the authenticated user"""
     serializer_class = UserSerializer
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
     queryset = User.objects.all()
     def get_object(self):
@@ -41,7 +45,7 @@ class ManageUserView(generics.RetrieveUpdateAPIView):
 class UserDeleteView(generics.DestroyAPIView):
     """Delete the authenticated user"""
     serializer_class = UserSerializer
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
     queryset = User.objects.all()
     def get_object(self):
@@ -57,7 +61,12 @@ class LoginView(APIView):
     def post(self, request):
         username = request.data.get("username")
         password = request.data.get("password")
+        if not isinstance(username, str) or not isinstance(password, str):
+            return Response(
+                {"error": "Username and password must be strings"},
+                status=400)
 
+        check_login_rate(request, username)
         user = authenticate(username=username, password=password)
         if user:
             # Generate or get existing token
@@ -2,17 +2,26 @@
 Test for the user API
 """
 
+import hashlib
 from django.test import TestCase
 from unittest.mock import patch
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import update_last_login
 from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
 from rest_framework.authtoken.models import Token 
+from rest_framework.exceptions import AuthenticationFailed
+from django.core.cache import cache
+from django.test import override_settings
+from core.authentication import (TOKEN_KEY, CachedTokenAuthentication,
+                                 local_tokens)
+from core.ratelimit import rejected_counts
 
 CREATE_USER_URL = reverse('user:create')
 TOKEN_URL = reverse('user:token')
 ME_URL = reverse('user:me')
+LOGIN_URL = reverse('user:login')
 
 def create_user(**params):
     """Create and return a new user"""
@@ -147,3 +156,161 @@ class PrivateUserApiTests(TestCase):
         self.assertEqual(self.user.name, payload['name'])
         self.assertTrue(self.user.check_password(payload['password']))
         self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    """Test token authentication served from the token caches"""
+
+    def setUp(self):
+        cache.clear()
+        local_tokens.clear()
+        self.user = create_user(email='test@example.com',
+                                password='testpass123')
+        self.token = Token.objects.create(user=self.user)
+        self.auth = CachedTokenAuthentication()
+
+    def test_cached_token_needs_no_queries(self):
+        """Test a known token is authenticated without touching the DB"""
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(client.get(ME_URL).status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(0):
+            user, _ = self.auth.authenticate_credentials(self.token.key)
+        self.assertEqual(user, self.user)
+
+        local_tokens.clear()
+        with self.assertNumQueries(0):
+            self.auth.authenticate_credentials(self.token.key)
+
+    def test_cached_entry_holds_no_credentials(self):
+        """Test the shared cache gets the user's flags, not their password"""
+        self.auth.authenticate_credentials(self.token.key)
+        digest = hashlib.sha256(self.token.key.encode()).hexdigest()
+        entry = cache.get(TOKEN_KEY.format(digest=digest))
+        self.assertNotIn(self.user.password, repr(entry))
+
+        local_tokens.clear()
+        user, token = self.auth.authenticate_credentials(self.token.key)
+        flags = (user.pk, user.is_active, user.is_staff, user.is_superuser)
+        self.assertEqual(flags, (self.user.pk, True, False, False))
+        self.assertEqual(token.created, self.token.created)
+        with self.assertNumQueries(1):
+            self.assertEqual(user.email, self.user.email)
+
+    def test_password_change_drops_cached_token(self):
+        """Test changing the password forces the next lookup to the DB"""
+        self.auth.authenticate_credentials(self.token.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.set_password('newpass123')
+            self.user.save()
+
+        with self.assertNumQueries(1):
+            self.auth.authenticate_credentials(self.token.key)
+
+    def test_requests_get_their_own_user(self):
+        """Test a request changing its user does not alter the cached one"""
+        first, _ = self.auth.authenticate_credentials(self.token.key)
+        first.name = 'Changed in one request'
+
+        second, token = self.auth.authenticate_credentials(self.token.key)
+        self.assertIsNot(second, first)
+        self.assertEqual(second.name, self.user.name)
+        self.assertIs(token.user, second)
+
+    def test_user_change_drops_cached_token(self):
+        """Test any user change but a login refreshes the cached user"""
+        self.auth.authenticate_credentials(self.token.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            update_last_login(None, self.user)
+        with self.assertNumQueries(0):
+            self.auth.authenticate_credentials(self.token.key)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_staff = True
+            self.user.save()
+        with self.assertNumQueries(1):
+            user, _ = self.auth.authenticate_credentials(self.token.key)
+        self.assertTrue(user.is_staff)
+
+    def test_deactivated_user_rejected(self):
+        """Test deactivating a user revokes their cached token at once"""
+        self.auth.authenticate_credentials(self.token.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+
+    def test_deleted_token_and_user_rejected(self):
+        """Test deleting the token or its user revokes the cached token"""
+        key = self.token.key
+        self.auth.authenticate_credentials(key)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.token.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(key)
+
+        token = Token.objects.create(user=self.user)
+        self.auth.authenticate_credentials(token.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(token.key)
+
+
+class LoginRateLimitTests(TestCase):
+    """Test password attempts are rate limited before hashing"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        create_user(email='test@example.com', password='goodpass')
+
+    @override_settings(LOGIN_RATE_LIMITS={'email': (2, 60)})
+    def test_token_attempts_limited_per_email(self):
+        """Test attempts over the email limit get 429 without authenticating"""
+        payload = {'email': 'test@example.com', 'password': 'badpass'}
+        with patch('user.api.serializers.authenticate',
+                   return_value=None) as auth:
+            codes = [self.client.post(TOKEN_URL, payload).status_code
+                     for _ in range(3)]
+            other = self.client.post(TOKEN_URL, {'email': 'other@example.com',
+                                                 'password': 'badpass'})
+
+        self.assertEqual(codes, [status.HTTP_400_BAD_REQUEST] * 2
+                         + [status.HTTP_429_TOO_MANY_REQUESTS])
+        self.assertEqual(other.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(auth.call_count, 3)
+        self.assertEqual(rejected_counts(), {'email': 1})
+
+    @override_settings(LOGIN_RATE_LIMITS={'ip': (1, 60)})
+    def test_login_attempts_limited_per_ip(self):
+        """Test the login view rejects an IP over its limit"""
+        res = self.client.post(LOGIN_URL, {'username': 'a@example.com',
+                                           'password': 'x'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = self.client.post(LOGIN_URL, {'username': 'b@example.com',
+                                           'password': 'x'})
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', res)
+        self.assertEqual(rejected_counts(), {'ip': 1})
+
+    @override_settings(LOGIN_RATE_LIMITS={'ip': (1, 60)})
+    def test_forwarded_for_not_trusted(self):
+        """Test a made-up X-Forwarded-For does not reset the IP limit"""
+        payload = {'username': 'a@example.com', 'password': 'x'}
+        self.client.post(LOGIN_URL, payload, HTTP_X_FORWARDED_FOR='10.0.0.1')
+        res = self.client.post(LOGIN_URL, payload,
+                               HTTP_X_FORWARDED_FOR='10.0.0.2')
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_login_rejects_non_string_credentials(self):
+        """Test a username that is not a string is a 400, not a 500"""
+        res = self.client.post(LOGIN_URL, {'username': ['a@example.com'],
+                                           'password': 'x'}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
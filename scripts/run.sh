@@ -1,11 +1,21 @@
-#/bin/sh
+#!/bin/sh
 
 set -e
 
 python manage.py wait_for_db
+# Refuses settings that only work in a single process (core.checks).
+python manage.py check --deploy
 python manage.py collectstatic --noinput
 python manage.py migrate
 
+# Sample files left by the workers of a previous run would be summed in.
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+    rm -f "$PROMETHEUS_MULTIPROC_DIR"/*.db
+fi
+
 # uwsgi --socket :9000 --workers 4 --master --enable-threads --module app.wsgi
+exec uwsgi --http :8000 --workers 2 --master --enable-threads --max-requests 500 \
+    --module app.wsgi:application
 
 # exec gunicorn -b :$PORT myproject.wsgi:application
\ No newline at end of file